@@ -0,0 +1,351 @@
+"""
+Benchmarks for the hot paths of every collector.
+
+Each benchmark drives a real entry point on deterministic synthetic data (or on recorded
+responses replayed by helpers/replay_server.py) at several scales of pods, samples, and runs,
+and reports wall time, peak memory (tracemalloc), and how many queries were sent.
+
+Run from the repo's root directory:
+    python benchmarks/run_benchmarks.py                      # small and medium scales
+    python benchmarks/run_benchmarks.py --scales large       # only the large scale
+    python benchmarks/run_benchmarks.py --save-baseline      # save results as the new baseline
+    python benchmarks/run_benchmarks.py --fixtures fixtures  # replay recorded responses
+
+Results are compared with benchmarks/baselines.json (if it exists). Anything slower or using more
+memory than the baseline by more than the regression threshold, or sending more queries, is
+flagged and the script exits with status 1.
+"""
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+import contextlib
+from typing import Callable
+import pandas as pd
+from termcolor import colored
+# get set up to be able to import from the repo's root directory and the collectors' directories
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+sys.path.append(os.path.join(parent, "training_data_collection"))
+sys.path.append(os.path.join(parent, "general_td_collection"))
+sys.path.append(os.path.join(parent, "ndp_integration"))
+# pylint: disable=wrong-import-position
+import synthetic
+from graphs import Graphs
+from tables import Tables
+from helpers.querying import QueryClient, set_query_client
+from helpers.replay_server import ReplayServer
+
+BASELINE_FILE = os.path.join(current, "baselines.json")
+# a benchmark is flagged if it is this much (0.2 = 20%) slower or uses this much more memory
+REGRESSION_THRESHOLD = 0.2
+# how many times to time each benchmark. The fastest time is reported
+REPEATS = 3
+SCALES = {
+    "small": {"pods": 20, "samples": 60, "runs": 20},
+    "medium": {"pods": 200, "samples": 360, "runs": 100},
+    "large": {"pods": 1000, "samples": 1440, "runs": 500},
+}
+# number of duration columns (duration_t1, duration_t2, ...) phase 4 is benchmarked with
+NUM_DURATION_COLS = 2
+
+
+# ==============================
+#          Benchmarks
+# ==============================
+# each benchmark is given a scale and a BenchmarkContext, and returns a function that takes no
+# arguments and runs the code being measured. Setting up data is not part of the measurement
+
+def _bench_get_graphs_dict(scale: dict, context: "BenchmarkContext") -> Callable:
+    context.use_replay_server(scale)
+    graphs_class = Graphs()
+    return lambda: graphs_class.get_graphs_dict(display_time_as_datetime=True)
+
+
+def _bench_get_tables_dict(scale: dict, context: "BenchmarkContext") -> Callable:
+    context.use_replay_server(scale)
+    # multiplexed table queries have to come back in one round trip, not from the fallback of
+    # sending every query separately
+    if Tables().multiplex_queries and context.fixture_dir is None:
+        queries_before = context.get_num_queries()
+        _run_quietly(Tables().get_tables_dict)
+        num_queries = context.get_num_queries() - queries_before
+        if num_queries != 1:
+            raise AssertionError(f"multiplexed get_tables_dict() sent {num_queries} queries instead of 1")
+    # Tables keeps tables it already filled in, so use a new one every time
+    return lambda: Tables().get_tables_dict()
+
+
+def _bench_check_for_losses(scale: dict, context: "BenchmarkContext") -> Callable:
+    graph_titles = list(Graphs().queries)[:2]
+    graphs_dict = synthetic.get_graphs_dict(graph_titles, scale["pods"], scale["samples"])
+    graphs_class = Graphs()
+    return lambda: graphs_class.check_for_losses(graphs_dict=graphs_dict, drop_threshold=5)
+
+
+def _bench_check_for_losses_one_df(scale: dict, context: "BenchmarkContext") -> Callable:
+    graph_titles = list(Graphs().queries)[:2]
+    graphs_dict = synthetic.get_graphs_dict(graph_titles, scale["pods"], scale["samples"])
+    graphs_class = Graphs()
+    graphs_df = graphs_class.get_graphs_as_one_df(graphs_dict=graphs_dict)
+    # the graphs as one df have to give the same losses as the graphs dict they came from
+    expected_losses = graphs_class.check_for_losses(graphs_dict=graphs_dict, drop_threshold=5)
+    if graphs_class.check_for_losses(graphs_dict=graphs_df, drop_threshold=5) != expected_losses:
+        raise AssertionError("check_for_losses() of the graphs as one df differs from the graphs dict")
+    return lambda: graphs_class.check_for_losses(graphs_dict=graphs_df, drop_threshold=5)
+
+
+def _bench_finalizer_sum_df(scale: dict, context: "BenchmarkContext") -> Callable:
+    # pylint: disable=import-outside-toplevel
+    from finalizing import Finalizer
+    df = synthetic.get_finalizer_df(scale["runs"], scale["pods"], scale["samples"])
+    finalizer = Finalizer(graph_metrics=["mean", "max", "increase", "iqr"], display_warnings=False)
+    return lambda: finalizer.sum_df(df.copy())
+
+
+def _bench_phase_4_update_columns(scale: dict, context: "BenchmarkContext") -> Callable:
+    # phase 4 reads csvs/phase_1_read.csv and txts/num_duration_cols.txt from the working directory
+    work_dir = context.get_phase_4_dir()
+    with _working_dir(work_dir):
+        # pylint: disable=import-outside-toplevel
+        from phase_4 import Phase_4
+        phase_4 = Phase_4()
+        ensembles_df, queried_df = synthetic.get_phase_4_dfs(
+            scale["runs"], scale["pods"], phase_4.all_col_names)
+        ensembles_df.to_csv(os.path.join("csvs", "phase_1_read.csv"), index=False)
+
+    def run() -> pd.DataFrame:
+        with _working_dir(work_dir):
+            return phase_4._update_queried_cols(queried_df.copy())
+    return run
+
+
+def _bench_find_runs_get_runs_df(scale: dict, context: "BenchmarkContext") -> Callable:
+    # pylint: disable=import-outside-toplevel
+    import find_runs
+    runs_per_pod = max(1, scale["runs"] // 10)
+    fine_periods_df = synthetic.get_fine_periods_df(
+        scale["pods"], runs_per_pod, samples_per_run=scale["samples"] // 10)
+    # pylint: disable=protected-access
+    return lambda: find_runs._get_runs_df(
+        fine_periods_df, queried_timestep="10m", minimum_break="1h")
+
+
+BENCHMARKS = {
+    "graphs.get_graphs_dict": _bench_get_graphs_dict,
+    "tables.get_tables_dict": _bench_get_tables_dict,
+    "graphs.check_for_losses": _bench_check_for_losses,
+    "graphs.check_for_losses_one_df": _bench_check_for_losses_one_df,
+    "finalizer.sum_df": _bench_finalizer_sum_df,
+    "phase_4.update_columns": _bench_phase_4_update_columns,
+    "find_runs.get_runs_df": _bench_find_runs_get_runs_df,
+}
+
+
+# ==============================
+#           Harness
+# ==============================
+
+class BenchmarkContext():
+    """Temporary files and the replay server shared by the benchmarks
+
+    If fixture_dir is given, the replay server serves those recorded responses. Otherwise
+    synthetic responses are generated for every graph and table query at each scale.
+    """
+
+    def __init__(self, fixture_dir: str | None = None) -> None:
+        self.fixture_dir = fixture_dir
+        self.temp_dir = tempfile.mkdtemp(prefix="benchmarks_")
+        self.server = None
+        self._server_scale = None
+
+    # point the query layer at a replay server for the given scale (with no query cache)
+    def use_replay_server(self, scale: dict) -> None:
+        if self.server is not None and self._server_scale == scale:
+            return
+        self._stop_server()
+        fixture_dir = self.fixture_dir
+        if fixture_dir is None:
+            fixture_dir = os.path.join(self.temp_dir, f"fixtures_{scale['pods']}_{scale['samples']}")
+            self._write_synthetic_fixtures(fixture_dir, scale)
+        self.server = ReplayServer(fixture_dir, port=0)
+        set_query_client(QueryClient(base_url=self.server.start(), cache=None))
+        self._server_scale = scale
+
+    # returns how many queries the replay server has received so far
+    def get_num_queries(self) -> int:
+        if self.server is None:
+            return 0
+        return self.server.get_stats()["requests"]
+
+    # returns a directory set up to run phase 4 in
+    def get_phase_4_dir(self) -> str:
+        work_dir = os.path.join(self.temp_dir, "phase_4")
+        os.makedirs(os.path.join(work_dir, "csvs"), exist_ok=True)
+        os.makedirs(os.path.join(work_dir, "txts"), exist_ok=True)
+        with open(os.path.join(work_dir, "txts", "num_duration_cols.txt"), "w", encoding="utf-8") as file:
+            file.write(str(NUM_DURATION_COLS))
+        return work_dir
+
+    def close(self) -> None:
+        self._stop_server()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def _stop_server(self) -> None:
+        if self.server is not None:
+            self.server.stop()
+            self.server = None
+
+    def _write_synthetic_fixtures(self, fixture_dir: str, scale: dict) -> None:
+        graphs_class = Graphs()
+        tables_class = Tables()
+        range_queries = list(graphs_class.queries.values())
+        for query_pair in graphs_class.partial_queries.values():
+            range_queries += query_pair
+        instant_queries = list(tables_class.queries.values()) + \
+            list(tables_class.partial_queries.values())
+        synthetic.write_fixtures(
+            fixture_dir, {"query_range": range_queries, "query": instant_queries},
+            num_pods=scale["pods"], num_samples=scale["samples"],
+            multiplexed_queries=tables_class.get_queries_to_send())
+
+
+# temporarily change the working directory
+@contextlib.contextmanager
+def _working_dir(path: str):
+    previous_dir = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous_dir)
+
+
+# run func without printing anything (progress bars, tables, etc.)
+def _run_quietly(func: Callable) -> None:
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        func()
+
+
+# given a benchmark and a scale, return its fastest wall time (seconds), peak memory (MB),
+# and how many queries one run of it sends
+def measure(benchmark: Callable, scale: dict, context: BenchmarkContext, repeats: int = REPEATS) -> dict[str, float]:
+    wall_times = []
+    num_queries = 0
+    for _ in range(repeats):
+        func = benchmark(scale, context)
+        queries_before = context.get_num_queries()
+        start = time.perf_counter()
+        _run_quietly(func)
+        wall_times.append(time.perf_counter() - start)
+        num_queries = context.get_num_queries() - queries_before
+
+    # measure memory separately since tracemalloc slows everything down
+    func = benchmark(scale, context)
+    tracemalloc.start()
+    try:
+        _run_quietly(func)
+        _, peak_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "wall_sec": round(min(wall_times), 4),
+        "peak_mb": round(peak_bytes / 2**20, 3),
+        "queries": num_queries
+    }
+
+
+# given results and baselines ({"benchmark[scale]": measurements}), return a list of the
+# regressions found for each result
+def find_regressions(results: dict[str, dict], baselines: dict[str, dict],
+                     threshold: float = REGRESSION_THRESHOLD) -> dict[str, list[str]]:
+    regressions = {}
+    for key, result in results.items():
+        baseline = baselines.get(key)
+        if baseline is None:
+            continue
+        found = []
+        for measurement in ("wall_sec", "peak_mb"):
+            if baseline[measurement] > 0 and result[measurement] > baseline[measurement] * (1 + threshold):
+                change = result[measurement] / baseline[measurement] - 1
+                found.append(f"{measurement} +{change:.0%}")
+        if result["queries"] > baseline["queries"]:
+            found.append(f"queries {baseline['queries']} -> {result['queries']}")
+        if len(found) > 0:
+            regressions[key] = found
+    return regressions
+
+
+def _read_baselines() -> dict[str, dict]:
+    if not os.path.exists(BASELINE_FILE):
+        return {}
+    with open(BASELINE_FILE, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def _save_baselines(results: dict[str, dict]) -> None:
+    baselines = _read_baselines()
+    baselines.update(results)
+    with open(BASELINE_FILE, "w", encoding="utf-8") as file:
+        json.dump(baselines, file, indent=4, sort_keys=True)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the collectors' hot paths")
+    parser.add_argument("--scales", nargs="+", choices=list(SCALES), default=["small", "medium"])
+    parser.add_argument("--benchmarks", nargs="+", choices=list(BENCHMARKS), default=list(BENCHMARKS))
+    parser.add_argument("--repeats", type=int, default=REPEATS)
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                        help="fraction slower/bigger than the baseline that counts as a regression")
+    parser.add_argument("--fixtures", default=None,
+                        help="directory of recorded responses to replay instead of synthetic data")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="save these results as the new baseline")
+    args = parser.parse_args()
+
+    context = BenchmarkContext(fixture_dir=args.fixtures)
+    results = {}
+    try:
+        for scale_name in args.scales:
+            for benchmark_name in args.benchmarks:
+                key = f"{benchmark_name}[{scale_name}]"
+                print(f"running {key}", flush=True)
+                results[key] = measure(
+                    BENCHMARKS[benchmark_name], SCALES[scale_name], context, repeats=args.repeats)
+    finally:
+        context.close()
+
+    baselines = _read_baselines()
+    regressions = find_regressions(results, baselines, threshold=args.threshold)
+
+    rows = []
+    for key, result in results.items():
+        baseline = baselines.get(key, {})
+        rows.append({
+            "benchmark": key,
+            **result,
+            "baseline_sec": baseline.get("wall_sec"),
+            "regressions": ", ".join(regressions.get(key, []))
+        })
+    print()
+    print(pd.DataFrame(rows).to_string(index=False))
+
+    if args.save_baseline:
+        _save_baselines(results)
+        print(colored(f"\nSaved baseline to {BASELINE_FILE}", "green"))
+        return 0
+    if len(regressions) > 0:
+        print(colored(f"\n{len(regressions)} benchmark(s) regressed by more than {args.threshold:.0%}", "red"))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,155 @@
+"""
+Deterministic synthetic data for the benchmarks.
+
+Every generator is seeded, so the same scale always produces exactly the same data.
+"""
+import random
+from uuid import UUID
+from datetime import datetime, timedelta
+import pandas as pd
+from helpers.recording import QueryRecorder
+from helpers.multiplexing import MUX_LABEL, plan_multiplexed_queries
+
+# every synthetic graph starts at the same time so benchmarks are repeatable
+START_TIME = 1_700_000_000
+STEP_SECONDS = 60
+
+
+# given a number of pods, return a list of (node, pod) pairs. Most pods are bp3d workers
+def get_pods(num_pods: int, seed: int = 0) -> list[tuple[str, str]]:
+    rng = random.Random(seed)
+    pods = []
+    for i in range(num_pods):
+        node = f"node-{i % max(1, num_pods // 8)}"
+        if i % 10 == 9:
+            pod = f"fc-worker-1-{rng.getrandbits(32):08x}"
+        else:
+            worker_id = UUID(int=rng.getrandbits(128)).hex
+            pod = f"bp3d-worker-k8s-{worker_id}-{rng.getrandbits(16):04x}"
+        pods.append((node, pod))
+    return pods
+
+
+# return a range query result list with num_samples samples for every pod.
+# Every pod drops to 0 for a few samples a third of the way through and recovers afterwards
+def get_matrix_result(pods: list[tuple[str, str]], num_samples: int, seed: int = 0) -> list[dict]:
+    rng = random.Random(seed)
+    drop_start = num_samples // 3
+    drop_end = drop_start + max(1, num_samples // 20)
+    result_list = []
+    for node, pod in pods:
+        base = rng.uniform(1, 100)
+        values = []
+        for i in range(num_samples):
+            value = 0 if drop_start <= i < drop_end else base + rng.uniform(-1, 1)
+            values.append([START_TIME + i * STEP_SECONDS, str(value)])
+        result_list.append({"metric": {"node": node, "pod": pod}, "values": values})
+    return result_list
+
+
+# return an instant query result list with one value for every pod
+def get_vector_result(pods: list[tuple[str, str]], seed: int = 0) -> list[dict]:
+    rng = random.Random(seed)
+    return [
+        {"metric": {"node": node, "pod": pod}, "value": [START_TIME, str(rng.uniform(0, 100))]}
+        for node, pod in pods
+    ]
+
+
+# save a fixture for every query in queries_by_endpoint ({"query" or "query_range": [queries]})
+# to fixture_dir for the replay server to serve. If multiplexed_queries ({title: instant query}) is
+# given, a fixture is also saved for every combined query query_multiplexed() sends for them, with
+# the same series as the queries' own fixtures
+def write_fixtures(fixture_dir: str, queries_by_endpoint: dict[str, list[str]], num_pods: int,
+                   num_samples: int, multiplexed_queries: dict[str, str] | None = None) -> None:
+    recorder = QueryRecorder(fixture_dir)
+    pods = get_pods(num_pods)
+    vector_results = {}
+    for endpoint, queries in queries_by_endpoint.items():
+        for seed, query in enumerate(queries):
+            if endpoint == "query_range":
+                result_type = "matrix"
+                result_list = get_matrix_result(pods, num_samples, seed=seed)
+            else:
+                result_type = "vector"
+                result_list = vector_results.setdefault(query, get_vector_result(pods, seed=seed))
+            response = {"status": "success", "data": {"resultType": result_type, "result": result_list}}
+            recorder.record(endpoint, {"query": query}, response, recorded_at=START_TIME)
+
+    for titles, combined_query in plan_multiplexed_queries(multiplexed_queries or {}):
+        result_list = []
+        for i, title in enumerate(titles):
+            query = multiplexed_queries[title]
+            for series in vector_results.get(query) or get_vector_result(pods, seed=len(vector_results) + i):
+                result_list.append(dict(series, metric={**series["metric"], MUX_LABEL: str(i)}))
+        response = {"status": "success", "data": {"resultType": "vector", "result": result_list}}
+        recorder.record("query", {"query": combined_query}, response, recorded_at=START_TIME)
+
+
+# return a graphs_dict like Graphs.get_graphs_dict(display_time_as_datetime=True) returns
+def get_graphs_dict(graph_titles: list[str], num_pods: int, num_samples: int) -> dict[str, pd.DataFrame]:
+    pods = get_pods(num_pods)
+    graphs_dict = {}
+    for seed, title in enumerate(graph_titles):
+        rows = []
+        for series in get_matrix_result(pods, num_samples, seed=seed):
+            for time, value in series["values"]:
+                rows.append((time, series["metric"]["node"], series["metric"]["pod"], float(value)))
+        graph_df = pd.DataFrame(rows, columns=["Time", "Node", "Pod", title])
+        graph_df["Time"] = pd.to_datetime(graph_df["Time"], unit="s")
+        graphs_dict[title] = graph_df
+    return graphs_dict
+
+
+# return a df like the one general_td_collection reads back from its queried csv: one row per run
+# with queried_ (instant query result lists), graph_ and static_ (lists of graph values) columns
+def get_finalizer_df(num_runs: int, num_pods: int, num_samples: int) -> pd.DataFrame:
+    rng = random.Random(0)
+    pods = get_pods(num_pods)
+    rows = []
+    for run in range(num_runs):
+        start = datetime.fromtimestamp(START_TIME) + timedelta(hours=run)
+        row = {
+            "start": start,
+            "end": start + timedelta(seconds=num_samples * STEP_SECONDS),
+            "queried_cpu_usage": str(get_vector_result(pods, seed=run)),
+            "queried_mem_usage": str(get_vector_result(pods, seed=run + 1)),
+        }
+        for title in ("cpu_usage", "mem_usage", "network_receive"):
+            row["graph_" + title] = str([rng.uniform(0, 100) for _ in range(num_samples)])
+        row["static_cpu_request"] = str([float(rng.randint(1, 8))] * num_samples)
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+# return (ensembles_df, queried_df) like phase 4 reads: ensembles_df is the phase 1 file with an
+# ensemble_uuid column, queried_df has one row per run with a result list in every queried column
+def get_phase_4_dfs(num_runs: int, num_pods: int, col_names: list[str]) -> tuple[pd.DataFrame, pd.DataFrame]:
+    pods = get_pods(num_pods)
+    worker_pods = [(node, pod) for node, pod in pods if pod.startswith("bp3d-worker-k8s-")]
+    ensembles = [str(UUID(pod.split("-")[3])) for _, pod in worker_pods]
+    ensembles_df = pd.DataFrame({"ensemble_uuid": ensembles})
+
+    rows = []
+    for run in range(num_runs):
+        row = {"ensemble_uuid": ensembles[run % len(ensembles)], "start": run, "stop": run + 1}
+        for col_seed, col_name in enumerate(col_names):
+            row[col_name] = str(get_vector_result(pods, seed=run * len(col_names) + col_seed))
+        rows.append(row)
+    return ensembles_df, pd.DataFrame(rows)
+
+
+# return a df like find_runs._find_fine_periods returns: a pod column and a time column with one
+# row for every active timestep. Each pod has num_runs runs separated by breaks of a few hours
+def get_fine_periods_df(num_pods: int, num_runs: int, samples_per_run: int, step_seconds: int = 600) -> pd.DataFrame:
+    rng = random.Random(0)
+    rows = []
+    for _, pod in get_pods(num_pods):
+        time = START_TIME
+        for _ in range(num_runs):
+            for _ in range(samples_per_run):
+                rows.append((pod, time))
+                time += step_seconds
+            # break between runs, longer than a 1h minimum break
+            time += rng.randint(2, 6) * 3600
+    return pd.DataFrame(rows, columns=["pod", "time"])
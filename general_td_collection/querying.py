@@ -13,7 +13,7 @@ current = os.path.dirname(os.path.realpath(__file__))
 parent = os.path.dirname(current)
 sys.path.append(parent)
 # pylint: disable=wrong-import-position
-from helpers.time_functions import calculate_offset, delta_to_time_str, datetime_ify
+from helpers.time_functions import calculate_eval_time, delta_to_time_str, datetime_ify
 from helpers.querying import query_data
 from graphs import Graphs
 # autopep8: on
@@ -290,23 +290,23 @@ class QueryHandler():
         start = datetime_ify(start)
         end = datetime_ify(end)
         duration_seconds = int((end-start).total_seconds())
-        offset = calculate_offset(start, duration_seconds)
+        eval_time = calculate_eval_time(start, duration_seconds)
         duration = delta_to_time_str(timedelta(seconds=duration_seconds))
 
         # all resources and the heart of their queries
         queries = {
             # non static metrics
-            'mem_usage': 'sum(max_over_time(container_memory_working_set_bytes{' + self._filter + '}[' + duration + '] offset ' + offset + '))',
+            'mem_usage': 'sum(max_over_time(container_memory_working_set_bytes{' + self._filter + '}[' + duration + '] @ ' + eval_time + '))',
 
-            'cpu_usage': 'sum(increase(container_cpu_usage_seconds_total{' + self._filter + '}[' + duration + '] offset ' + offset + '))',
+            'cpu_usage': 'sum(increase(container_cpu_usage_seconds_total{' + self._filter + '}[' + duration + '] @ ' + eval_time + '))',
 
-            'transmitted_packets': 'sum(increase(container_network_transmit_packets_total{' + self._filter + '}[' + duration + '] offset ' + offset + '))',
+            'transmitted_packets': 'sum(increase(container_network_transmit_packets_total{' + self._filter + '}[' + duration + '] @ ' + eval_time + '))',
 
-            'received_packets': 'sum(increase(container_network_receive_packets_total{' + self._filter + '}[' + duration + '] offset ' + offset + '))',
+            'received_packets': 'sum(increase(container_network_receive_packets_total{' + self._filter + '}[' + duration + '] @ ' + eval_time + '))',
 
-            'transmitted_bandwidth': 'sum(increase(container_network_transmit_bytes_total{' + self._filter + '}[' + duration + '] offset ' + offset + '))',
+            'transmitted_bandwidth': 'sum(increase(container_network_transmit_bytes_total{' + self._filter + '}[' + duration + '] @ ' + eval_time + '))',
 
-            'received_bandwidth': 'sum(increase(container_network_receive_bytes_total{' + self._filter + '}[' + duration + '] offset ' + offset + '))'
+            'received_bandwidth': 'sum(increase(container_network_receive_bytes_total{' + self._filter + '}[' + duration + '] @ ' + eval_time + '))'
         }
 
         return queries
@@ -366,7 +366,7 @@ class QueryHandler():
         data_dict = {}
         for query_retrieval_func in tqdm(query_retrieval_funcs_list):
             queries = query_retrieval_func(row['start'], row['end'])
-            data_dict.update({title: query_data(query)
+            data_dict.update({title: query_data(query, title=title)
                               for title, query in queries.items()})
         # prepend a string for finalizing.py to know that the column needs to be summed
         for title, data in data_dict.items():
@@ -31,6 +31,7 @@ import pandas as pd
 from setup import prompt_new_run
 from querying import QueryHandler
 from finalizing import Finalizer
+from helpers.telemetry import telemetry_stage
 # autopep8: on
 
 # display settings
@@ -74,13 +75,14 @@ if test_subset:
     print("\n\n\nStarting df:\n", df, "\n\n\n\n")
 
 # Main workflow
-df = query_handler.query_df(
-    df,  # pandas dataframe containing 'start' and 'end' columns
-    rgw_queries=False,  # rgw queue, cache, and gets/puts metrics
-    gpu_queries=False,  # total gpu usage and requested gpus
-    gpu_compute_resource_queries=False,  # gpu utilization and physical metrics
-    cpu_compute_resource_queries=True  # cpu, memory, and network metrics
-)
+with telemetry_stage("query_df"):
+    df = query_handler.query_df(
+        df,  # pandas dataframe containing 'start' and 'end' columns
+        rgw_queries=False,  # rgw queue, cache, and gets/puts metrics
+        gpu_queries=False,  # total gpu usage and requested gpus
+        gpu_compute_resource_queries=False,  # gpu utilization and physical metrics
+        cpu_compute_resource_queries=True  # cpu, memory, and network metrics
+    )
 df = finalizer.sum_df(
     df, graph_metrics=['min', 'max', 'mean', 'median', 'increase'])
     # graph_metrics describe the data for graph-based queries. Choose the metrics you want
@@ -5,9 +5,10 @@ import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 from termcolor import colored
 from graphs import Graphs
+from helpers.series_set import SeriesSet
 
 
-# given a sum_by list, return a dict of graphs by title: graph
+# given a sum_by list, return a dict of graphs by title: graph. Each graph is only queried when it is first accessed
 def get_graphs_dict(sum_by: list[str] | None = "_") -> dict[pd.DataFrame]:
     # set ['node', 'pod'] as default for sum_by without putting dangerous default list in definition
     if sum_by == "_":
@@ -24,7 +25,9 @@ def get_graphs_dict(sum_by: list[str] | None = "_") -> dict[pd.DataFrame]:
         # keep as False. Important for calculating the time and displaying it
         display_time_as_datetime=False,
         # for displaying in the terminal how long each query and graph creation takes
-        show_runtimes=False
+        show_runtimes=False,
+        # only query each graph when it is displayed, so closing the program early skips the rest
+        lazy=True
     )
     return graphs_dict
 
@@ -59,7 +62,8 @@ def hue_col_from_sum_by(sum_by: list[str]) -> str | None:
 
 # display graphs one at a time in a popup window. After closing one, the next one opens
 # Note: if graphs do not have a pod column, change sum_by to be the string or list of strings that graphs are summed by (instead of pod)
-def display_graphs(graphs_dict: dict[pd.DataFrame] | None = None, sum_by: list['str'] | str | None = "_") -> None:
+# graphs can be dataframes or SeriesSets (see helpers/series_set.py)
+def display_graphs(graphs_dict: dict[pd.DataFrame | SeriesSet] | None = None, sum_by: list['str'] | str | None = "_") -> None:
     # set ['node', 'pod'] as default for sum_by without putting dangerous default list in definition
     if sum_by == "_":
         sum_by = ["node", "pod"]
@@ -79,7 +83,10 @@ def display_graphs(graphs_dict: dict[pd.DataFrame] | None = None, sum_by: list['
             continue
 
         # show time as datetimes instead of seconds since epoch(01-01-1970)
-        graph_df['Time'] = pd.to_datetime(graph_df['Time'], unit="s")
+        if isinstance(graph_df, SeriesSet):
+            graph_df = graph_df.to_long_df(time_as_datetime=True, categorical_labels=True)
+        else:
+            graph_df['Time'] = pd.to_datetime(graph_df['Time'], unit="s")
 
         # Set graph styling and labels.
         if hue_column is not None:
@@ -1,17 +1,27 @@
 #!/usr/bin/python3
 # -*- coding: utf-8 -*-
+import re
 import time
+from concurrent.futures import Executor
+from functools import partial
+import numpy as np
 import pandas as pd
 from datetime import datetime, timezone
 from tqdm import tqdm
 from termcolor import colored
-from helpers.querying import query_data_for_graph
+from helpers.querying import query_data_for_graph, get_query_telemetry
+from helpers.concurrency import run_concurrently, replace_failures
+from helpers.decoding import matrix_to_df
+from helpers.joining import join_on_labels
+from helpers.lazy_loading import LazyDict
+from helpers.series_set import SeriesSet
+from helpers.series_matrix import SeriesMatrix
 from helpers.printing import print_sub_title
-from helpers.filtering import filter_df_for_workers
+from helpers.filtering import filter_df_for_workers, filter_series_set_for_workers, add_worker_pod_matcher_to_queries
 from helpers.time_functions import (
     datetime_ify, delta_to_time_str, time_str_to_delta, find_time_from_offset)
 from inputs import (NAMESPACE, DEFAULT_FINAL_GRAPH_TIME, DEFAULT_DURATION,
-                    DEFAULT_GRAPH_TIME_OFFSET, DEFAULT_GRAPH_STEP, REQUERY_GRAPH_STEP_DIVISOR, 
+                    DEFAULT_GRAPH_TIME_OFFSET, DEFAULT_GRAPH_STEP, REQUERY_GRAPH_STEP_DIVISOR, REQUERY_MAX_PODS_PER_QUERY,
                     QUERY_TIMEOUT_SEC)
 
 
@@ -59,31 +69,64 @@ class Graphs():
     # ============================
 
     # generate and return a dictionary of all the graphs
-    def get_graphs_dict(self, only_include_worker_pods: bool = False, display_time_as_datetime: bool = True, show_runtimes: bool = False) -> dict[str, pd.DataFrame]:
-        graphs_dict = self._generate_graphs(show_runtimes=show_runtimes)
+    # if max_concurrency (or a shared executor) is given, all graph queries are sent at once
+    # if show_runtimes, a telemetry summary of the graph queries (slowest queries, latency per graph, etc.) is printed
+    # if only_include_worker_pods, only worker pods are queried (see get_queries())
+    # if start and end are given, the graphs cover that time range instead of the time_offset before self.end
+    # if lazy, a LazyDict is returned instead, where each graph is only queried the first time it is
+    # accessed. Its prefetch() queries a chosen set of graphs at once
+    # if as_series_sets, every graph is a SeriesSet (see helpers/series_set.py) instead of a dataframe,
+    # which uses much less memory for many pods. display_time_as_datetime doesn't apply to SeriesSets
+    # if use_cache is False, the query cache and series store are skipped (e.g. for live refreshes)
+    # if progress_bars is False, no progress bars are printed
+    def get_graphs_dict(self, only_include_worker_pods: bool = False, display_time_as_datetime: bool = True, show_runtimes: bool = False,
+                        max_concurrency: int | None = None, executor: Executor | None = None,
+                        start: datetime | None = None, end: datetime | None = None,
+                        lazy: bool = False, as_series_sets: bool = False, use_cache: bool = True,
+                        progress_bars: bool = True) -> dict[str, pd.DataFrame | SeriesSet] | LazyDict:
+        if lazy:
+            queries_dict, partial_queries_dict = self.get_queries(
+                only_include_worker_pods=only_include_worker_pods)
+            return LazyDict({
+                query_title: partial(self._generate_lazy_graph, query_title, queries_dict, partial_queries_dict,
+                                     only_include_worker_pods=only_include_worker_pods,
+                                     display_time_as_datetime=display_time_as_datetime, start=start, end=end,
+                                     as_series_sets=as_series_sets)
+                for query_title in list(queries_dict) + list(partial_queries_dict)
+            })
+
+        runtime_start = time.time()
+        graphs_dict = self._generate_graphs(
+            max_concurrency=max_concurrency, executor=executor,
+            only_include_worker_pods=only_include_worker_pods, start=start, end=end,
+            as_series_sets=as_series_sets, use_cache=use_cache, progress_bars=progress_bars)
+        if show_runtimes:
+            self._print_runtimes(since=runtime_start)
         # loop through graphs
         for graph_title, graph in graphs_dict.items():
-            if graph is None:
-                continue
-
-            # for every worker pod in graph, change pod's value to just be the worker id, drop all non-worker pods
-            if only_include_worker_pods:
-                graph = filter_df_for_workers(graph)
-
-            # update graphs with correct time columns
-            if display_time_as_datetime:
-                graph['Time'] = pd.to_datetime(graph['Time'], unit="s")
-
-            graphs_dict[graph_title] = graph
+            graphs_dict[graph_title] = self._finish_graph(
+                graph, only_include_worker_pods=only_include_worker_pods,
+                display_time_as_datetime=display_time_as_datetime)
 
         return graphs_dict
 
+    # returns the (queries, partial_queries) of the graphs. If only_include_worker_pods, every query
+    # only selects bp3d-worker pods, so the other pods in the namespace aren't sent back at all
+    def get_queries(self, only_include_worker_pods: bool = False) -> tuple[dict[str, str], dict[str, list[str]]]:
+        if only_include_worker_pods:
+            return (add_worker_pod_matcher_to_queries(self.queries),
+                    add_worker_pod_matcher_to_queries(self.partial_queries))
+        return self.queries, self.partial_queries
+
     # Given a dictionary of queries, generate graphs based on those queries
     # Note: if the queries do not start with "sum by(node, pod)", then you must set sum_by
     #       to be what the query has in "sum by(_____)""
     #       If queries do not have "sum by(...)", then set sum_by to None
     # Return a dictionary of graphs of the same names as the queries
-    def get_graphs_from_queries(self, queries_dict: dict[str, str], sum_by: list[str] | str | None = "_", start: datetime | None = None, end: datetime | None = None, time_step: str | None = None, display_time_as_datetime: bool = False, progress_bars: bool = True, as_one_df: bool = False) -> dict[str, pd.DataFrame] | pd.DataFrame:
+    # (or a LazyDict of graphs that are only queried when accessed if lazy, unless as_one_df)
+    def get_graphs_from_queries(self, queries_dict: dict[str, str], sum_by: list[str] | str | None = "_", start: datetime | None = None, end: datetime | None = None, time_step: str | None = None, display_time_as_datetime: bool = False, progress_bars: bool = True, as_one_df: bool = False,
+                                max_concurrency: int | None = None, executor: Executor | None = None,
+                                lazy: bool = False) -> dict[str, pd.DataFrame] | pd.DataFrame | LazyDict:
         # set ['node', 'pod'] as default for sum_by without putting dangerous default list in definition
         if sum_by == "_":
             sum_by = ["node", "pod"]
@@ -95,12 +138,30 @@ class Graphs():
             for i, metric in enumerate(sum_by):
                 sum_by[i] = metric.lower()
 
+        if lazy and not as_one_df:
+            return LazyDict({
+                title: partial(self._generate_lazy_graph_from_query, title, query, start=start, end=end,
+                               time_step=time_step, sum_by=sum_by, display_time_as_datetime=display_time_as_datetime)
+                for title, query in queries_dict.items()
+            })
+
         # generate graphs
         disable_bars = not progress_bars
         graphs_dict = {}
-        for title, query in tqdm(queries_dict.items(), disable=disable_bars):
-            graphs_dict[title] = self._generate_graph_df(
-                title, query, start=start, end=end, time_step=time_step, sum_by=sum_by)
+        if max_concurrency is None and executor is None:
+            for title, query in tqdm(queries_dict.items(), disable=disable_bars):
+                graphs_dict[title] = self._generate_graph_df(
+                    title, query, start=start, end=end, time_step=time_step, sum_by=sum_by)
+        else:
+            tasks = {
+                title: partial(self._generate_graph_df, title, query, start=start,
+                               end=end, time_step=time_step, sum_by=sum_by)
+                for title, query in queries_dict.items()
+            }
+            graphs_dict = run_concurrently(
+                tasks, max_concurrency=max_concurrency, executor=executor,
+                progress_bar=progress_bars and executor is None)
+            graphs_dict = replace_failures(graphs_dict, default=None)
 
         # update times to be datetimes if requested
         if display_time_as_datetime:
@@ -118,15 +179,13 @@ class Graphs():
 
     # combines all graph dataframes into one large dataframe. Each graph is represented as a column
     # this works because all graphs are queried for the same time frame and time step. They also have the same pods set
-    def get_graphs_as_one_df(self, graphs_dict: dict[str, pd.DataFrame] | None = None, sum_by: list[str] | str | None = "_") -> pd.DataFrame:
+    def get_graphs_as_one_df(self, graphs_dict: dict[str, pd.DataFrame | SeriesSet] | None = None, sum_by: list[str] | str | None = "_") -> pd.DataFrame:
         # set ['node', 'pod'] as default for sum_by without putting dangerous default list in definition
         if sum_by == "_":
             sum_by = ["node", "pod"]
         if isinstance(sum_by, str):
             sum_by = [sum_by]
 
-        total_df = pd.DataFrame(data={})
-
         # Handle invalid input
         if graphs_dict is None and sum_by != ['node', 'pod']:
             raise ValueError(
@@ -136,47 +195,67 @@ class Graphs():
         if graphs_dict is None:
             graphs_dict = self._generate_graphs()
 
-        # Fill in Time and sum_by (default: node, pod) columns with the first non-empty graph
-        for graph_df in graphs_dict.values():
-            if graph_df is not None:
-                # Insert Time column
-                total_df['Time'] = graph_df['Time']
-
-                if sum_by is None:
-                    break
-                # Handle if sum_by is single string
-                if isinstance(sum_by, str):
-                    sum_by = [sum_by]
-                # Insert sum_by columns into main graph
-                for metric in sum_by:
-                    metric_col = metric.title()
-                    total_df[metric_col] = graph_df[metric_col]
-                # once columns are inserted, break - start filling in df with graphs
-                break
-
-        # Fill in graphs columns
+        # graphs that are SeriesSets are exported to dataframes first
+        graphs_dict = {
+            title: graph.to_long_df() if isinstance(graph, SeriesSet) else graph
+            for title, graph in graphs_dict.items()
+        }
+
+        # join the graphs on their Time and sum_by (default: Node, Pod) columns, so rows are matched
+        # by their labels even if graphs have different pods or have them in a different order
+        keys = ['Time'] + ([metric.title() for metric in sum_by] if sum_by is not None else [])
+        total_df = join_on_labels(
+            [graph_df[keys + [title]] for title, graph_df in graphs_dict.items() if graph_df is not None],
+            keys=keys)
+
+        # graphs without data are columns of None
         for title, graph_df in graphs_dict.items():
             if graph_df is None:
                 total_df[title] = None
-                continue
-            total_df[title] = graph_df[title]
+        return total_df[keys + list(graphs_dict.keys())]
 
-        return total_df
+    # returns {title: SeriesMatrix} of every graph, for analytics across pods at every time (top k, percentiles,
+    # counts, rolling windows). Every matrix has the same time axis: a row per time_step from the first to the
+    # last sample of any graph. Graphs without data are None
+    def get_graph_matrices(self, graphs_dict: dict[str, pd.DataFrame | SeriesSet] | None = None) -> dict[str, SeriesMatrix | None]:
+        if graphs_dict is None:
+            graphs_dict = self._generate_graphs(as_series_sets=True)
+        series_sets = {
+            title: graph if isinstance(graph, SeriesSet) or graph is None else SeriesSet.from_df(graph, value_title=title)
+            for title, graph in graphs_dict.items()
+        }
+        times_ms = [series_set.times_ms for series_set in series_sets.values()
+                    if series_set is not None and series_set.num_samples > 0]
+        if len(times_ms) == 0:
+            return {title: None for title in series_sets}
+        start = datetime.fromtimestamp(min(times.min() for times in times_ms) / 1000)
+        end = datetime.fromtimestamp(max(times.max() for times in times_ms) / 1000)
+        return {
+            title: SeriesMatrix.from_series_set(series_set, step=self.time_step, start=start, end=end)
+            if series_set is not None else None
+            for title, series_set in series_sets.items()
+        }
 
     # convert a dataframe containing all graphs data into a dictionary with several graphs
     # used when a graphs_df is passed in instead of a graphs_dict in check_for_losses
     # this can happen when a user requests the graph data to be a single df, then passes
     # that df back in to check_for_losses
-    def convert_graphs_df_to_dict(self, graphs_df: pd.DataFrame) -> dict[str, pd.DataFrame]:
+    # if as_series_sets, every graph is a SeriesSet instead. They share one copy of the Time, Node,
+    # and Pod columns instead of each graph having its own
+    def convert_graphs_df_to_dict(self, graphs_df: pd.DataFrame, as_series_sets: bool = False) -> dict[str, pd.DataFrame | SeriesSet]:
         if not isinstance(graphs_df, pd.DataFrame):
             raise TypeError("Input must be a pandas DataFrame")
 
+        if as_series_sets:
+            value_titles = [column for column in graphs_df.columns if column not in ['Node', 'Pod', 'Time']]
+            return SeriesSet.from_df_columns(graphs_df, value_titles, label_columns=['Node', 'Pod'])
+
         graphs_dict = {}
         for col_title in graphs_df.columns:
             # create a new graph for each column with metric data
             metadata_columns = ['Node', 'Pod', 'Time']
             if col_title in metadata_columns:
-                pass
+                continue
             # assemble new graph df
             graph_data = {
                 'Time': graphs_df['Time'],
@@ -184,8 +263,10 @@ class Graphs():
                 'Pod': graphs_df['Pod'],
                 col_title: graphs_df[col_title]
             }
-            graph_df = pd.DataFrame(data=graph_data)
-            graphs_dict[col_title] = graph_df
+            # rows without a value are pods this graph had no sample for (filled in by the join in
+            # get_graphs_as_one_df()), so they are left out to get the graph's own rows back
+            graph_df = pd.DataFrame(data=graph_data).dropna(subset=[col_title])
+            graphs_dict[col_title] = graph_df.reset_index(drop=True)
 
         return graphs_dict
 
@@ -194,6 +275,21 @@ class Graphs():
         # set default values if not given
         if time_step is None:
             time_step = self.time_step
+        start, end = self._get_time_range(start=start, end=end)
+
+        # assemble strings
+        start_utc = start.astimezone(timezone.utc)
+        end_utc = end.astimezone(timezone.utc)
+        start_str = start_utc.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+        end_str = end_utc.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+        # combine strings into time filter format
+        time_filter = f'start={start_str}&end={end_str}&step={time_step}'
+
+        return time_filter
+
+    # returns the start and end of the time range as datetimes. If neither is given, the range
+    # is the time_offset before self.end
+    def _get_time_range(self, start: datetime | None = None, end: datetime | None = None) -> tuple[datetime, datetime]:
         if start is None and end is None:
             # calculate start time
             start = find_time_from_offset(
@@ -206,144 +302,196 @@ class Graphs():
             # make sure both start and end are datetime objects
             start = datetime_ify(start)
             end = datetime_ify(end)
-
-        # assemble strings
-        start_utc = start.astimezone(timezone.utc)
-        end_utc = end.astimezone(timezone.utc)
-        start_str = start_utc.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
-        end_str = end_utc.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
-        # combine strings into time filter format
-        time_filter = f'start={start_str}&end={end_str}&step={time_step}'
-
-        return time_filter
+        return start, end
 
     # returns a dataframe containing Time, node, pod, and value (value is titled something different for each graph)
     # returns none if there is no data
     # note: sum_by is a string or list of strings that must have the same items that queries start with in their "sum by(___, ___) (...)".
     # If sum_by is specified, the df won't contain node or pod cols it will contain the sum_by cols
     # this is only used by get_graphs_from_queries
-    def _generate_graph_df(self, query_title: str, query: str, start=None, end=None, time_step: str | None = None, sum_by: list[str] | str | None = "_", show_runtimes: bool = False) -> pd.DataFrame:
+    # if as_series_set, a SeriesSet of the graph's series is returned instead of a dataframe
+    # use_cache is passed on to query_data_for_graph()
+    def _generate_graph_df(self, query_title: str, query: str, start=None, end=None, time_step: str | None = None, sum_by: list[str] | str | None = "_",
+                           as_series_set: bool = False, use_cache: bool = True) -> pd.DataFrame | SeriesSet:
         # set ['node', 'pod'] as default for sum_by without putting dangerous default list in definition
         if sum_by == "_":
             sum_by = ["node", "pod"]
         if isinstance(sum_by, str):
             sum_by = [sum_by]
+
         # create time filter to then generate list of all datapoints for the graph
         time_filter = self._assemble_time_filter(
             start=start, end=end, time_step=time_step)
 
-        if show_runtimes:
-            runtime_start = time.time()
-
-        # query for data
-        result_list = query_data_for_graph(query, time_filter, timeout_sec=self.query_timeout_seconds)
+        # query for data (the query client splits long time ranges into several queries)
+        result_list = query_data_for_graph(
+            query, time_filter, timeout_sec=self.query_timeout_seconds, use_cache=use_cache, title=query_title)
         if len(result_list) == 0:
             return None
+        if as_series_set:
+            return SeriesSet.from_result_list(
+                result_list, query_title, label_names=sum_by if sum_by is not None else [])
 
-        if show_runtimes:
-            runtime_end = time.time()
-            print("\ntime elapsed for querying:", colored(
-                runtime_end-runtime_start, "green"))
-
-        # prepare columns to be put into graph.
-        times_column = []
-        values_column = []
-        sum_by_columns = {}
-        # initialize sum_by columns to eventually be put into the graph
-        if sum_by is not None:
-            sum_by_columns = {metric: [] for metric in sum_by}
-
-        # loop through the data for each pod
-        for datapoint in result_list:
-            values_list = []
-            times_list = []
+        # decode the result list into Time, sum_by (title case), and value columns
+        graph_df = matrix_to_df(result_list, query_title, label_names=sum_by)
 
-            # extract queried data
-            for time_value_pair in datapoint['values']:
-                times_list.append(time_value_pair[0])
-                values_list.append(float(time_value_pair[1]))
+        return graph_df
 
-            # add pod's lists to the graph's columns
-            times_column.extend(times_list)
-            values_column.extend(values_list)
+    # filter a graph for worker pods and convert its times to datetimes, if requested
+    # (SeriesSets keep their times as they are)
+    def _finish_graph(self, graph: pd.DataFrame | SeriesSet | None, only_include_worker_pods: bool = False,
+                      display_time_as_datetime: bool = False) -> pd.DataFrame | SeriesSet | None:
+        if graph is None:
+            return None
+        if isinstance(graph, SeriesSet):
+            return filter_series_set_for_workers(graph) if only_include_worker_pods else graph
 
-            if sum_by is None:
-                continue
-            for metric in sum_by:
-                item_list = [datapoint['metric'][metric]]*len(times_list)
-                sum_by_columns[metric].extend(item_list)
-
-        # create and populate graph dataframe
-        graph_df = pd.DataFrame()
-        graph_df['Time'] = times_column
-        # add in sum_by columns
-        if sum_by is not None:  # if sum_by is None, don't add a sum_by column
-            for metric in sum_by:
-                # make sure item cols in graph are title case (Capitalized First Letters Of Words)
-                graph_df[metric.title()] = sum_by_columns[metric]
-        # add in values column
-        graph_df[query_title] = values_column
+        # for every worker pod in graph, change pod's value to just be the worker id, drop all non-worker pods
+        if only_include_worker_pods:
+            graph = filter_df_for_workers(graph)
 
-        return graph_df
+        # update graphs with correct time columns
+        if display_time_as_datetime:
+            graph['Time'] = pd.to_datetime(graph['Time'], unit="s")
+        return graph
+
+    # query a single graph of get_graphs_dict(lazy=True), given the queries it was made with
+    def _generate_lazy_graph(self, query_title: str, queries_dict: dict[str, str], partial_queries_dict: dict[str, list[str]],
+                             only_include_worker_pods: bool = False, display_time_as_datetime: bool = False,
+                             start: datetime | None = None, end: datetime | None = None,
+                             as_series_sets: bool = False) -> pd.DataFrame | SeriesSet | None:
+        if query_title in queries_dict:
+            graph_df = self._generate_graph_df(query_title, queries_dict[query_title], start=start, end=end,
+                                               as_series_set=as_series_sets)
+        else:
+            query_pair = partial_queries_dict[query_title]
+            graph_df = self._combine_partial_graphs(
+                query_title,
+                self._generate_graph_df(query_title, query_pair[0], start=start, end=end, as_series_set=as_series_sets),
+                self._generate_graph_df(query_title, query_pair[1], start=start, end=end, as_series_set=as_series_sets))
+        return self._finish_graph(
+            graph_df, only_include_worker_pods=only_include_worker_pods,
+            display_time_as_datetime=display_time_as_datetime)
+
+    # query a single graph of get_graphs_from_queries(lazy=True)
+    def _generate_lazy_graph_from_query(self, query_title: str, query: str, start: datetime | None = None,
+                                        end: datetime | None = None, time_step: str | None = None,
+                                        sum_by: list[str] | None = None,
+                                        display_time_as_datetime: bool = False) -> pd.DataFrame | None:
+        graph_df = self._generate_graph_df(
+            query_title, query, start=start, end=end, time_step=time_step, sum_by=sum_by)
+        return self._finish_graph(graph_df, display_time_as_datetime=display_time_as_datetime)
 
     # get a dictionary in the form of {graph titles: list of graph data}
-    def _generate_graphs(self, show_runtimes: bool = False) -> dict[str, pd.DataFrame]:
-        queries_dict = self.queries
-        partial_queries_dict = self.partial_queries
+    # pylint: disable=too-many-arguments
+    def _generate_graphs(self, max_concurrency: int | None = None, executor: Executor | None = None,
+                         only_include_worker_pods: bool = False, start: datetime | None = None,
+                         end: datetime | None = None, as_series_sets: bool = False, use_cache: bool = True,
+                         progress_bars: bool = True) -> dict[str, pd.DataFrame | SeriesSet]:
+        if max_concurrency is not None or executor is not None:
+            return self._generate_graphs_concurrently(
+                max_concurrency=max_concurrency, executor=executor,
+                only_include_worker_pods=only_include_worker_pods, start=start, end=end,
+                as_series_sets=as_series_sets, use_cache=use_cache, progress_bars=progress_bars)
+
+        queries_dict, partial_queries_dict = self.get_queries(
+            only_include_worker_pods=only_include_worker_pods)
         graphs_dict = {}
 
         # get all of the initial graphs from the normal queries
-        for query_title, query in tqdm(queries_dict.items()):
-            if show_runtimes:
-                start_time = time.time()
-
+        for query_title, query in tqdm(queries_dict.items(), disable=not progress_bars):
             # collect graph data
             graph_df = self._generate_graph_df(
-                query_title, query, show_runtimes=show_runtimes)
+                query_title, query, start=start, end=end, as_series_set=as_series_sets, use_cache=use_cache)
             graphs_dict[query_title] = graph_df
 
-            if show_runtimes:
-                end_time = time.time()
-                print("total time elapsed:", colored(
-                    end_time-start_time, "green"), "\n\n")
-
         # get graphs from partial queries
-        for query_title, query_pair in tqdm(partial_queries_dict.items()):
-            if show_runtimes:
-                start_time = time.time()
-
+        for query_title, query_pair in tqdm(partial_queries_dict.items(), disable=not progress_bars):
             # store the two queries' values. Originally graph_df only stores read
             # values instead of read+write. Later, it is updated to store both.
             graph_df = self._generate_graph_df(
-                query_title, query_pair[0], show_runtimes=show_runtimes)
+                query_title, query_pair[0], start=start, end=end, as_series_set=as_series_sets, use_cache=use_cache)
             graph_df_write = self._generate_graph_df(
-                query_title, query_pair[1], show_runtimes=show_runtimes)
-
-            if graph_df is not None and graph_df_write is not None:
-                # calculate read + write column by adding read values and write values
-                graph_df[query_title] = graph_df[query_title] + \
-                    graph_df_write[query_title]
+                query_title, query_pair[1], start=start, end=end, as_series_set=as_series_sets, use_cache=use_cache)
 
             # add graph dataframe to graphs_dict
-            graphs_dict[query_title] = graph_df
+            graphs_dict[query_title] = self._combine_partial_graphs(
+                query_title, graph_df, graph_df_write)
 
-            if show_runtimes:
-                end_time = time.time()
-                print("total time elapsed:", colored(
-                    end_time-start_time, "green"), "\n\n")
+        return graphs_dict
 
+    # same as _generate_graphs(), but every query (including both queries of each partial query)
+    # is sent at once. A query that fails results in a graph of None instead of stopping the rest
+    # pylint: disable=too-many-arguments
+    def _generate_graphs_concurrently(self, max_concurrency: int | None = None, executor: Executor | None = None,
+                                      only_include_worker_pods: bool = False, start: datetime | None = None,
+                                      end: datetime | None = None, as_series_sets: bool = False,
+                                      use_cache: bool = True,
+                                      progress_bars: bool = True) -> dict[str, pd.DataFrame | SeriesSet]:
+        queries_dict, partial_queries_dict = self.get_queries(
+            only_include_worker_pods=only_include_worker_pods)
+        tasks = {}
+        for query_title, query in queries_dict.items():
+            tasks[query_title] = partial(self._generate_graph_df, query_title, query, start=start, end=end,
+                                         as_series_set=as_series_sets, use_cache=use_cache)
+        for query_title, query_pair in partial_queries_dict.items():
+            for i, query in enumerate(query_pair):
+                tasks[(query_title, i)] = partial(self._generate_graph_df, query_title, query, start=start, end=end,
+                                                  as_series_set=as_series_sets, use_cache=use_cache)
+
+        results = run_concurrently(
+            tasks, max_concurrency=max_concurrency, executor=executor,
+            progress_bar=progress_bars and executor is None)
+        results = replace_failures(results, default=None)
+
+        # assemble graphs in the same order as _generate_graphs()
+        graphs_dict = {query_title: results[query_title] for query_title in queries_dict}
+        for query_title in partial_queries_dict:
+            graphs_dict[query_title] = self._combine_partial_graphs(
+                query_title, results[(query_title, 0)], results[(query_title, 1)])
         return graphs_dict
 
+    # print a telemetry summary of every query sent since the given unix time
+    def _print_runtimes(self, since: float) -> None:
+        telemetry = get_query_telemetry()
+        if telemetry is None:
+            print(colored("query telemetry is disabled, no runtimes to show", "yellow"))
+            return
+        telemetry.print_summary(since=since)
+
+    # given the read and write graphs of a partial query, return a graph of read + write values.
+    # Values are matched by their Time and labels (like SeriesSet.add()), so the two graphs don't need
+    # the same pods in the same order. A read value with no write value at the same time and labels is NaN
+    def _combine_partial_graphs(self, query_title: str, graph_df: pd.DataFrame | SeriesSet | None,
+                                graph_df_write: pd.DataFrame | SeriesSet | None) -> pd.DataFrame | SeriesSet | None:
+        if isinstance(graph_df, SeriesSet) and graph_df_write is not None:
+            return graph_df.add(graph_df_write)
+        if graph_df is None or graph_df_write is None:
+            return graph_df
+        keys = [column for column in graph_df.columns if column != query_title]
+        write_df = graph_df_write[keys + [query_title]].rename(columns={query_title: '_write'})
+        # calculate read + write column by adding read values and write values
+        sum_df = graph_df.merge(write_df, how='left', on=keys)
+        sum_df[query_title] = sum_df[query_title] + sum_df['_write']
+        return sum_df.drop(columns='_write')
+
     # =============================================
     #               Requery Methods
     # =============================================
 
-    # change a query to only query for the given pod
-    def _update_query_for_requery(self, query: str, pod: str) -> str:
+    # change a query to only query for the given pod (or pods, if given a list)
+    def _update_query_for_requery(self, query: str, pod: str | list[str]) -> str:
         # add specific pod to query so only the one specific pod is queried instead of all pods
         # insert the pod specification just before the namespace is specified
         namespace_index = query.find('namespace="')
-        pod_str = f'pod="{pod}", '
+        if isinstance(pod, str):
+            pod_str = f'pod="{pod}", '
+        elif len(pod) == 1:
+            pod_str = f'pod="{pod[0]}", '
+        else:
+            # escape regex characters (e.g. '.') in pod names, and the escapes themselves for the promql string
+            pods_regex = "|".join(re.sub(r'([.^$|?*+()\[\]{}\\])', r'\\\\\1', p) for p in pod)
+            pod_str = f'pod=~"{pods_regex}", '
         updated_query = query[:namespace_index] + \
             pod_str + query[namespace_index:]
 
@@ -371,102 +519,95 @@ class Graphs():
     # {'dropped': [{'pod':str, 'start':datetime, 'end':datetime, 'prev_val':float}, {...}, ...],
     #  'recovered': [{'pod':str, 'start':datetime, 'end':datetime, 'val':float}, {...}, ...]}
     # returns none if no losses
-    def _check_graph_loss(self, graph_title: str, graph_df: pd.DataFrame, drop_threshold: int | float = 0, print_info: bool = False) -> dict:
+    # a drop is a pod's value going from nonzero to zero, a recovery is it going from zero to nonzero.
+    # Each recovery is paired with the pod's earliest drop that hasn't been recovered yet
+    # graph_df can also be a SeriesSet, whose times are given as unix seconds
+    def _check_graph_loss(self, graph_title: str, graph_df: pd.DataFrame | SeriesSet, drop_threshold: int | float = 0, print_info: bool = False) -> dict:
         if drop_threshold < 0:
             raise ValueError(
                 "drop_threshold must be greater than or equal to 0.")
-        # data to return
-        pods_dropped = []
-        pods_recovered = []
-        pods_dropped_indices_by_name = {}
-        pods_recovered_indices_by_name = {}
-        # loop through looking for lost and/or recovered pods - start at index 1 because at 0 there was nothing to have dropped/recovered
-        for index in range(1, len(graph_df)):
-            # get current and previous pod info
-            current_value = graph_df[graph_title][index]
-            current_time = graph_df['Time'][index]
-            current_pod = graph_df['Pod'][index]
-            previous_value = graph_df[graph_title][index-1]
-            previous_time = graph_df['Time'][index-1]
-            previous_pod = graph_df['Pod'][index-1]
-
-            # only check pods dropped/recovered between the same pods
-            if previous_pod != current_pod:
-                continue
-
-            # pod not dropped or recovered
-            if not (previous_value == 0 and current_value != 0):
-                continue
+        if isinstance(graph_df, SeriesSet):
+            if graph_df.num_samples < 2:
+                return None
+            values = graph_df.values
+            # samples of a series are next to each other, so compare series instead of pods
+            series_ids = graph_df.get_series_ids()
+            pods = np.array(graph_df.get_label_values('pod'), dtype=object)[series_ids]
+            same_pod = series_ids[1:] == series_ids[:-1]
+        else:
+            if len(graph_df) < 2 or not pd.api.types.is_numeric_dtype(graph_df[graph_title]):
+                return None
+            # rows of a pod don't have to be next to each other (e.g. a graph from get_graphs_as_one_df()),
+            # so sort them by pod (in the order pods first appear), then time. The sort is stable
+            group_cols = [col for col in ['Node', 'Pod'] if col in graph_df.columns]
+            group_ids = graph_df.groupby(group_cols, sort=False, dropna=False).ngroup().to_numpy()
+            order = pd.DataFrame({'group': group_ids, 'Time': graph_df['Time'].to_numpy()}).sort_values(
+                ['group', 'Time'], kind='stable').index.to_numpy()
+            graph_df = graph_df.iloc[order].reset_index(drop=True)
+            group_ids = group_ids[order]
+            values = graph_df[graph_title].to_numpy(dtype=float)
+            pods = graph_df['Pod'].to_numpy()
+            same_pod = group_ids[1:] == group_ids[:-1]
+
+        # compare every row to the row before it (shifted arrays) - only between rows of the same pod
+        previous_values = values[:-1]
+        current_values = values[1:]
+        # pod dropped: was nonzero (and at least drop_threshold), now is zero
+        is_drop = same_pod & (previous_values > 0) & (current_values == 0) & \
+            (previous_values >= drop_threshold)
+        # pod recovered: was zero, now is nonzero
+        is_recovery = same_pod & (previous_values == 0) & (current_values != 0)
+        if not is_drop.any():
+            return None
 
-            # pod dropped: was nonzero, now is zero
-            if previous_value > 0 and current_value == 0:
-                # check if drop is big enough to record
-                if previous_value < drop_threshold:
-                    continue
+        # indices of the rows where a drop or recovery was found (the row after the change)
+        event_indices = np.flatnonzero(is_drop | is_recovery) + 1
+        event_is_drop = is_drop[event_indices - 1]
+        time_indices = np.concatenate([event_indices - 1, event_indices])
+        if isinstance(graph_df, SeriesSet):
+            times = (graph_df.times_ms[time_indices] / 1000).tolist()
+        else:
+            times = graph_df['Time'].iloc[time_indices].tolist()
+        previous_times = times[:len(event_indices)]
+        current_times = times[len(event_indices):]
 
+        # pair recoveries with drops. This only loops through the (few) drops and recoveries, not every row
+        pods_dropped = []
+        pods_recovered = []
+        drops_by_pod = {}
+        num_recovered_by_pod = {}
+        for i, index in enumerate(event_indices):
+            pod = pods[index]
+            if event_is_drop[i]:
                 drop = {
-                    'pod': current_pod,
-                    'start': previous_time,
-                    'end': current_time,
-                    'prev_val': previous_value
+                    'pod': pod,
+                    'start': previous_times[i],
+                    'end': current_times[i],
+                    'prev_val': values[index - 1]
                 }
                 pods_dropped.append(drop)
-                pod_dropped_index = len(pods_dropped) - 1
-                # save the name and index of the pod dropped for quick lookup
-                if current_pod in pods_dropped_indices_by_name.keys():
-                    pods_dropped_indices_by_name[current_pod].append(
-                        pod_dropped_index)
-                else:
-                    pods_dropped_indices_by_name[current_pod] = [
-                        pod_dropped_index]
-                continue
-
-            # pod recovered: was zero, now is nonzero
-            # check that pod was dropped in order for it to be recovered
-            if current_pod not in pods_dropped_indices_by_name.keys():
+                drops_by_pod.setdefault(pod, []).append(drop)
                 continue
 
             # check that pod has been recovered fewer times than dropped
-            dropped_pod_indices = pods_dropped_indices_by_name[current_pod]
-            recovered_pod_indices = []
-            if current_pod in pods_recovered_indices_by_name.keys():
-                recovered_pod_indices = pods_recovered_indices_by_name[current_pod]
-            if len(recovered_pod_indices) >= len(dropped_pod_indices):
+            pod_drops = drops_by_pod.get(pod, [])
+            num_recovered = num_recovered_by_pod.get(pod, 0)
+            if num_recovered >= len(pod_drops):
                 continue
-
-            # get the pod drop corresponding to this recovery
-            dropped_pod_index = dropped_pod_indices[len(
-                recovered_pod_indices)]
-            dropped_pod = pods_dropped[dropped_pod_index]
-            # check that recovery isn't before drop
-            time_down = current_time - dropped_pod['end']
-            if time_down.total_seconds() <= 0:
+            # check that recovery isn't before the drop it recovers from
+            if not current_times[i] > pod_drops[num_recovered]['end']:
                 continue
 
-            # save this pod recovery
-            recovery = {
-                'pod': current_pod,
-                'start': previous_time,
-                'end': current_time,
-                'val': current_value
-            }
-            pods_recovered.append(recovery)
-            pod_recovered_index = len(pods_recovered) - 1
-            # save the name and index of the pod recovery for quick lookup
-            if len(recovered_pod_indices) > 0:
-                pods_recovered_indices_by_name[current_pod].append(
-                    pod_recovered_index)
-            else:
-                pods_recovered_indices_by_name[current_pod] = [
-                    pod_recovered_index]
-        # once pod loss info is collected, check if there are any drops
-        # cannot have recoverd pods if none were dropped.
-        # if both dropped and recovered are empty, return None
-        if len(pods_dropped) == 0:
-            return None
+            pods_recovered.append({
+                'pod': pod,
+                'start': previous_times[i],
+                'end': current_times[i],
+                'val': values[index]
+            })
+            num_recovered_by_pod[pod] = num_recovered + 1
 
         # print collected statistics
-        if print_info and len(pods_dropped) > 0:
+        if print_info:
             self._print_pod_losses(graph_title, pods_dropped, pods_recovered)
 
         return {'dropped': pods_dropped, 'recovered': pods_recovered}
@@ -481,7 +622,8 @@ class Graphs():
     #     graph_title_2: {...},
     #     ...
     # }
-    def check_for_losses(self, graphs_dict: dict[str, pd.DataFrame] | None = None, drop_threshold: int | float = 0, print_info: bool = False) -> dict:
+    # graphs can also be SeriesSets (see get_graphs_dict(as_series_sets=True))
+    def check_for_losses(self, graphs_dict: dict[str, pd.DataFrame | SeriesSet] | None = None, drop_threshold: int | float = 0, print_info: bool = False) -> dict:
         if graphs_dict is None:
             graphs_dict = self.get_graphs_dict()
 
@@ -516,75 +658,88 @@ class Graphs():
         #     graph_title_2: {...},
         #     ...
         # }
+    # Pods dropped/recovered around the same time are requeried together: the events of a graph are
+    # grouped into windows of overlapping times, and each window is queried once for all of its pods
+    # (pod=~"a|b|c") over the whole window. The result is then sliced back into a df per event.
     def requery_graphs(self, graphs_losses_dict: dict, show_runtimes: bool = False) -> dict:
-        # declare variables
-        requeried_graphs_dict = {}
-        query = ''
-        query_pair = []
-        partial_query = False
+        runtime_start = time.time()
+        # convert time_step to timedelta to be able to divide it by the requery divisor,
+        # then back to str to be used for querying
+        time_step = delta_to_time_str(
+            time_str_to_delta(self.time_step)/self.requery_step_divisor)
 
+        requeried_graphs_dict = {}
         # get graph titles and label_dict (label_dict = {'dropped':[{},...], 'retrieved:[{},...])
         for graph_title, label_dict in tqdm(graphs_losses_dict.items()):
             if label_dict is None:
                 continue
-            requeried_graphs_dict[graph_title] = {}
-            # get category (dropped or retrieved) and list of pod_dicts
-            for category, pods_list in label_dict.items():
-                requeried_graphs_dict[graph_title][category] = []
-                # get query (not updated for specific pod)
-                if graph_title in self.queries:
-                    query = self.queries[graph_title]
-                    partial_query = False
-                else:
-                    # partial query --> 2 queries per graph
-                    query_pair = self.partial_queries[graph_title]
-                    partial_query = True
-
-                # loop through the pods for each graph
-                for pod_dict in pods_list:
-                    # assemble arguments for self._generate_graph_df
-                    pod = pod_dict['pod']
-                    start = pod_dict['start']
-                    end = pod_dict['end']
-                    # convert time_step to timedelta to be able to divide it by the requery divisor
-                    time_step = time_str_to_delta(
-                        self.time_step)/self.requery_step_divisor
-                    # convert time_step back to str to be used for querying
-                    time_step = delta_to_time_str(time_step)
-                    graph_df = None
-
-                    # graph is defined by 1 query --> query graph
-                    if not partial_query:
-                        updated_query = self._update_query_for_requery(
-                            query, pod)
-                        graph_df = self._generate_graph_df(
-                            graph_title, updated_query, start=start, end=end, time_step=time_step, show_runtimes=show_runtimes
-                        )
-                        requeried_graphs_dict[graph_title][category].append(
-                            graph_df)
-                        continue
-
-                    # graph is defined by 2 queries --> query both, add both partial graphs to get the final graph
-                    # each partial query is for some metric read+write values
-                    updated_read_query = self._update_query_for_requery(
-                        query_pair[0], pod)
-                    updated_write_query = self._update_query_for_requery(
-                        query_pair[1], pod)
-
-                    # get the metric's data by adding the read values df to the write values df
-                    read_graph = self._generate_graph_df(
-                        graph_title, updated_read_query, start=start, end=end, time_step=time_step, show_runtimes=show_runtimes
-                    )
-                    write_graph = self._generate_graph_df(
-                        graph_title, updated_write_query, start=start, end=end, time_step=time_step, show_runtimes=show_runtimes
-                    )
-
-                    # keep time the same, so only add the values column
-                    graph_df = read_graph
-                    graph_df[graph_title] = read_graph[graph_title] + \
-                        write_graph[graph_title]
-
-                    requeried_graphs_dict[graph_title][category].append(
-                        graph_df)
+            # graphs from partial queries are defined by 2 queries (read and write values)
+            if graph_title in self.queries:
+                queries = [self.queries[graph_title]]
+            else:
+                queries = self.partial_queries[graph_title]
+
+            # every event is (category, index in category, pod_dict)
+            events = [(category, i, pod_dict) for category, pods_list in label_dict.items()
+                      for i, pod_dict in enumerate(pods_list)]
+            graph_dfs_by_event = {}
+            for window_start, window_end, window_events in self._group_requery_windows(events):
+                window_pods = list(dict.fromkeys(pod_dict['pod'] for _, _, pod_dict in window_events))
+                for chunk_start in range(0, len(window_pods), REQUERY_MAX_PODS_PER_QUERY):
+                    pods = window_pods[chunk_start:chunk_start + REQUERY_MAX_PODS_PER_QUERY]
+                    window_graphs = [
+                        self._generate_graph_df(
+                            graph_title, self._update_query_for_requery(query, pods),
+                            start=window_start, end=window_end, time_step=time_step)
+                        for query in queries
+                    ]
+                    for category, i, pod_dict in window_events:
+                        if pod_dict['pod'] not in pods:
+                            continue
+                        graph_slices = [
+                            self._slice_requery_graph(window_graph, pod_dict)
+                            for window_graph in window_graphs
+                        ]
+                        # keep time the same, so only add the values column
+                        graph_df = graph_slices[0]
+                        if len(graph_slices) == 2:
+                            graph_df = self._combine_partial_graphs(graph_title, *graph_slices)
+                        graph_dfs_by_event[(category, i)] = graph_df
+
+            # same structure as graphs_losses_dict: a df (or None if there was no data) per pod_dict
+            requeried_graphs_dict[graph_title] = {
+                category: [graph_dfs_by_event[(category, i)] for i in range(len(pods_list))]
+                for category, pods_list in label_dict.items()
+            }
 
+        if show_runtimes:
+            self._print_runtimes(since=runtime_start)
         return requeried_graphs_dict
+
+    # given a list of (category, index, pod_dict) events, group the events with overlapping
+    # start to end times. Returns a list of (window start, window end, events in the window)
+    def _group_requery_windows(self, events: list[tuple[str, int, dict]]) -> list[tuple[datetime, datetime, list]]:
+        windows = []
+        for event in sorted(events, key=lambda event: datetime_ify(event[2]['start']).timestamp()):
+            start = datetime_ify(event[2]['start'])
+            end = datetime_ify(event[2]['end'])
+            if len(windows) > 0 and start.timestamp() <= windows[-1][1].timestamp():
+                window_start, window_end, window_events = windows[-1]
+                windows[-1] = (window_start, max(window_end, end, key=datetime.timestamp),
+                               window_events + [event])
+                continue
+            windows.append((start, end, [event]))
+        return windows
+
+    # return the rows of a requeried window's graph that belong to the pod and time range of
+    # pod_dict (as if it were queried on its own), or None if there are none
+    def _slice_requery_graph(self, graph_df: pd.DataFrame | None, pod_dict: dict) -> pd.DataFrame | None:
+        if graph_df is None:
+            return None
+        start = datetime_ify(pod_dict['start']).timestamp()
+        end = datetime_ify(pod_dict['end']).timestamp()
+        in_event = (graph_df['Pod'] == pod_dict['pod']) & \
+            (graph_df['Time'] >= start) & (graph_df['Time'] <= end)
+        if not in_event.any():
+            return None
+        return graph_df[in_event].reset_index(drop=True)
@@ -1,16 +1,24 @@
 #!/usr/bin/python3
 # -*- coding: utf-8 -*-
+from concurrent.futures import Executor
+from functools import partial
 import pandas as pd
 from tqdm import tqdm
 from helpers.querying import query_data
-from helpers.filtering import filter_df_for_workers
-from inputs import NAMESPACE, QUERY_TIMEOUT_SEC
+from helpers.concurrency import run_concurrently, replace_failures
+from helpers.multiplexing import query_multiplexed
+from helpers.decoding import vector_to_df
+from helpers.filtering import filter_df_for_workers, add_worker_pod_matcher_to_queries
+from inputs import NAMESPACE, QUERY_TIMEOUT_SEC, QUERY_MULTIPLEX_INSTANT
 
 
 class Header():
-    def __init__(self, namespace: str = NAMESPACE, query_timeout_seconds: int = QUERY_TIMEOUT_SEC) -> None:
+    # if multiplex_queries is True, all header queries are combined into one request (see helpers/multiplexing.py)
+    def __init__(self, namespace: str = NAMESPACE, query_timeout_seconds: int = QUERY_TIMEOUT_SEC,
+                 multiplex_queries: bool = QUERY_MULTIPLEX_INSTANT) -> None:
         self.namespace = namespace
         self.query_timeout_seconds = query_timeout_seconds
+        self.multiplex_queries = multiplex_queries
         self.queries = {
             'CPU Utilisation (from requests)': 'sum by(node, pod) (node_namespace_pod_container:container_cpu_usage_seconds_total:sum_irate{namespace="' + self.namespace + '"}) / sum by(node, pod) (kube_pod_container_resource_requests{job="kube-state-metrics", namespace="' + self.namespace + '", resource="cpu"})',
             'CPU Utilisation (from limits)': 'sum by (node, pod) (node_namespace_pod_container:container_cpu_usage_seconds_total:sum_irate{namespace="' + self.namespace + '"}) / sum by(node, pod) (kube_pod_container_resource_limits{job="kube-state-metrics", namespace="' + self.namespace + '", resource="cpu"})',
@@ -20,13 +28,23 @@ class Header():
 
     # returns a dict in the form {header_title:dataframe}
     # where the dataframe contains header values per node, pod
-    def get_header_dict(self, only_include_worker_pods: bool = False) -> dict[str, pd.DataFrame]:
+    # if max_concurrency (or a shared executor) is given, all header queries are sent at once
+    # if results (a dict of {header_title: result_list}) is given, it is used instead of querying
+    # if only_include_worker_pods, only worker pods are queried (see get_queries())
+    def get_header_dict(self, only_include_worker_pods: bool = False, max_concurrency: int | None = None,
+                        executor: Executor | None = None,
+                        results: dict[str, list[dict]] | None = None) -> dict[str, pd.DataFrame]:
         header_dict = {}
 
+        # query for every header item
+        result_lists = results
+        if result_lists is None:
+            result_lists = self._query_header_items(
+                self.get_queries(only_include_worker_pods=only_include_worker_pods),
+                max_concurrency=max_concurrency, executor=executor)
+
         # generate a dataframe for each header item, then add it to header_dict
-        for query_title, query in tqdm(self.queries.items()):
-            # generate dataframe
-            result_list = query_data(query, timeout_sec=self.query_timeout_seconds)
+        for query_title, result_list in result_lists.items():
             header_item = self._generate_df(query_title, result_list)
 
             # filter by worker pods if requested
@@ -37,25 +55,46 @@ class Header():
 
         return header_dict
 
+    # returns the header queries. If only_include_worker_pods, every query only selects
+    # bp3d-worker pods, so the other pods in the namespace aren't sent back at all
+    def get_queries(self, only_include_worker_pods: bool = False) -> dict[str, str]:
+        if only_include_worker_pods:
+            return add_worker_pod_matcher_to_queries(self.queries)
+        return self.queries
+
+    # returns a dict in the form {header_title: result_list} for the given queries.
+    # Queries all at once in one combined query if multiplex_queries is set, otherwise
+    # queries one at a time unless max_concurrency or executor is given
+    def _query_header_items(self, queries: dict[str, str], max_concurrency: int | None = None,
+                            executor: Executor | None = None) -> dict[str, list[dict]]:
+        if self.multiplex_queries:
+            results = query_multiplexed(queries, timeout_sec=self.query_timeout_seconds,
+                                        max_concurrency=max_concurrency, executor=executor)
+            return replace_failures(results, default=[])
+
+        if max_concurrency is None and executor is None:
+            return {
+                query_title: query_data(
+                    query, timeout_sec=self.query_timeout_seconds, title=query_title)
+                for query_title, query in tqdm(queries.items())
+            }
+
+        tasks = {
+            query_title: partial(
+                query_data, query, timeout_sec=self.query_timeout_seconds, title=query_title)
+            for query_title, query in queries.items()
+        }
+        results = run_concurrently(
+            tasks, max_concurrency=max_concurrency, executor=executor,
+            progress_bar=executor is None)
+        return replace_failures(results, default=[])
+
     # returns a dataframe containing nodes, pods, and values for
     # a given result_list from a query (header data)
     def _generate_df(self, col_title: str, res_list: list[dict]) -> pd.DataFrame:
-        # parse json data and initialize dataframe
-        df = pd.DataFrame(columns=['Node', 'Pod', col_title])
-        # df = pd.DataFrame(columns=['Time', 'Node', 'Pod', col_title])  # for timestamp
-
-        # fill in dataframe
-        for datapoint in res_list:
-            # each triplet is a dictionary with node (str), pod (str), values (list)
-            node = datapoint['metric']['node']
-            pod = datapoint['metric']['pod']
-            # timestamp = datapoint['value']['0']  # for timestamp
-
-            # multiply by 100 to get value in % form instead of decimal form.
-            value = float(datapoint['value'][1])*100
-
-            # add row to the end of the dataframe containing the node, pod, and value
-            df.loc[len(df.index)] = [node, pod, value]
-            # df.loc[len(df.index)] = [timestamp, node, pod, value]  # for timestamp
+        # each datapoint in res_list is a dictionary with node (str), pod (str), and value
+        df = vector_to_df(res_list, col_title, label_names=['node', 'pod'])
+        # multiply by 100 to get value in % form instead of decimal form.
+        df[col_title] = df[col_title] * 100
 
         return df
@@ -0,0 +1,270 @@
+import os
+import re
+import gzip
+import json
+import time
+import hashlib
+import threading
+from datetime import datetime, timezone
+from helpers.time_functions import time_str_to_delta
+from inputs import (QUERY_CACHE_DIR, QUERY_CACHE_MAX_MB, QUERY_CACHE_SETTLE_SEC,
+                    QUERY_CACHE_RECENT_TTL_SEC, QUERY_CACHE_LIVE_QUERIES)
+
+# the promql @ modifier with a unix time (e.g. 'metric[1h] @ 1700000000')
+_AT_MODIFIER_PATTERN = re.compile(r'@\s*([0-9]+(?:\.[0-9]+)?)')
+
+# characters that whitespace can be dropped around in promql without changing the query
+_PROMQL_PUNCTUATION = set("(){}[],=!~<>+-*/^%")
+
+
+# given a promql query, return it with insignificant whitespace removed so that queries
+# that only differ in spacing (e.g. "sum by (node, pod)" vs "sum by(node,pod)") are the same.
+# whitespace inside of quoted strings is kept as is.
+def normalize_query(query: str) -> str:
+    normalized = []
+    quote_char = None
+    pending_space = False
+    for char in query.strip():
+        if quote_char is not None:
+            normalized.append(char)
+            if char == quote_char and normalized[-2:-1] != ["\\"]:
+                quote_char = None
+            continue
+        if char.isspace():
+            pending_space = True
+            continue
+        # only keep a space if it separates two words (e.g. "sum by", "offset 5m")
+        if pending_space and normalized and char not in _PROMQL_PUNCTUATION \
+                and normalized[-1] not in _PROMQL_PUNCTUATION:
+            normalized.append(" ")
+        pending_space = False
+        if char in ('"', "'", "`"):
+            quote_char = char
+        normalized.append(char)
+    return "".join(normalized)
+
+
+# given a time from query params (unix seconds or an rfc3339 string), return unix seconds
+def time_param_to_seconds(time_param: str | float | int) -> float:
+    try:
+        return float(time_param)
+    except ValueError:
+        pass
+    time_str = time_param.replace("Z", "")
+    for format_str in ("%Y-%m-%dT%H:%M:%S.%f", "%Y-%m-%dT%H:%M:%S"):
+        try:
+            time_dt = datetime.strptime(time_str, format_str)
+            return time_dt.replace(tzinfo=timezone.utc).timestamp()
+        except ValueError:
+            continue
+    raise ValueError(f"time param '{time_param}' is not unix seconds or rfc3339")
+
+
+# given a step from query params (seconds or a time string like '1m'), return seconds
+def step_param_to_seconds(step_param: str | float | int) -> float:
+    try:
+        return float(step_param)
+    except ValueError:
+        return time_str_to_delta(step_param).total_seconds()
+
+
+# given a query, return the latest unix time of its @ modifiers if every selector (every {...}) has one.
+# Such a query gives the same result no matter when it is evaluated. Otherwise return None
+def get_eval_time_from_query(query: str) -> float | None:
+    eval_times = [float(match) for match in _AT_MODIFIER_PATTERN.findall(query)]
+    if len(eval_times) == 0 or len(eval_times) < query.count("{"):
+        return None
+    return max(eval_times)
+
+
+# given an endpoint and query params, return a hash of the normalized request.
+# Requests that only differ in query whitespace or time format have the same key.
+# If base_url is given it is part of the key, so results of different servers (e.g. a replay server
+# and the real api) never share a key
+def get_request_key(endpoint: str, params: dict[str, str], base_url: str | None = None) -> str:
+    key_dict = {"endpoint": endpoint, "query": normalize_query(params["query"])}
+    if base_url is not None:
+        key_dict["base_url"] = base_url
+    if "time" in params:
+        key_dict["time"] = time_param_to_seconds(params["time"])
+    if "start" in params:
+        key_dict["start"] = time_param_to_seconds(params["start"])
+        key_dict["end"] = time_param_to_seconds(params["end"])
+        key_dict["step"] = step_param_to_seconds(params["step"])
+    key_str = json.dumps(key_dict, sort_keys=True)
+    return hashlib.sha256(key_str.encode("utf-8")).hexdigest()
+
+
+class QueryCache():
+    """Content addressed, size bounded disk cache for query results
+
+    Results are keyed by the server's base url, endpoint, normalized query, and evaluation time or range + step.
+    Windows that ended a while ago can't change anymore, so they are kept until evicted.
+    Windows that touch "now" expire after a short TTL. Instant queries without a time or @ modifiers are
+    live snapshots, so they aren't cached at all unless cache_live_queries is True (see is_cacheable()).
+    Entries are stored gzip compressed, and the least recently used ones are deleted once the
+    cache grows past max_mb.
+    """
+
+    def __init__(self, cache_dir: str = QUERY_CACHE_DIR, max_mb: float = QUERY_CACHE_MAX_MB,
+                 settle_seconds: float = QUERY_CACHE_SETTLE_SEC,
+                 recent_ttl_seconds: float = QUERY_CACHE_RECENT_TTL_SEC,
+                 cache_live_queries: bool = QUERY_CACHE_LIVE_QUERIES) -> None:
+        self.cache_dir = cache_dir
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.settle_seconds = settle_seconds
+        self.recent_ttl_seconds = recent_ttl_seconds
+        self.cache_live_queries = cache_live_queries
+        self._lock = threading.Lock()
+        self._total_bytes = None  # calculated the first time something is stored
+        self._stats = {"hits": 0, "misses": 0, "expired": 0, "stores": 0, "evictions": 0}
+
+    # returns the cached result list for the request to base_url, or None if it isn't cached (or expired)
+    def get(self, endpoint: str, params: dict[str, str], base_url: str | None = None) -> list[dict] | None:
+        path = self._get_path(self.get_key(endpoint, params, base_url))
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as file:
+                entry = json.load(file)
+        except (OSError, ValueError):
+            self._count("misses")
+            return None
+
+        expires = entry.get("expires")
+        if expires is not None and expires < time.time():
+            self._count("expired")
+            self._count("misses")
+            self._remove(path)
+            return None
+
+        # mark the entry as recently used for lru eviction
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self._count("hits")
+        return entry["result"]
+
+    # save the result list for the request to base_url. Empty results aren't saved since the api sometimes
+    # returns no data for queries that do have data
+    def put(self, endpoint: str, params: dict[str, str], result_list: list[dict],
+            base_url: str | None = None) -> None:
+        if len(result_list) == 0:
+            return
+        entry = {
+            "expires": self._get_expiry(endpoint, params),
+            "result": result_list
+        }
+        path = self._get_path(self.get_key(endpoint, params, base_url))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a temporary file first so other threads/processes never read half an entry
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as file:
+            json.dump(entry, file)
+        old_size = os.path.getsize(path) if os.path.exists(path) else 0
+        os.replace(tmp_path, path)
+        self._count("stores")
+        self._add_bytes(os.path.getsize(path) - old_size)
+
+    # returns the number of hits, misses, expired entries, stores, evictions, and the hit rate
+    def get_stats(self) -> dict[str, int | float]:
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups > 0 else 0.0
+        return stats
+
+    # delete every entry in the cache
+    def clear(self) -> None:
+        for path, _, _ in self._list_entries():
+            self._remove(path)
+        with self._lock:
+            self._total_bytes = 0
+
+    # returns False for live instant queries (no time and no @ modifiers) unless cache_live_queries is True
+    def is_cacheable(self, endpoint: str, params: dict[str, str]) -> bool:
+        if self.cache_live_queries or endpoint != "query" or "time" in params:
+            return True
+        return get_eval_time_from_query(params["query"]) is not None
+
+    # given an endpoint, query params, and the server's base url, return the key the result is cached under
+    def get_key(self, endpoint: str, params: dict[str, str], base_url: str | None = None) -> str:
+        return get_request_key(endpoint, params, base_url)
+
+    # returns the unix time the entry expires at, or None if it never expires
+    def _get_expiry(self, endpoint: str, params: dict[str, str]) -> float | None:
+        now = time.time()
+        window_end = None
+        if "end" in params:
+            window_end = time_param_to_seconds(params["end"])
+        elif "time" in params:
+            window_end = time_param_to_seconds(params["time"])
+        else:
+            window_end = get_eval_time_from_query(params["query"])
+        # instant queries without a time (or @ modifiers) are evaluated at "now", so they are never settled
+        if window_end is not None and window_end < now - self.settle_seconds:
+            return None
+        return now + self.recent_ttl_seconds
+
+    def _get_path(self, key: str) -> str:
+        # split entries into subdirectories so no single directory gets too big
+        return os.path.join(self.cache_dir, key[:2], key + ".json.gz")
+
+    def _count(self, stat: str) -> None:
+        with self._lock:
+            self._stats[stat] += 1
+
+    def _remove(self, path: str) -> None:
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return
+        with self._lock:
+            if self._total_bytes is not None:
+                self._total_bytes -= size
+
+    # returns a list of (path, size, last used time) of every entry in the cache
+    def _list_entries(self) -> list[tuple[str, int, float]]:
+        entries = []
+        if not os.path.isdir(self.cache_dir):
+            return entries
+        for sub_dir in os.scandir(self.cache_dir):
+            if not sub_dir.is_dir():
+                continue
+            for entry in os.scandir(sub_dir.path):
+                if not entry.name.endswith(".json.gz"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((entry.path, stat.st_size, stat.st_mtime))
+        return entries
+
+    # keep track of the size of the cache, evicting entries if it gets too big
+    def _add_bytes(self, num_bytes: int) -> None:
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = sum(size for _, size, _ in self._list_entries())
+            else:
+                self._total_bytes += num_bytes
+            over_limit = self._total_bytes > self.max_bytes
+        if over_limit:
+            self._evict()
+
+    # delete least recently used entries until the cache is under 90% of max_bytes
+    def _evict(self) -> None:
+        entries = sorted(self._list_entries(), key=lambda entry: entry[2])
+        total_bytes = sum(size for _, size, _ in entries)
+        target_bytes = self.max_bytes * 0.9
+        for path, size, _ in entries:
+            if total_bytes <= target_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total_bytes -= size
+            self._count("evictions")
+        with self._lock:
+            self._total_bytes = total_bytes
@@ -0,0 +1,108 @@
+import threading
+import contextvars
+from concurrent.futures import Executor, Future, ThreadPoolExecutor, as_completed
+from typing import Callable
+from termcolor import colored
+from tqdm import tqdm
+
+
+# given a dict of {key: function that takes no arguments}, run the functions concurrently and
+# return a dict of {key: result} in the same order as tasks.
+# At most max_concurrency functions run at once. Pass in an executor instead to share one bounded
+# pool of workers between several callers (e.g. Header, Tables, and Graphs in get_all_data).
+# If a function raises an exception, the exception is stored as its result instead of being
+# raised, so one failed query doesn't cancel the others.
+def run_concurrently(tasks: dict[any, Callable], max_concurrency: int | None = None,
+                     executor: Executor | None = None, progress_bar: bool = False) -> dict[any, any]:
+    if executor is None:
+        if max_concurrency is None or max_concurrency < 1:
+            raise ValueError(
+                "max_concurrency must be an int >= 1 if no executor is passed in")
+        with ThreadPoolExecutor(max_workers=max_concurrency) as new_executor:
+            return run_concurrently(tasks, executor=new_executor, progress_bar=progress_bar)
+
+    futures = {submit_in_context(executor, task): key for key, task in tasks.items()}
+    results_by_key = {}
+    for future in tqdm(as_completed(futures), total=len(futures), disable=not progress_bar):
+        key = futures[future]
+        try:
+            results_by_key[key] = future.result()
+        # pylint: disable=broad-exception-caught
+        except Exception as exc:
+            results_by_key[key] = exc
+
+    # keep the same order the tasks were passed in with
+    return {key: results_by_key[key] for key in tasks}
+
+
+# submit a function that takes no arguments to the executor, running it in a copy of the current
+# context so context variables (e.g. the telemetry stage, see helpers/telemetry.py) carry over to the worker
+def submit_in_context(executor: Executor, task: Callable) -> Future:
+    return executor.submit(contextvars.copy_context().run, task)
+
+
+# given the results from run_concurrently, print a warning for every task that failed and
+# replace its result with default. Returns the updated results dict
+def replace_failures(results: dict[any, any], default: any = None) -> dict[any, any]:
+    for key, result in results.items():
+        if isinstance(result, Exception):
+            print(colored(f"\nQuery for '{key}' failed: {result!r}", "red"))
+            results[key] = default
+    return results
+
+
+class SingleFlight():
+    """Runs a function only once at a time per key, sharing its result with every caller of that key
+
+    If do() is called with a key whose function is already running in another thread, it waits for
+    that call to finish and returns (or raises) the same result instead of running the function again.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._stats = {"executed": 0, "coalesced": 0}
+
+    # run func (or wait for the call of the same key already running) and return
+    # (result, whether the result came from another caller's call)
+    def do(self, key: any, func: Callable) -> tuple[any, bool]:
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = _Call()
+                self._calls[key] = call
+                self._stats["executed"] += 1
+            else:
+                self._stats["coalesced"] += 1
+
+        if not is_leader:
+            call.done.wait()
+            if call.exception is not None:
+                raise call.exception
+            return call.result, True
+
+        try:
+            call.result = func()
+        except BaseException as exc:
+            call.exception = exc
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    # returns how many calls were executed and how many were coalesced into another call (saved)
+    def get_stats(self) -> dict[str, int]:
+        with self._lock:
+            return dict(self._stats)
+
+
+class _Call():
+    """A call in progress in SingleFlight"""
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result = None
+        self.exception = None
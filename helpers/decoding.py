@@ -0,0 +1,87 @@
+import numpy as np
+import pandas as pd
+
+
+# given a result list from a range query (resultType "matrix"), return every sample of every series
+# as flat arrays: (timestamps in ms as int64, values as float64, {label: label value per sample}).
+# Samples of each series are kept together and in the order the api returned them.
+def decode_matrix(result_list: list[dict], label_names: list[str] | None = None,
+                  categorical_labels: bool = False) -> tuple[np.ndarray, np.ndarray, dict[str, np.ndarray | pd.Categorical]]:
+    series_lengths = np.fromiter(
+        (len(series['values']) for series in result_list), dtype=np.int64, count=len(result_list))
+    num_samples = int(series_lengths.sum())
+    samples = [pair for series in result_list for pair in series['values']]
+    # timestamps are unix seconds with up to ms precision. Store them as whole ms
+    times = np.fromiter((pair[0] for pair in samples), dtype=np.float64, count=num_samples)
+    times_ms = np.rint(times * 1000).astype(np.int64)
+    # values are strings (e.g. "1.5", "NaN", "+Inf"), numpy parses them all at once
+    values = np.array([pair[1] for pair in samples], dtype=np.float64)
+    labels = _decode_labels(result_list, label_names, series_lengths, categorical_labels)
+    return times_ms, values, labels
+
+
+# given a result list from an instant query (resultType "vector"), return one sample per series
+# as arrays: (timestamps in ms as int64, values as float64, {label: label value per sample})
+def decode_vector(result_list: list[dict], label_names: list[str] | None = None,
+                  categorical_labels: bool = False) -> tuple[np.ndarray, np.ndarray, dict[str, np.ndarray | pd.Categorical]]:
+    num_series = len(result_list)
+    times = np.fromiter((series['value'][0] for series in result_list), dtype=np.float64, count=num_series)
+    times_ms = np.rint(times * 1000).astype(np.int64)
+    values = np.array([series['value'][1] for series in result_list], dtype=np.float64)
+    labels = _decode_labels(result_list, label_names, np.ones(num_series, dtype=np.int64), categorical_labels)
+    return times_ms, values, labels
+
+
+# given timestamps in ms, return them as unix seconds (the same floats the api returned)
+def ms_to_seconds(times_ms: np.ndarray) -> np.ndarray:
+    return times_ms / 1000
+
+
+# given a range query result list, return a dataframe with a Time column (unix seconds),
+# a column for each label (title case), and a column of values titled value_title
+def matrix_to_df(result_list: list[dict], value_title: str, label_names: list[str] | None = None,
+                 categorical_labels: bool = False) -> pd.DataFrame:
+    times_ms, values, labels = decode_matrix(result_list, label_names, categorical_labels)
+    columns = {'Time': ms_to_seconds(times_ms)}
+    columns.update({label.title(): label_values for label, label_values in labels.items()})
+    columns[value_title] = values
+    return pd.DataFrame(columns)
+
+
+# given an instant query result list, return a dataframe with a column for each label (title case)
+# and a column of values titled value_title. Set include_time to also add a Time column first
+def vector_to_df(result_list: list[dict], value_title: str, label_names: list[str] | None = None,
+                 include_time: bool = False, categorical_labels: bool = False) -> pd.DataFrame:
+    times_ms, values, labels = decode_vector(result_list, label_names, categorical_labels)
+    columns = {}
+    if include_time:
+        columns['Time'] = ms_to_seconds(times_ms)
+    columns.update({label.title(): label_values for label, label_values in labels.items()})
+    columns[value_title] = values
+    return pd.DataFrame(columns)
+
+
+# format a sample value the way prometheus does
+def format_value(value: float) -> str:
+    if np.isnan(value):
+        return "NaN"
+    if np.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return np.format_float_positional(float(value), trim="-")
+
+
+# return {label: array with the series' label value repeated once per sample}.
+# Each series' label value is only looked up once, then repeated with numpy
+def _decode_labels(result_list: list[dict], label_names: list[str] | None, series_lengths: np.ndarray,
+                   categorical_labels: bool) -> dict[str, np.ndarray | pd.Categorical]:
+    labels = {}
+    if label_names is None:
+        return labels
+    for label in label_names:
+        series_values = [series['metric'][label] for series in result_list]
+        if categorical_labels:
+            codes, categories = pd.factorize(np.array(series_values, dtype=object))
+            labels[label] = pd.Categorical.from_codes(np.repeat(codes, series_lengths), categories)
+        else:
+            labels[label] = np.repeat(np.array(series_values, dtype=object), series_lengths)
+    return labels
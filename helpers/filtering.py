@@ -1,6 +1,13 @@
 import re
+import numpy as np
 import pandas as pd
 
+# matches the pods of every bp3d-worker (including helitack workers), for a pod=~"..." matcher
+WORKER_POD_REGEX = "bp3d-worker-(helitack-)?k8s-.*"
+# gets the worker id out of a bp3d-worker pod name (of either kind)
+_WORKER_ID_PATTERN = r"bp3d-worker-(?:helitack-)?k8s-([a-fA-F0-9]+)"
+_WORKER_POD_MATCHER = f'pod=~"{WORKER_POD_REGEX}", '
+
 
 # for current bp3d-worker naming convention ((bp3d-worker-k8s-...):
 # gets the worker id for a given pod or returns None if it is not a bp3d-worker
@@ -14,16 +21,50 @@ def get_worker_id(pod_name: str, helitack: bool = False) -> str:
     return worker_id
 
 
+# given a series of pod names, return a series of their worker ids (NaN for non-worker pods).
+# The regex only runs once per unique pod name, not once per row
+def get_worker_ids(pods: pd.Series) -> pd.Series:
+    codes, unique_pods = pd.factorize(pods)
+    unique_ids = pd.Series(np.asarray(unique_pods, dtype=object)).str.extract(_WORKER_ID_PATTERN, expand=False)
+    # missing pods have a code of -1, which is pointed at an extra NaN on the end
+    unique_ids = np.append(unique_ids.to_numpy(dtype=object), np.nan)
+    return pd.Series(unique_ids[codes], index=pods.index, name=pods.name)
+
+
 # for every worker pod in a given df, change pod's value to just be the worker id,
 # drop all non-worker pods, then return that new, filtered dataframe
 def filter_df_for_workers(dataframe: pd.DataFrame) -> pd.DataFrame:
-    # run get_worker_id() on all pods to replace the pod with the ensemble or None if not a worker
-    dataframe['Pod'] = dataframe['Pod'].apply(get_worker_id)
+    # replace every pod with its worker id or NaN if not a worker (without changing the given df)
+    dataframe = dataframe.assign(Pod=get_worker_ids(dataframe['Pod']))
     # drop all the rows with non worker pods
     dataframe = dataframe.dropna(subset=["Pod"])
     return dataframe
 
 
+# same as filter_df_for_workers(), for a graph's SeriesSet (see helpers/series_set.py)
+def filter_series_set_for_workers(series_set):
+    worker_ids = get_worker_ids(pd.Series(series_set.get_label_values('pod'), dtype=object))
+    is_worker = worker_ids.notna().to_numpy()
+    return series_set.relabel('pod', worker_ids.tolist()).take(np.flatnonzero(is_worker))
+
+
+# add a matcher for bp3d-worker pods to every selector of a query, so only worker pods are
+# queried instead of every pod in the namespace. The matcher is put just before namespace="
+# (like Graphs._update_query_for_requery()). Queries that already have it are returned as they are
+def add_worker_pod_matcher(query: str) -> str:
+    if _WORKER_POD_MATCHER in query:
+        return query
+    return query.replace('namespace="', _WORKER_POD_MATCHER + 'namespace="')
+
+
+# add_worker_pod_matcher() to every query in a dict of {title: query or list of queries}
+def add_worker_pod_matcher_to_queries(queries: dict[str, str | list[str]]) -> dict[str, str | list[str]]:
+    return {
+        title: [add_worker_pod_matcher(q) for q in query] if isinstance(query, list) else add_worker_pod_matcher(query)
+        for title, query in queries.items()
+    }
+
+
 # potentially useful functions:
 
 # for old bp3d-worker naming convention (bp3d-worker-...):
@@ -0,0 +1,43 @@
+import pandas as pd
+
+# column added to the keys to tell rows with the same keys apart (e.g. the same pod on two nodes
+# when joining on Pod only). The nth row with a key is matched with the nth row with that key
+# in the other dataframes
+_DUPLICATE_KEY = "_duplicate_key"
+
+
+# given dataframes that each have the key columns (e.g. ['Node', 'Pod'] or ['Time', 'Node', 'Pod'])
+# and one or more value columns, return one dataframe with a row for every distinct key and the
+# value columns of every dataframe, in order. A key missing from a dataframe gets NaN in its columns.
+# Rows are matched by their keys instead of their position, so dataframes don't need the same
+# rows in the same order. Rows are in the order their keys first appear (the first dataframe's rows,
+# then keys that only later dataframes have), so e.g. graph rows stay grouped by pod.
+# If categorical_labels is True, the key columns (other than Time) are returned as categoricals
+def join_on_labels(dfs: list[pd.DataFrame], keys: list[str], categorical_labels: bool = False) -> pd.DataFrame:
+    if len(dfs) == 0:
+        return pd.DataFrame(columns=keys)
+    has_duplicates = any(df.duplicated(subset=keys).any() for df in dfs)
+    indexed_dfs = [_index_by_keys(df, keys, has_duplicates) for df in dfs]
+
+    # one multi-way outer join of every dataframe on the union of their keys
+    joined_df = pd.concat(indexed_dfs, axis=1, join="outer", sort=False).reset_index()
+    if has_duplicates:
+        joined_df = joined_df.drop(columns=_DUPLICATE_KEY)
+    joined_df.columns.name = None
+
+    if categorical_labels:
+        for key in keys:
+            if key != 'Time':
+                joined_df[key] = joined_df[key].astype("category")
+    return joined_df
+
+
+def _index_by_keys(df: pd.DataFrame, keys: list[str], has_duplicates: bool) -> pd.DataFrame:
+    # categorical keys are joined by their values, not their codes
+    for key in keys:
+        if isinstance(df[key].dtype, pd.CategoricalDtype):
+            df = df.assign(**{key: df[key].astype(object)})
+    if not has_duplicates:
+        return df.set_index(keys)
+    df = df.assign(**{_DUPLICATE_KEY: df.groupby(keys, sort=False, dropna=False).cumcount()})
+    return df.set_index(keys + [_DUPLICATE_KEY])
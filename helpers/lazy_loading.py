@@ -0,0 +1,88 @@
+import threading
+from collections.abc import MutableMapping
+from functools import partial
+from typing import Callable, Iterable
+from termcolor import colored
+from helpers.concurrency import run_concurrently, SingleFlight
+from inputs import QUERY_POOL_SIZE
+
+
+class LazyDict(MutableMapping):
+    """A dict whose values are only loaded the first time they are accessed
+
+    Created from a dict of {key: function that takes no arguments and returns the value}. Accessing
+    a key calls its function once and keeps the result, so later accesses are free. Threads that
+    access a key while it is loading wait for that load instead of loading it again. A load that
+    raises isn't kept, so the next access tries again. prefetch() loads several keys at once.
+    """
+
+    def __init__(self, loaders: dict[any, Callable]) -> None:
+        # every key in order, with its loader (None for values that were set directly)
+        self._loaders = dict(loaders)
+        self._values = {}
+        self._lock = threading.Lock()
+        self._single_flight = SingleFlight()
+
+    def __getitem__(self, key: any) -> any:
+        with self._lock:
+            if key in self._values:
+                return self._values[key]
+            if key not in self._loaders:
+                raise KeyError(key)
+        value, _ = self._single_flight.do(key, partial(self._load, key))
+        return value
+
+    def __setitem__(self, key: any, value: any) -> None:
+        with self._lock:
+            self._loaders.setdefault(key, None)
+            self._values[key] = value
+
+    def __delitem__(self, key: any) -> None:
+        with self._lock:
+            del self._loaders[key]
+            self._values.pop(key, None)
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._loaders))
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._loaders)
+
+    def __repr__(self) -> str:
+        with self._lock:
+            loaded = [key for key in self._loaders if key in self._values]
+        return f"LazyDict({len(loaded)} of {len(self)} loaded: {loaded!r})"
+
+    def is_loaded(self, key: any) -> bool:
+        with self._lock:
+            return key in self._values
+
+    # load the given keys (every key if None) that aren't loaded yet, at most max_concurrency at a time
+    # (or on a shared executor). Keys that fail to load print a warning and are left unloaded
+    def prefetch(self, keys: Iterable | None = None, max_concurrency: int | None = None,
+                 executor=None, progress_bar: bool = False) -> None:
+        if keys is None:
+            keys = list(self)
+        tasks = {key: partial(self.__getitem__, key) for key in keys if not self.is_loaded(key)}
+        if len(tasks) == 0:
+            return
+        if max_concurrency is None and executor is None:
+            max_concurrency = min(len(tasks), QUERY_POOL_SIZE)
+        results = run_concurrently(
+            tasks, max_concurrency=max_concurrency, executor=executor, progress_bar=progress_bar)
+        for key, result in results.items():
+            if isinstance(result, Exception):
+                print(colored(f"\nLoading '{key}' failed: {result!r}", "red"))
+
+    def _load(self, key: any) -> any:
+        # another caller may have finished loading it while this one was waiting for the lock
+        with self._lock:
+            if key in self._values:
+                return self._values[key]
+            loader = self._loaders[key]
+        value = loader()
+        with self._lock:
+            self._values[key] = value
+        return value
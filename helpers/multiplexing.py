@@ -0,0 +1,98 @@
+"""
+Combines many instant queries into one request.
+
+Every query is tagged with a label holding its index using label_replace, and the tagged queries
+are combined with `or`:
+    label_replace(<query 0>, "query_mux_id", "0", "", "") or label_replace(<query 1>, "query_mux_id", "1", "", "") ...
+Since the tag makes every series' labels unique, `or` keeps every series of every query.
+The combined result is split back into a result list per query by the tag.
+"""
+from concurrent.futures import Executor
+from functools import partial
+from termcolor import colored
+from helpers.concurrency import run_concurrently
+from helpers.querying import query_data
+from inputs import QUERY_TIMEOUT_SEC, QUERY_MUX_MAX_LENGTH
+
+MUX_LABEL = "query_mux_id"
+
+
+# return a query that returns every series of every query, each tagged with MUX_LABEL = its index
+def build_multiplexed_query(queries: list[str]) -> str:
+    return " or ".join(
+        f'label_replace({query}, "{MUX_LABEL}", "{i}", "", "")' for i, query in enumerate(queries))
+
+
+# given the result list of a multiplexed query of num_queries queries, return a result list for
+# every query (by index). The tag label is removed from every series
+def demultiplex_result_list(result_list: list[dict], num_queries: int) -> list[list[dict]]:
+    result_lists = [[] for _ in range(num_queries)]
+    for series in result_list:
+        metric = dict(series['metric'])
+        index = int(metric.pop(MUX_LABEL))
+        result_lists[index].append(dict(series, metric=metric))
+    return result_lists
+
+
+# given a dict of {title: instant query}, return a list of (titles, combined query) for every
+# combined query query_multiplexed() sends. Queries that don't fit in a group with another query
+# aren't combined, so they aren't in the list
+def plan_multiplexed_queries(queries: dict[str, str],
+                             max_query_length: int = QUERY_MUX_MAX_LENGTH) -> list[tuple[list[str], str]]:
+    return [(titles, build_multiplexed_query([queries[title] for title in titles]))
+            for titles in _group_titles(queries, max_query_length) if len(titles) > 1]
+
+
+# given a dict of {title: instant query}, return a dict of {title: result list} using as few
+# requests as possible. Queries are grouped into combined queries of at most max_query_length
+# characters. If a combined query fails, its queries are sent separately instead.
+# The api sometimes returns nothing for a query, so queries that come back empty are also sent
+# separately to retry them (unless requery_empty is False).
+# Like run_concurrently(), a query that fails on its own has the exception as its result.
+# Requests are sent using at most max_concurrency worker threads (one at a time by default),
+# or on executor if it is given. use_cache and refresh_cache are passed on to query_data()
+# pylint: disable=too-many-arguments
+def query_multiplexed(queries: dict[str, str], timeout_sec: int = QUERY_TIMEOUT_SEC,
+                      max_query_length: int = QUERY_MUX_MAX_LENGTH, requery_empty: bool = True,
+                      use_cache: bool = True, refresh_cache: bool = False,
+                      max_concurrency: int | None = None,
+                      executor: Executor | None = None) -> dict[str, list[dict] | Exception]:
+    send = partial(query_data, timeout_sec=timeout_sec, use_cache=use_cache, refresh_cache=refresh_cache)
+    run = partial(run_concurrently, max_concurrency=max_concurrency or 1, executor=executor)
+
+    groups = plan_multiplexed_queries(queries, max_query_length)
+    combined_results = run({
+        i: partial(send, combined_query, handle_fail=False, title=f"Multiplexed ({len(titles)} queries)")
+        for i, (titles, combined_query) in enumerate(groups)
+    })
+    results = {}
+    for (titles, _), combined_result_list in zip(groups, combined_results.values()):
+        if isinstance(combined_result_list, Exception):
+            print(colored(f"\nCombined query of {len(titles)} queries failed ({combined_result_list!r}), "
+                          "sending them separately", "yellow"))
+            continue
+        for title, result_list in zip(titles, demultiplex_result_list(combined_result_list, len(titles))):
+            if len(result_list) > 0 or not requery_empty:
+                results[title] = result_list
+
+    # send the queries that weren't answered by a combined query on their own
+    results.update(run({
+        title: partial(send, query, title=title) for title, query in queries.items() if title not in results
+    }))
+
+    # keep the same order the queries were passed in with
+    return {title: results[title] for title in queries}
+
+
+# split the titles of queries into groups whose combined query is at most max_query_length long
+def _group_titles(queries: dict[str, str], max_query_length: int) -> list[list[str]]:
+    groups = []
+    group_length = 0
+    for i, (title, query) in enumerate(queries.items()):
+        length = len(build_multiplexed_query([query])) + len(str(i)) + len(" or ")
+        if len(groups) == 0 or group_length + length > max_query_length:
+            groups.append([])
+            group_length = 0
+        groups[-1].append(title)
+        group_length += length
+    return groups
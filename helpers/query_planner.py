@@ -0,0 +1,209 @@
+"""
+Plans the instant queries of several collectors (e.g. Header and Tables in get_all_data) so that
+every distinct base series is only queried once.
+
+Every query is reduced to a key for the series it returns:
+    sum by(node, pod) (metric{matchers})
+with the aggregation labels and matchers sorted and whitespace removed. cluster="" is also dropped:
+Tables' queries only return data because the series have no cluster label, so the matcher doesn't
+change which series are selected. Otherwise only queries for exactly the same series share a key,
+so every result is the same as if its query had been sent on its own.
+A ratio query (a / b) whose numerator and denominator are both already being queried by another
+query isn't sent at all: it is calculated locally from their results.
+"""
+import re
+from concurrent.futures import Executor
+from functools import partial
+import numpy as np
+from helpers.cache import normalize_query
+from helpers.decoding import format_value
+from helpers.querying import query_data
+from helpers.concurrency import run_concurrently, replace_failures
+from helpers.multiplexing import query_multiplexed
+from inputs import QUERY_TIMEOUT_SEC, QUERY_MULTIPLEX_INSTANT
+
+_SUM_BY_PATTERN = re.compile(r'^sum\s*by\s*\(([^)]*)\)\s*\((.*)\)$', re.DOTALL)
+_SELECTOR_PATTERN = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)\s*\{(.*)\}$', re.DOTALL)
+_MATCHER_PATTERN = re.compile(r'\s*([a-zA-Z_][a-zA-Z0-9_]*)\s*(=~|!~|!=|=)\s*"((?:[^"\\]|\\.)*)"\s*(,|$)')
+
+
+class QueryPlanner():
+    """Sends the instant queries of several groups (e.g. 'header' and 'tables') with no series queried twice
+
+    Add every group's {title: query} dict with add_queries(), then call execute() to get
+    {group: {title: result list}}. get_report() returns how many queries were saved.
+    """
+
+    def __init__(self, timeout_sec: int = QUERY_TIMEOUT_SEC) -> None:
+        self.timeout_sec = timeout_sec
+        self._queries = {}
+        # the last plan and {series key: title of its first query}, until more queries are added
+        self._plan = None
+        self._titles = {}
+
+    def add_queries(self, group: str, queries: dict[str, str]) -> None:
+        for title, query in queries.items():
+            self._queries[(group, title)] = query
+        self._plan = None
+
+    # returns ({series key: query to send}, {(group, title): series key or (numerator key, denominator key)})
+    def plan(self) -> tuple[dict[str, str], dict[tuple[str, str], str | tuple[str, str]]]:
+        if self._plan is not None:
+            return self._plan
+        base_queries = {}
+        titles = {}
+        derivations = {}
+        ratios = {}
+        # every query that isn't a ratio is a base series
+        for group_and_title, query in self._queries.items():
+            operands = split_ratio(query)
+            if operands is not None:
+                ratios[group_and_title] = operands
+                continue
+            key = get_series_key(query)
+            base_queries.setdefault(key, query)
+            titles.setdefault(key, group_and_title[1])
+            derivations[group_and_title] = key
+
+        # ratios of two base series are calculated locally, other ratios are sent as they are
+        for group_and_title, (numerator, denominator) in ratios.items():
+            numerator_key = get_series_key(numerator)
+            denominator_key = get_series_key(denominator)
+            if numerator_key in base_queries and denominator_key in base_queries:
+                derivations[group_and_title] = (numerator_key, denominator_key)
+                continue
+            key = get_series_key(self._queries[group_and_title])
+            base_queries.setdefault(key, self._queries[group_and_title])
+            titles.setdefault(key, group_and_title[1])
+            derivations[group_and_title] = key
+        self._plan = base_queries, derivations
+        self._titles = titles
+        return self._plan
+
+    # query every base series once, then return {group: {title: result list}} for every query added.
+    # Failed queries print a warning and have an empty result list.
+    # use_cache and refresh_cache are passed on to query_data() (e.g. use_cache=False for live refreshes).
+    # If progress_bars is False, no progress bar is printed while queries are sent concurrently
+    # pylint: disable=too-many-arguments
+    def execute(self, max_concurrency: int | None = None, executor: Executor | None = None,
+                multiplex: bool = QUERY_MULTIPLEX_INSTANT, use_cache: bool = True,
+                refresh_cache: bool = False, progress_bars: bool = True) -> dict[str, dict[str, list[dict]]]:
+        base_queries, derivations = self.plan()
+        send = partial(query_data, timeout_sec=self.timeout_sec, use_cache=use_cache, refresh_cache=refresh_cache)
+        if multiplex:
+            base_results = query_multiplexed(base_queries, timeout_sec=self.timeout_sec,
+                                             use_cache=use_cache, refresh_cache=refresh_cache,
+                                             max_concurrency=max_concurrency, executor=executor)
+        elif max_concurrency is not None or executor is not None:
+            tasks = {key: partial(send, query, title=self._get_title(key)) for key, query in base_queries.items()}
+            base_results = run_concurrently(
+                tasks, max_concurrency=max_concurrency, executor=executor,
+                progress_bar=progress_bars and executor is None)
+        else:
+            base_results = {}
+            for key, query in base_queries.items():
+                try:
+                    base_results[key] = send(query, title=self._get_title(key))
+                # pylint: disable=broad-exception-caught
+                except Exception as exc:
+                    base_results[key] = exc
+        base_results = replace_failures(base_results, default=[])
+
+        results = {}
+        for (group, title), derivation in derivations.items():
+            if isinstance(derivation, tuple):
+                result_list = divide_result_lists(base_results[derivation[0]], base_results[derivation[1]])
+            else:
+                result_list = base_results[derivation]
+            results.setdefault(group, {})[title] = result_list
+        return results
+
+    # returns how many queries were added, how many were sent, how many that saved, and which
+    # queries were calculated locally
+    def get_report(self) -> dict:
+        base_queries, derivations = self.plan()
+        return {
+            "queries": len(self._queries),
+            "queries_sent": len(base_queries),
+            "queries_eliminated": len(self._queries) - len(base_queries),
+            "calculated_locally": [f"{group}: {title}" for (group, title), derivation in derivations.items()
+                                   if isinstance(derivation, tuple)]
+        }
+
+    # the title of the first query of a series, for telemetry
+    def _get_title(self, key: str) -> str:
+        return self._titles.get(key, key)
+
+
+# if a query is a ratio of two expressions (a / b, with the / outside of any parentheses,
+# brackets, or strings), return (a, b). Otherwise return None
+def split_ratio(query: str) -> tuple[str, str] | None:
+    depth = 0
+    in_string = False
+    split_index = None
+    for i, char in enumerate(query):
+        if in_string:
+            if char == '"' and query[i - 1] != '\\':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "([{":
+            depth += 1
+        elif char in ")]}":
+            depth -= 1
+        elif char == '/' and depth == 0:
+            # only plain ratios of two expressions are split
+            if split_index is not None:
+                return None
+            split_index = i
+    if split_index is None:
+        return None
+    return query[:split_index].strip(), query[split_index + 1:].strip()
+
+
+# return a key for the series a query returns (see the module docstring).
+# Queries that aren't a sum by() of a single selector are keyed by their normalized text
+def get_series_key(query: str) -> str:
+    query = query.strip()
+    sum_by = _SUM_BY_PATTERN.match(query)
+    if sum_by is None:
+        return normalize_query(query)
+    selector = _SELECTOR_PATTERN.match(sum_by.group(2).strip())
+    matchers = _parse_matchers(selector.group(2)) if selector is not None else None
+    if matchers is None:
+        return normalize_query(query)
+
+    metric = selector.group(1)
+    matchers.discard(('cluster', '=', ''))
+
+    labels = ",".join(sorted(label.strip() for label in sum_by.group(1).split(",")))
+    matchers_str = ",".join(f'{name}{op}"{value}"' for name, op, value in sorted(matchers))
+    return f"sum by({labels}) ({metric}{{{matchers_str}}})"
+
+
+# given the inside of a selector's {}, return a set of (label, operator, value), or None if it can't be parsed
+def _parse_matchers(matchers_str: str) -> set[tuple[str, str, str]] | None:
+    matchers = set()
+    position = 0
+    while position < len(matchers_str.rstrip()):
+        matcher = _MATCHER_PATTERN.match(matchers_str, position)
+        if matcher is None:
+            return None
+        matchers.add(matcher.group(1, 2, 3))
+        position = matcher.end()
+    return matchers
+
+
+# divide every series of the numerator by the series of the denominator with the same labels
+# (like prometheus' one-to-one vector matching). Series without a match are dropped
+def divide_result_lists(numerator: list[dict], denominator: list[dict]) -> list[dict]:
+    denominators_by_labels = {tuple(sorted(series['metric'].items())): series for series in denominator}
+    result_list = []
+    for series in numerator:
+        denominator_series = denominators_by_labels.get(tuple(sorted(series['metric'].items())))
+        if denominator_series is None:
+            continue
+        with np.errstate(divide="ignore", invalid="ignore"):
+            value = np.float64(series['value'][1]) / np.float64(denominator_series['value'][1])
+        result_list.append({'metric': dict(series['metric']), 'value': [series['value'][0], format_value(value)]})
+    return result_list
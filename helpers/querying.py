@@ -1,67 +1,493 @@
 import json
+import math
+import time
+import random
+import threading
+from functools import partial
+from urllib.parse import parse_qsl
 from termcolor import colored
 import requests
-from inputs import QUERY_TIMEOUT_SEC
+from requests.adapters import HTTPAdapter
+from helpers.cache import QueryCache, get_request_key, time_param_to_seconds, step_param_to_seconds
+from helpers.concurrency import SingleFlight, run_concurrently
+from helpers.recording import QueryRecorder
+from helpers.series_store import SeriesStore
+from helpers.telemetry import QueryTelemetry, count_series_and_samples
+from helpers.rate_limiting import AdaptiveConcurrencyLimiter, HostRateLimiter, CircuitBreaker
+from inputs import (BASE_URL, QUERY_TIMEOUT_SEC, QUERY_POOL_SIZE, QUERY_MAX_RETRIES, QUERY_EMPTY_RETRIES,
+                    QUERY_BACKOFF_SEC, QUERY_MAX_BACKOFF_SEC, QUERY_CACHE_ENABLED, SERIES_STORE_ENABLED, QUERY_RECORD_DIR,
+                    QUERY_TELEMETRY_IN_MEMORY, QUERY_TELEMETRY_MAX_ENTRIES, QUERY_TELEMETRY_FILE, QUERY_ADAPTIVE_CONCURRENCY,
+                    QUERY_MIN_CONCURRENCY, QUERY_INITIAL_CONCURRENCY, QUERY_MAX_CONCURRENCY,
+                    QUERY_TARGET_LATENCY_SEC, QUERY_MAX_RPS, QUERY_RATE_LIMIT_FILE,
+                    QUERY_BREAKER_FAILURES, QUERY_BREAKER_RESET_SEC, QUERY_SINGLE_FLIGHT,
+                    QUERY_MAX_GET_LENGTH, QUERY_RANGE_STEP_ALIGN, QUERY_RANGE_BUCKET_SEC,
+                    QUERY_RANGE_BUCKET_MIN_POINTS, QUERY_RANGE_BUCKET_CONCURRENCY, QUERY_RANGE_MAX_POINTS)
+
+# responses worth retrying: rate limited or the server/gateway is having trouble
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+class QueryClient():
+    """Shared http client for querying the prometheus (thanos) api
+
+    Keeps a persistent session with a pool of keep-alive connections so that repeated queries
+    don't pay for a new TCP + TLS handshake each time. Responses are requested gzip compressed,
+    query parameters are url encoded by requests, and failed requests are retried with
+    exponential backoff and jitter.
+    If a QueryCache is given, results are looked up there before being requested.
+    Range queries are snapped to multiples of their step and requested in aligned buckets (see
+    _request_buckets()) unless step_align is False, so sliding windows re-use cached buckets.
+    Either way, no single request returns more than max_points_per_query points per series.
+    If a SeriesStore is given, range queries are answered from it first, and only the parts of
+    the time range it doesn't have are requested (and then stored).
+    If a QueryRecorder is given, every api response is saved as a fixture for the replay server
+    (the cache is only written to, not read from, while recording so every query gets recorded).
+    If a QueryTelemetry is given, every query (including cache hits and failures) is recorded there.
+    Every request to the api waits for the circuit breaker, host rate limiter, and concurrency
+    limiter that are given (see helpers/rate_limiting.py), so callers can send queries from as many
+    threads as they like without overloading the api.
+    If a SingleFlight is given, a request identical (same normalized query and times) to one already
+    in flight waits for that request's result instead of being sent again.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, base_url: str = BASE_URL, pool_size: int = QUERY_POOL_SIZE,
+                 max_retries: int = QUERY_MAX_RETRIES, empty_retries: int = QUERY_EMPTY_RETRIES,
+                 backoff_seconds: float = QUERY_BACKOFF_SEC,
+                 max_backoff_seconds: float = QUERY_MAX_BACKOFF_SEC,
+                 cache: QueryCache | None = None, recorder: QueryRecorder | None = None,
+                 telemetry: QueryTelemetry | None = None,
+                 concurrency_limiter: AdaptiveConcurrencyLimiter | None = None,
+                 rate_limiter: HostRateLimiter | None = None,
+                 circuit_breaker: CircuitBreaker | None = None,
+                 single_flight: SingleFlight | None = None,
+                 store: SeriesStore | None = None, step_align: bool = QUERY_RANGE_STEP_ALIGN,
+                 max_points_per_query: int | None = QUERY_RANGE_MAX_POINTS) -> None:
+        self.base_url = base_url if base_url.endswith("/") else base_url + "/"
+        self.max_retries = max_retries
+        self.empty_retries = empty_retries
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.cache = cache
+        self.recorder = recorder
+        self.telemetry = telemetry
+        self.concurrency_limiter = concurrency_limiter
+        self.rate_limiter = rate_limiter
+        self.circuit_breaker = circuit_breaker
+        self.single_flight = single_flight
+        self.store = store
+        self.step_align = step_align
+        self.max_points_per_query = max_points_per_query
+        # retries are handled in _request, so the adapter itself never retries
+        self._adapter = HTTPAdapter(pool_maxsize=pool_size, max_retries=0)
+        self._session = requests.Session()
+        self._session.mount("https://", self._adapter)
+        self._session.mount("http://", self._adapter)
+        self._session.headers.update({
+            "Accept": "application/json",
+            "Accept-Encoding": "gzip, deflate"
+        })
+        self._stats_lock = threading.Lock()
+        self._num_retries = 0
+
+    # query for a single datapoint per series (instant query)
+    # use_cache=False skips the cache entirely. refresh_cache=True re-requests and re-saves the result
+    # title is what the query is recorded as in telemetry (e.g. "CPU Usage")
+    def query(self, query: str, timeout_sec: int = QUERY_TIMEOUT_SEC, handle_fail: bool = True,
+              use_cache: bool = True, refresh_cache: bool = False, title: str | None = None) -> list[dict]:
+        return self._request("query", {"query": query}, timeout_sec, handle_fail,
+                             use_cache=use_cache, refresh_cache=refresh_cache, title=title)
+
+    # query for several datapoints per series over a time range. time_filter is in the form
+    # 'start=<time>&end=<time>&step=<time str>' (see Graphs._assemble_time_filter())
+    def query_range(self, query: str, time_filter: str, timeout_sec: int = QUERY_TIMEOUT_SEC,
+                    handle_fail: bool = True, use_cache: bool = True,
+                    refresh_cache: bool = False, title: str | None = None) -> list[dict]:
+        params = {"query": query}
+        params.update(parse_qsl(time_filter))
+        start = time_param_to_seconds(params["start"])
+        end = time_param_to_seconds(params["end"])
+        step = step_param_to_seconds(params["step"])
+        # snap the range to multiples of the step, so windows that end at "now" line up from run to run
+        if self.step_align and step > 0:
+            start, end = align_to_step(start, step), align_to_step(end, step)
+
+        def fetch(fetch_start: float, fetch_end: float) -> list[dict]:
+            return self._request_buckets(params, fetch_start, fetch_end, step, timeout_sec, handle_fail,
+                                         use_cache=use_cache, refresh_cache=refresh_cache, title=title)
+        # the store is skipped while recording so every query gets recorded.
+        # Otherwise only the parts of the range that aren't stored are requested
+        if self.store is None or not use_cache or self.recorder is not None:
+            return fetch(start, end)
+        return self.store.query_range(query, start, end, step, fetch, refresh=refresh_cache, base_url=self.base_url)
+
+    # returns how many requests were sent, how many tcp connections were opened for them,
+    # how many requests reused an already open connection, and how many retries happened
+    def get_connection_stats(self) -> dict[str, int]:
+        num_requests = 0
+        num_opened = 0
+        pools = self._adapter.poolmanager.pools
+        for pool_key in pools.keys():
+            pool = pools.get(pool_key)
+            if pool is None:
+                continue
+            num_requests += pool.num_requests
+            num_opened += pool.num_connections
+        with self._stats_lock:
+            num_retries = self._num_retries
+        return {
+            "requests": num_requests,
+            "connections_opened": num_opened,
+            "connections_reused": num_requests - num_opened,
+            "retries": num_retries
+        }
+
+    # returns the stats of the concurrency limiter, rate limiter, and circuit breaker in use
+    def get_load_limiting_stats(self) -> dict[str, dict]:
+        stats = {}
+        if self.concurrency_limiter is not None:
+            stats["concurrency"] = self.concurrency_limiter.get_stats()
+        if self.rate_limiter is not None:
+            stats["rate"] = self.rate_limiter.get_stats()
+        if self.circuit_breaker is not None:
+            stats["circuit_breaker"] = self.circuit_breaker.get_stats()
+        return stats
+
+    # returns how many requests were sent and how many were saved by waiting for an identical
+    # request that was already in flight
+    def get_coalescing_stats(self) -> dict[str, int]:
+        if self.single_flight is None:
+            return {"executed": 0, "coalesced": 0}
+        return self.single_flight.get_stats()
+
+    # close all open connections
+    def close(self) -> None:
+        self._session.close()
+        if self.telemetry is not None:
+            self.telemetry.close()
+
+    # wait before the next attempt: a random time up to backoff_seconds * 2^attempt (full jitter)
+    def _backoff(self, attempt: int) -> None:
+        with self._stats_lock:
+            self._num_retries += 1
+        max_wait = min(self.max_backoff_seconds, self.backoff_seconds * 2**attempt)
+        time.sleep(random.uniform(0, max_wait))
+
+    # return the result list for a request, from the cache if possible, otherwise from the api
+    # pylint: disable=too-many-arguments
+    def _request(self, endpoint: str, params: dict[str, str], timeout_sec: int, handle_fail: bool,
+                 use_cache: bool = True, refresh_cache: bool = False, title: str | None = None) -> list[dict]:
+        start = time.perf_counter()
+        # results are cached per server, so e.g. a replay server's results are never used for the real api
+        base_url = self.base_url
+        cache = self.cache if use_cache else None
+        # live instant queries are snapshots of "now", so they skip the cache (see QueryCache.is_cacheable())
+        if cache is not None and not cache.is_cacheable(endpoint, params):
+            cache = None
+        if cache is not None and not refresh_cache and self.recorder is None:
+            res_list = cache.get(endpoint, params, base_url)
+            if res_list is not None:
+                self._record_telemetry(endpoint, params, start, title, res_list, cache_status="hit")
+                return res_list
+
+        # cache status for telemetry: off (no cache), bypass (use_cache=False), refresh, or miss.
+        # coalesced if the result came from an identical request that was already in flight
+        cache_status = "off"
+        if cache is not None:
+            cache_status = "refresh" if refresh_cache else "miss"
+        elif self.cache is not None:
+            cache_status = "bypass"
+        try:
+            if self.single_flight is None:
+                res_list, num_bytes, num_retries = self._send_and_cache(
+                    endpoint, params, timeout_sec, handle_fail, cache, base_url)
+            else:
+                (res_list, num_bytes, num_retries), shared = self.single_flight.do(
+                    (get_request_key(endpoint, params, base_url), handle_fail),
+                    lambda: self._send_and_cache(endpoint, params, timeout_sec, handle_fail, cache, base_url))
+                if shared:
+                    cache_status, num_bytes, num_retries = "coalesced", 0, 0
+        except Exception as exc:
+            self._record_telemetry(endpoint, params, start, title, [],
+                                   cache_status=cache_status, error=repr(exc))
+            raise
+        self._record_telemetry(endpoint, params, start, title, res_list, num_bytes=num_bytes,
+                               retries=num_retries, cache_status=cache_status)
+        return res_list
+
+    # request a range query, splitting off every bucket of get_bucket_seconds(step) (starting at a multiple
+    # of the bucket size) that the range covers whole and that has ended. Those are cached under the same key
+    # by every range that covers them. The parts of the range before and after them are requested as they
+    # are, so a range without a whole bucket (e.g. a short or recent one) is a single request.
+    # If step_align is off, the range is requested as is. Any part with more than max_points_per_query
+    # points per series is split up further (see split_range()). Returns the samples between start and end
+    # pylint: disable=too-many-arguments
+    def _request_buckets(self, params: dict[str, str], start: float, end: float, step: float, timeout_sec: int,
+                         handle_fail: bool, use_cache: bool = True, refresh_cache: bool = False,
+                         title: str | None = None) -> list[dict]:
+        request = partial(self._request, "query_range", timeout_sec=timeout_sec, handle_fail=handle_fail,
+                          use_cache=use_cache, refresh_cache=refresh_cache, title=title)
+        if step <= 0:
+            return request({**params, "start": repr(start), "end": repr(end)})
+
+        parts = []
+        if self.step_align:
+            # the whole, ended buckets in the range
+            bucket_seconds = get_bucket_seconds(step)
+            last_end = min(end, time.time())
+            bucket_start = align_to_step(start, bucket_seconds)
+            if bucket_start < start:
+                bucket_start += bucket_seconds
+            while bucket_start + bucket_seconds - step <= last_end:
+                parts.append((bucket_start, bucket_start + bucket_seconds - step))
+                bucket_start += bucket_seconds
+        if len(parts) == 0:
+            parts = [(start, end)]
+        # the edges of the range that aren't a whole bucket
+        if parts[0][0] > start:
+            parts.insert(0, (start, parts[0][0] - step))
+        if parts[-1][1] < end:
+            parts.append((parts[-1][1] + step, end))
+        parts = [sub_range for part_start, part_end in parts
+                 for sub_range in split_range(part_start, part_end, step, self.max_points_per_query)]
+
+        tasks = {part_start: partial(request, {**params, "start": repr(part_start), "end": repr(part_end)})
+                 for part_start, part_end in parts}
+        if len(tasks) == 1:
+            return next(iter(tasks.values()))()
+        results = run_concurrently(tasks, max_concurrency=min(len(tasks), QUERY_RANGE_BUCKET_CONCURRENCY))
+        # a missing part would leave a silent gap in the range, so fail the whole range instead
+        for result in results.values():
+            if isinstance(result, Exception):
+                raise result
+        return stitch_buckets(list(results.values()), start, end)
+
+    # send a request and save its result to the cache (if given) under base_url. Returns the same as _send()
+    # pylint: disable=too-many-arguments
+    def _send_and_cache(self, endpoint: str, params: dict[str, str], timeout_sec: int, handle_fail: bool,
+                        cache: QueryCache | None, base_url: str | None = None) -> tuple[list[dict], int, int]:
+        res_list, num_bytes, num_retries = self._send(endpoint, params, timeout_sec, handle_fail)
+        if cache is not None:
+            cache.put(endpoint, params, res_list, base_url)
+        return res_list, num_bytes, num_retries
+
+    # pylint: disable=too-many-arguments
+    def _record_telemetry(self, endpoint: str, params: dict[str, str], start: float, title: str | None,
+                          res_list: list[dict], num_bytes: int = 0, retries: int = 0,
+                          cache_status: str = "off", error: str | None = None) -> None:
+        if self.telemetry is None:
+            return
+        num_series, num_samples = count_series_and_samples(res_list)
+        self.telemetry.record(
+            params["query"], endpoint, time.perf_counter() - start, title=title,
+            num_bytes=num_bytes, num_series=num_series, num_samples=num_samples,
+            retries=retries, cache_status=cache_status, error=error)
+
+    # send a request to the given endpoint, retrying on connection errors, timeouts, retryable
+    # status codes, and (if handle_fail) empty results.
+    # Returns (result list, bytes in the final response, number of retries)
+    def _send(self, endpoint: str, params: dict[str, str], timeout_sec: int,
+              handle_fail: bool) -> tuple[list[dict], int, int]:
+        url = self.base_url + endpoint
+        attempt = 0
+        empty_attempts = 0
+        while True:
+            try:
+                response = self._get(url, params, timeout_sec)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= self.max_retries:
+                    raise
+                self._backoff(attempt)
+                attempt += 1
+                continue
+
+            if response.status_code in RETRY_STATUS_CODES:
+                if attempt < self.max_retries:
+                    self._backoff(attempt)
+                    attempt += 1
+                    continue
+                # out of retries. This is the server failing, not a bad query, so raise an HTTPError with the status
+                response.raise_for_status()
+
+            try:
+                queried_data = response.json()
+                res_list = queried_data['data']['result']
+            except (ValueError, KeyError, TypeError):
+                print(f'\n\nqueried_data is\n{colored(response.text, "red")}\n')
+                # pylint: disable=raise-missing-from
+                raise TypeError(f'\n\nBad query string: \n{params}\n\n')
+
+            # there is a bug with the api itself where some requests come back with no data.
+            # handle_fail retries those after backing off for a bit
+            if handle_fail and len(res_list) == 0 and empty_attempts < self.empty_retries:
+                self._backoff(empty_attempts)
+                empty_attempts += 1
+                continue
+
+            if self.recorder is not None:
+                self.recorder.record(endpoint, params, queried_data, recorded_at=time.time())
+            return res_list, len(response.content), attempt + empty_attempts
+
+    # send a single request once the circuit breaker, rate limiter, and concurrency limiter allow it.
+    # Long queries are sent as a POST (form encoded body) so they don't exceed url length limits.
+    # Connection errors, timeouts, and retryable status codes count as failures for the limiters
+    def _get(self, url: str, params: dict[str, str], timeout_sec: int) -> requests.Response:
+        if self.circuit_breaker is not None:
+            self.circuit_breaker.before_request()
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+        if self.concurrency_limiter is not None:
+            self.concurrency_limiter.acquire()
+        start = time.perf_counter()
+        success = False
+        try:
+            if len(params["query"]) > QUERY_MAX_GET_LENGTH:
+                response = self._session.post(url, data=params, timeout=timeout_sec)
+            else:
+                response = self._session.get(url, params=params, timeout=timeout_sec)
+            success = response.status_code not in RETRY_STATUS_CODES
+            return response
+        finally:
+            if self.concurrency_limiter is not None:
+                self.concurrency_limiter.release(time.perf_counter() - start, success)
+            if self.circuit_breaker is not None:
+                if success:
+                    self.circuit_breaker.record_success()
+                else:
+                    self.circuit_breaker.record_failure()
+
+
+_shared_client = None
+_shared_client_lock = threading.Lock()
+
+
+# get the QueryClient that every query goes through, creating it the first time it is needed
+def get_query_client() -> QueryClient:
+    # pylint: disable=global-statement
+    global _shared_client
+    with _shared_client_lock:
+        if _shared_client is None:
+            cache = QueryCache() if QUERY_CACHE_ENABLED else None
+            store = SeriesStore() if SERIES_STORE_ENABLED else None
+            recorder = QueryRecorder(QUERY_RECORD_DIR) if QUERY_RECORD_DIR else None
+            telemetry = QueryTelemetry(
+                file_path=QUERY_TELEMETRY_FILE, keep_in_memory=QUERY_TELEMETRY_IN_MEMORY,
+                max_entries=QUERY_TELEMETRY_MAX_ENTRIES)
+            concurrency_limiter = None
+            if QUERY_ADAPTIVE_CONCURRENCY:
+                concurrency_limiter = AdaptiveConcurrencyLimiter(
+                    min_limit=QUERY_MIN_CONCURRENCY, initial_limit=QUERY_INITIAL_CONCURRENCY,
+                    max_limit=QUERY_MAX_CONCURRENCY, target_latency_seconds=QUERY_TARGET_LATENCY_SEC)
+            rate_limiter = HostRateLimiter(QUERY_MAX_RPS, state_file=QUERY_RATE_LIMIT_FILE) if QUERY_MAX_RPS else None
+            circuit_breaker = CircuitBreaker(
+                failure_threshold=QUERY_BREAKER_FAILURES, reset_seconds=QUERY_BREAKER_RESET_SEC)
+            single_flight = SingleFlight() if QUERY_SINGLE_FLIGHT else None
+            _shared_client = QueryClient(
+                cache=cache, recorder=recorder, telemetry=telemetry, concurrency_limiter=concurrency_limiter,
+                rate_limiter=rate_limiter, circuit_breaker=circuit_breaker, single_flight=single_flight,
+                store=store)
+        return _shared_client
+
+
+# replace the shared QueryClient (e.g. to change the pool size or retry settings)
+def set_query_client(client: QueryClient) -> None:
+    # pylint: disable=global-statement
+    global _shared_client
+    with _shared_client_lock:
+        if _shared_client is not None and _shared_client is not client:
+            _shared_client.close()
+        _shared_client = client
+
+
+# get the telemetry that every query sent through the shared QueryClient is recorded to
+def get_query_telemetry() -> QueryTelemetry | None:
+    return get_query_client().telemetry
+
+
+# point every query at a different api (e.g. "http://localhost:9090/api/v1/" for a replay server)
+def set_base_url(base_url: str) -> None:
+    client = get_query_client()
+    client.base_url = base_url if base_url.endswith("/") else base_url + "/"
 
 
 # Use url and a given query to request data from the website
-def query_data(query: str, timeout_sec:int=QUERY_TIMEOUT_SEC, handle_fail: bool = True) -> list[dict]:
+def query_data(query: str, timeout_sec: int = QUERY_TIMEOUT_SEC, handle_fail: bool = True,
+               use_cache: bool = True, refresh_cache: bool = False, title: str | None = None) -> list[dict]:
     # handle_fail will re request the api if no response from query. Set to true by default
     # there is a bug with the api itself where every fifth request comes back with no data,
     # this parameter set to True will re request to deal with that
     # It is highly recommended that handle_fail is always set to True.
-
-    # set up url
-    base_url = "https://thanos.nrp-nautilus.io/api/v1/"
-    endpoint = f"query?query={query}"
-    full_url = base_url + endpoint
-    # query database
-    queried_data = requests.get(full_url, timeout=timeout_sec).json()
-
-    # re-request data if it comes back with no value
-    if handle_fail:
-        try:
-            res_list = queried_data['data']['result']
-            if len(res_list) == 0:
-                queried_data = requests.get(
-                    full_url, timeout=timeout_sec).json()
-        except KeyError:
-            print(f'\n\nqueried_data is\n{colored(queried_data,"red")}\n')
-            # pylint: disable=raise-missing-from
-            raise TypeError(
-                f'\n\nBad query string: {query}\n\n')
-
-    return queried_data['data']['result']
+    # use_cache=False bypasses the query cache, refresh_cache=True re-requests and updates it
+    # title is what the query is recorded as in telemetry
+    return get_query_client().query(
+        query, timeout_sec=timeout_sec, handle_fail=handle_fail,
+        use_cache=use_cache, refresh_cache=refresh_cache, title=title)
 
 
 # Use url and a given query and time_filter to request data for a graph from the api
 # Different function from query_data() to avoid confusion with querying single data points and tables vs graphs
-def query_data_for_graph(query: str, time_filter: str, timeout_sec=QUERY_TIMEOUT_SEC, handle_fail: bool = True) -> list[dict]:
+def query_data_for_graph(query: str, time_filter: str, timeout_sec=QUERY_TIMEOUT_SEC, handle_fail: bool = True,
+                         use_cache: bool = True, refresh_cache: bool = False, title: str | None = None) -> list[dict]:
     # handle_fail will re request the api if it gets no response from your query. Set to true by default
     # there is a bug with the api itself where every fifth request comes back with no data,
     # this parameter set to True will re request to deal with that
     # It is highly recommended that handle_fail is always set to True.
+    # use_cache=False bypasses the query cache, refresh_cache=True re-requests and updates it
+    # title is what the query is recorded as in telemetry
+    return get_query_client().query_range(
+        query, time_filter, timeout_sec=timeout_sec, handle_fail=handle_fail,
+        use_cache=use_cache, refresh_cache=refresh_cache, title=title)
 
-    # set up url
-    base_url = 'https://thanos.nrp-nautilus.io/api/v1/'
-    endpoint = f'query_range?query={query}&{time_filter}'
-    full_url = base_url + endpoint
-    # query database
-    queried_data = requests.get(full_url, timeout=timeout_sec).json()
 
-    # re-request data if it comes back with no value
-    if (handle_fail):
-        try:
-            res_list = queried_data['data']['result']
-            if (len(res_list) == 0):
-                queried_data = requests.get(
-                    full_url, timeout=timeout_sec).json()
-        except KeyError:
-            print(f'\n\nqueried_data is\n{colored(queried_data,"red")}\n')
-            # pylint: disable=raise-missing-from
-            raise TypeError(f'\n\nBad query string: \n{full_url}\n\n')
-
-    return queried_data['data']['result']
+# given a unix time and a step (seconds), return the last multiple of the step at or before the time
+def align_to_step(time_seconds: float, step_seconds: float) -> float:
+    return math.floor(time_seconds / step_seconds + 1e-9) * step_seconds
+
+
+# given a step (seconds), return the size of the buckets range queries are requested in: the first
+# size in QUERY_RANGE_BUCKET_SEC with at least QUERY_RANGE_BUCKET_MIN_POINTS points (or the last size),
+# rounded up to a multiple of the step so every bucket starts on the step grid
+def get_bucket_seconds(step_seconds: float) -> float:
+    bucket_seconds = QUERY_RANGE_BUCKET_SEC[-1]
+    for size in QUERY_RANGE_BUCKET_SEC:
+        if size / step_seconds >= QUERY_RANGE_BUCKET_MIN_POINTS:
+            bucket_seconds = size
+            break
+    return math.ceil(bucket_seconds / step_seconds - 1e-9) * step_seconds
+
+
+# given a range (unix seconds) and step (seconds), return it split into consecutive (start, end) sub-ranges
+# of at most max_points points each (prometheus/thanos limit the points per series of one range query).
+# Every sub-range starts on the range's step grid and ends one step before the next one starts.
+# If max_points is None, the range isn't split
+def split_range(start: float, end: float, step: float, max_points: int | None) -> list[tuple[float, float]]:
+    num_points = int((end - start) / step + 1e-9) + 1
+    if max_points is None or num_points <= max_points:
+        return [(start, end)]
+    sub_ranges = [(start + first_point * step, start + (first_point + max_points - 1) * step)
+                  for first_point in range(0, num_points, max_points)]
+    # make sure the last sub-range ends exactly where the full range does
+    sub_ranges[-1] = (sub_ranges[-1][0], end)
+    return sub_ranges
+
+
+# given result lists of consecutive buckets (in time order), return one result list of every
+# series' samples between start and end (unix seconds, inclusive)
+def stitch_buckets(result_lists: list[list[dict]], start: float, end: float) -> list[dict]:
+    # timestamps come back rounded to ms
+    start, end = start - 0.0005, end + 0.0005
+    series_by_labels = {}
+    for result_list in result_lists:
+        for series in result_list:
+            values = [pair for pair in series['values'] if start <= pair[0] <= end]
+            if len(values) == 0:
+                continue
+            labels = tuple(sorted(series['metric'].items()))
+            if labels not in series_by_labels:
+                series_by_labels[labels] = {'metric': series['metric'], 'values': values}
+            else:
+                series_by_labels[labels]['values'].extend(values)
+    return list(series_by_labels.values())
 
 
 # writes json data to a file
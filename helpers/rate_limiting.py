@@ -0,0 +1,215 @@
+"""
+Keeps the query layer from overloading the shared thanos api.
+
+AdaptiveConcurrencyLimiter - limits requests in flight, raising the limit while the api is fast
+                             and cutting it when the api slows down or fails (AIMD)
+HostRateLimiter            - a requests per second ceiling shared by every thread and process
+                             on the host
+CircuitBreaker             - fails queries fast once the api is clearly unhealthy
+"""
+import os
+import time
+import threading
+from contextlib import contextmanager
+try:
+    import fcntl
+except ImportError:  # not available on windows, where the rate limit is only per process
+    fcntl = None
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of sending a request while the circuit breaker is open"""
+
+
+class AdaptiveConcurrencyLimiter():
+    """Limits the number of requests in flight, adjusting the limit with AIMD
+
+    Every request that succeeds faster than target_latency_seconds raises the limit by
+    1/limit (so about 1 per limit's worth of requests). A request that fails or is slower than
+    the target multiplies the limit by decrease_factor, at most once per decrease_interval_seconds
+    so one burst of failures doesn't collapse the limit to the minimum.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, min_limit: int = 1, initial_limit: int = 4, max_limit: int = 10,
+                 target_latency_seconds: float = 5, decrease_factor: float = 0.5,
+                 decrease_interval_seconds: float = 1) -> None:
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.target_latency_seconds = target_latency_seconds
+        self.decrease_factor = decrease_factor
+        self.decrease_interval_seconds = decrease_interval_seconds
+        self._limit = float(min(max(initial_limit, min_limit), max_limit))
+        self._in_flight = 0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+        self._stats = {"increases": 0, "decreases": 0, "max_in_flight": 0}
+
+    @property
+    def limit(self) -> int:
+        with self._condition:
+            return int(self._limit)
+
+    # wait until there is room for another request in flight
+    def acquire(self) -> None:
+        with self._condition:
+            while self._in_flight >= int(self._limit):
+                self._condition.wait()
+            self._in_flight += 1
+            self._stats["max_in_flight"] = max(self._stats["max_in_flight"], self._in_flight)
+
+    # finish a request, adjusting the limit by how it went
+    def release(self, latency_seconds: float, success: bool) -> None:
+        with self._condition:
+            self._in_flight -= 1
+            now = time.monotonic()
+            if success and latency_seconds <= self.target_latency_seconds:
+                if self._limit < self.max_limit:
+                    self._limit = min(self.max_limit, self._limit + 1 / self._limit)
+                    self._stats["increases"] += 1
+            elif now - self._last_decrease >= self.decrease_interval_seconds:
+                self._limit = max(self.min_limit, self._limit * self.decrease_factor)
+                self._last_decrease = now
+                self._stats["decreases"] += 1
+            self._condition.notify_all()
+
+    # send requests inside of the with block, e.g.
+    #   with limiter.request() as outcome:
+    #       response = session.get(...)
+    #       outcome["success"] = response.ok
+    @contextmanager
+    def request(self):
+        self.acquire()
+        outcome = {"success": False}
+        start = time.perf_counter()
+        try:
+            yield outcome
+        finally:
+            self.release(time.perf_counter() - start, outcome["success"])
+
+    def get_stats(self) -> dict[str, float]:
+        with self._condition:
+            return dict(self._stats, limit=round(self._limit, 2), in_flight=self._in_flight)
+
+
+class HostRateLimiter():
+    """Spaces requests at least 1/max_rps seconds apart across every thread and process on the host
+
+    The time the next request may be sent is kept in state_file. Each request locks the file,
+    reserves the next slot, and sleeps until it. Without fcntl (windows), or with no state_file,
+    the limit only applies to the current process.
+    """
+
+    def __init__(self, max_rps: float, state_file: str | None = None) -> None:
+        self.max_rps = max_rps
+        self.state_file = state_file if fcntl is not None else None
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+        self._total_wait = 0.0
+
+    # wait until a request may be sent
+    def acquire(self) -> None:
+        if self.max_rps is None or self.max_rps <= 0:
+            return
+        interval = 1 / self.max_rps
+        with self._lock:
+            now = time.time()
+            if self.state_file is None:
+                slot = max(now, self._next_slot)
+                self._next_slot = slot + interval
+            else:
+                slot = self._reserve_shared_slot(now, interval)
+            self._total_wait += slot - now
+        if slot > now:
+            time.sleep(slot - now)
+
+    # reserve the next slot in the state file shared with other processes and return its time
+    def _reserve_shared_slot(self, now: float, interval: float) -> float:
+        os.makedirs(os.path.dirname(self.state_file) or ".", exist_ok=True)
+        with open(self.state_file, "a+", encoding="utf-8") as file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            try:
+                file.seek(0)
+                try:
+                    next_slot = float(file.read().strip() or 0)
+                except ValueError:
+                    next_slot = 0.0
+                slot = max(now, next_slot)
+                file.seek(0)
+                file.truncate()
+                file.write(str(slot + interval))
+                file.flush()
+            finally:
+                fcntl.flock(file, fcntl.LOCK_UN)
+        return slot
+
+    def get_stats(self) -> dict[str, float]:
+        with self._lock:
+            return {"max_rps": self.max_rps, "total_wait_sec": round(self._total_wait, 3)}
+
+
+class CircuitBreaker():
+    """Stops requests to an api that keeps failing
+
+    After failure_threshold failures in a row the breaker opens and every request fails fast
+    with CircuitOpenError. After reset_seconds it lets a single trial request through
+    (half open): if it succeeds the breaker closes, if it fails the breaker opens again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 10, reset_seconds: float = 30) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._state = self.CLOSED
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+        self._num_trips = 0
+        self._num_rejected = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state
+
+    # raise CircuitOpenError if a request should not be sent right now
+    def before_request(self) -> None:
+        with self._lock:
+            if self._state == self.CLOSED:
+                return
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_seconds:
+                self._state = self.HALF_OPEN
+                self._trial_in_flight = False
+            if self._state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return
+            self._num_rejected += 1
+            retry_in = max(0, self.reset_seconds - (time.monotonic() - self._opened_at))
+        raise CircuitOpenError(
+            f"the query api failed {self.failure_threshold} times in a row, not sending "
+            f"requests for another {retry_in:.0f} seconds")
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._consecutive_failures = 0
+            self._state = self.CLOSED
+            self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._consecutive_failures += 1
+            if self._state == self.HALF_OPEN or (
+                    self._state == self.CLOSED and self._consecutive_failures >= self.failure_threshold):
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._trial_in_flight = False
+                self._num_trips += 1
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {"state": self._state, "consecutive_failures": self._consecutive_failures,
+                    "trips": self._num_trips, "rejected": self._num_rejected}
@@ -0,0 +1,68 @@
+import os
+import json
+import hashlib
+import threading
+from helpers.cache import get_request_key, normalize_query
+
+
+# given an endpoint and a query, return a key that ignores the time the query was evaluated at.
+# Used by the replay server to find a recording when no recording matches the exact time
+def get_query_key(endpoint: str, query: str) -> str:
+    key_str = json.dumps({"endpoint": endpoint, "query": normalize_query(query)}, sort_keys=True)
+    return hashlib.sha256(key_str.encode("utf-8")).hexdigest()
+
+
+class QueryRecorder():
+    """Saves api responses to a directory as fixtures that the replay server can serve
+
+    Each response is saved as <fixture_dir>/<request key>.json containing the endpoint,
+    the query params, when it was recorded, and the full json response from the api.
+    """
+
+    def __init__(self, fixture_dir: str) -> None:
+        self.fixture_dir = fixture_dir
+        self._lock = threading.Lock()
+        self.num_recorded = 0
+
+    # save the response to a request as a fixture. A later response to the same request replaces it
+    def record(self, endpoint: str, params: dict[str, str], response: dict, recorded_at: float) -> None:
+        fixture = {
+            "endpoint": endpoint,
+            "params": params,
+            "recorded_at": recorded_at,
+            "response": response
+        }
+        os.makedirs(self.fixture_dir, exist_ok=True)
+        path = os.path.join(self.fixture_dir, get_request_key(endpoint, params) + ".json")
+        # write to a temporary file first so the replay server never reads half a fixture
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(fixture, file)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self.num_recorded += 1
+
+
+# given a directory of fixtures saved by QueryRecorder, return two dicts:
+# {request key: fixture} for exact matches, and {query key: most recently recorded fixture}
+# for matching a query no matter what time it was evaluated at
+def load_fixtures(fixture_dir: str) -> tuple[dict[str, dict], dict[str, dict]]:
+    fixtures_by_request = {}
+    fixtures_by_query = {}
+    if not os.path.isdir(fixture_dir):
+        return fixtures_by_request, fixtures_by_query
+
+    for file_name in sorted(os.listdir(fixture_dir)):
+        if not file_name.endswith(".json"):
+            continue
+        with open(os.path.join(fixture_dir, file_name), "r", encoding="utf-8") as file:
+            fixture = json.load(file)
+        endpoint = fixture["endpoint"]
+        params = fixture["params"]
+        fixtures_by_request[get_request_key(endpoint, params)] = fixture
+
+        query_key = get_query_key(endpoint, params["query"])
+        latest = fixtures_by_query.get(query_key)
+        if latest is None or fixture["recorded_at"] > latest["recorded_at"]:
+            fixtures_by_query[query_key] = fixture
+    return fixtures_by_request, fixtures_by_query
@@ -0,0 +1,170 @@
+"""
+Local stand-in for the prometheus (thanos) api that replays recorded responses.
+
+Record fixtures by running any collector with the QUERY_RECORD_DIR environment variable set
+(or QUERY_RECORD_DIR in inputs.py), then serve them from the repo's root directory with:
+    python -m helpers.replay_server
+and point the query layer at it with the PROMETHEUS_BASE_URL environment variable
+(e.g. PROMETHEUS_BASE_URL=http://localhost:9090/api/v1/) or helpers.querying.set_base_url().
+
+Latency, errors, and the empty responses the real api sometimes returns can be injected
+to test and benchmark how the collectors handle them.
+"""
+import json
+import time
+import random
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qsl
+from termcolor import colored
+from helpers.cache import get_request_key
+from helpers.recording import get_query_key, load_fixtures
+from inputs import (REPLAY_FIXTURE_DIR, REPLAY_PORT, REPLAY_LATENCY_SEC, REPLAY_LATENCY_JITTER_SEC,
+                    REPLAY_ERROR_RATE, REPLAY_EMPTY_RATE)
+
+ENDPOINTS = ("/api/v1/query", "/api/v1/query_range")
+
+
+class ReplayServer():
+    """HTTP server implementing /api/v1/query and /api/v1/query_range from recorded fixtures
+
+    A request is answered with the fixture recorded for the exact same request (same normalized
+    query and times). If there is none and strict is False, the most recent recording of the same
+    query is used, so collectors that query relative to "now" can still be replayed.
+    Requests with no recording get a 404 error response.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, fixture_dir: str = REPLAY_FIXTURE_DIR, host: str = "127.0.0.1",
+                 port: int = REPLAY_PORT, latency_seconds: float = REPLAY_LATENCY_SEC,
+                 latency_jitter_seconds: float = REPLAY_LATENCY_JITTER_SEC,
+                 error_rate: float = REPLAY_ERROR_RATE, empty_rate: float = REPLAY_EMPTY_RATE,
+                 strict: bool = False, seed: int | None = None) -> None:
+        self.fixture_dir = fixture_dir
+        self.latency_seconds = latency_seconds
+        self.latency_jitter_seconds = latency_jitter_seconds
+        self.error_rate = error_rate
+        self.empty_rate = empty_rate
+        self.strict = strict
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "replayed": 0, "not_found": 0,
+                       "errors_injected": 0, "empties_injected": 0}
+        self.fixtures_by_request, self.fixtures_by_query = load_fixtures(fixture_dir)
+
+        self._server = ThreadingHTTPServer((host, port), _ReplayHandler)
+        self._server.daemon_threads = True
+        self._server.replay_server = self
+        self._thread = None
+
+    # the url to pass to set_base_url() / PROMETHEUS_BASE_URL to query this server
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/api/v1/"
+
+    # start serving in a background thread and return the base url
+    def start(self) -> str:
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    # serve in the current thread until interrupted
+    def serve_forever(self) -> None:
+        self._server.serve_forever()
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    # returns counts of requests, replayed responses, requests with no recording, and injected faults
+    def get_stats(self) -> dict[str, int]:
+        with self._lock:
+            return dict(self._stats)
+
+    # given the endpoint ("query" or "query_range") and query params, return (status code, response)
+    def respond(self, endpoint: str, params: dict[str, str]) -> tuple[int, dict]:
+        self._count("requests")
+        with self._lock:
+            delay = self.latency_seconds + self._random.uniform(0, self.latency_jitter_seconds)
+            inject_error = self._random.random() < self.error_rate
+            inject_empty = self._random.random() < self.empty_rate
+        if delay > 0:
+            time.sleep(delay)
+
+        if "query" not in params:
+            return 400, _error_response("bad_data", "missing query parameter")
+        if inject_error:
+            self._count("errors_injected")
+            return 503, _error_response("unavailable", "injected error")
+
+        fixture = self.fixtures_by_request.get(get_request_key(endpoint, params))
+        if fixture is None and not self.strict:
+            fixture = self.fixtures_by_query.get(get_query_key(endpoint, params["query"]))
+        if fixture is None:
+            self._count("not_found")
+            return 404, _error_response("not_found", f"no recorded response for {params['query']}")
+
+        response = fixture["response"]
+        if inject_empty:
+            self._count("empties_injected")
+            result_type = response.get("data", {}).get("resultType", "vector")
+            return 200, {"status": "success", "data": {"resultType": result_type, "result": []}}
+        self._count("replayed")
+        return 200, response
+
+    def _count(self, stat: str) -> None:
+        with self._lock:
+            self._stats[stat] += 1
+
+
+class _ReplayHandler(BaseHTTPRequestHandler):
+    # keep connections alive like the real api does
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self) -> None:  # pylint: disable=invalid-name
+        url = urlparse(self.path)
+        self._handle(url.path, dict(parse_qsl(url.query)))
+
+    def do_POST(self) -> None:  # pylint: disable=invalid-name
+        url = urlparse(self.path)
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length).decode("utf-8")
+        params = dict(parse_qsl(url.query))
+        params.update(parse_qsl(body))
+        self._handle(url.path, params)
+
+    def _handle(self, path: str, params: dict[str, str]) -> None:
+        path = path.rstrip("/")
+        if path not in ENDPOINTS:
+            self._reply(404, _error_response("not_found", f"unknown endpoint {path}"))
+            return
+        endpoint = path.rsplit("/", 1)[-1]
+        self._reply(*self.server.replay_server.respond(endpoint, params))
+
+    def _reply(self, status_code: int, response: dict) -> None:
+        body = json.dumps(response).encode("utf-8")
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # don't print a line for every request
+    def log_message(self, format, *args) -> None:  # pylint: disable=redefined-builtin
+        pass
+
+
+def _error_response(error_type: str, error: str) -> dict:
+    return {"status": "error", "errorType": error_type, "error": error}
+
+
+if __name__ == "__main__":
+    replay_server = ReplayServer()
+    print(colored(
+        f"Replaying {len(replay_server.fixtures_by_request)} recorded responses from "
+        f"{replay_server.fixture_dir} at {replay_server.base_url}", "green"))
+    try:
+        replay_server.serve_forever()
+    except KeyboardInterrupt:
+        replay_server.stop()
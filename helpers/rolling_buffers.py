@@ -0,0 +1,125 @@
+"""
+Fixed capacity buffers of the most recent samples of every series of a graph (e.g. every node, pod
+of 'CPU Usage'), used to keep a rolling window of graphs without re-querying the whole window.
+"""
+import numpy as np
+import pandas as pd
+
+
+class RingBuffer():
+    """The last `capacity` (time, value) samples of one series, oldest first"""
+
+    def __init__(self, capacity: int) -> None:
+        self.capacity = capacity
+        self._times = np.empty(capacity, dtype=np.float64)
+        self._values = np.empty(capacity, dtype=np.float64)
+        self._start = 0
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    # the time of the newest sample, or None if the buffer is empty
+    @property
+    def last_time(self) -> float | None:
+        if self._size == 0:
+            return None
+        return float(self._times[(self._start + self._size - 1) % self.capacity])
+
+    # append samples (in time order), overwriting the oldest samples once the buffer is full.
+    # Samples that aren't newer than the newest sample in the buffer are skipped.
+    # Returns a boolean mask of which of the given samples were appended
+    def append(self, times: np.ndarray, values: np.ndarray) -> np.ndarray:
+        times = np.asarray(times, dtype=np.float64)
+        values = np.asarray(values, dtype=np.float64)
+        is_new = np.ones(len(times), dtype=bool)
+        if self._size > 0:
+            is_new = times > self.last_time
+        new_times, new_values = times[is_new], values[is_new]
+        # only the newest capacity samples can fit
+        if len(new_times) > self.capacity:
+            new_times, new_values = new_times[-self.capacity:], new_values[-self.capacity:]
+
+        num_new = len(new_times)
+        positions = (self._start + self._size + np.arange(num_new)) % self.capacity
+        self._times[positions] = new_times
+        self._values[positions] = new_values
+        num_overwritten = max(0, self._size + num_new - self.capacity)
+        self._start = (self._start + num_overwritten) % self.capacity
+        self._size = min(self.capacity, self._size + num_new)
+        return is_new
+
+    # returns (times, values) of every sample in the buffer, oldest first
+    def get_samples(self) -> tuple[np.ndarray, np.ndarray]:
+        positions = (self._start + np.arange(self._size)) % self.capacity
+        return self._times[positions], self._values[positions]
+
+
+class SeriesBuffers():
+    """A RingBuffer for every series of a graph, keyed by the series' labels (e.g. (node, pod))
+
+    Graph dataframes (Time, label columns, value column) are appended with append_df(), and the
+    buffered window is returned in the same format by to_df().
+    """
+
+    def __init__(self, capacity: int, value_title: str, label_names: list[str] | None = None) -> None:
+        if label_names is None:
+            label_names = ['Node', 'Pod']
+        self.capacity = capacity
+        self.value_title = value_title
+        self.label_names = label_names
+        self._buffers = {}
+
+    def __len__(self) -> int:
+        return len(self._buffers)
+
+    # append every sample of a graph dataframe to the buffer of its series.
+    # Returns the rows of graph_df that were new (newer than what was already buffered for their series)
+    def append_df(self, graph_df: pd.DataFrame | None) -> pd.DataFrame:
+        if graph_df is None or len(graph_df) == 0:
+            return pd.DataFrame(columns=['Time'] + self.label_names + [self.value_title])
+        graph_df = graph_df.sort_values(by='Time', kind='stable')
+        times = graph_df['Time'].to_numpy(dtype=np.float64)
+        values = graph_df[self.value_title].to_numpy(dtype=np.float64)
+        is_new = np.zeros(len(graph_df), dtype=bool)
+
+        groups = graph_df.groupby(self.label_names, sort=False, observed=True, dropna=False).indices
+        for labels, row_positions in groups.items():
+            if not isinstance(labels, tuple):
+                labels = (labels,)
+            buffer = self._buffers.get(labels)
+            if buffer is None:
+                buffer = self._buffers[labels] = RingBuffer(self.capacity)
+            is_new[row_positions] = buffer.append(times[row_positions], values[row_positions])
+        return graph_df[is_new]
+
+    # drop the series whose newest sample is older than the given unix time (e.g. pods that are gone)
+    def drop_older_than(self, oldest_time: float) -> None:
+        self._buffers = {
+            labels: buffer for labels, buffer in self._buffers.items()
+            if buffer.last_time is not None and buffer.last_time >= oldest_time
+        }
+
+    # returns the newest sample time of any series, or None if nothing is buffered
+    def get_last_time(self) -> float | None:
+        last_times = [buffer.last_time for buffer in self._buffers.values() if len(buffer) > 0]
+        return max(last_times) if len(last_times) > 0 else None
+
+    # returns every buffered sample as a graph dataframe (Time, label columns, value column)
+    def to_df(self) -> pd.DataFrame:
+        columns = ['Time'] + self.label_names + [self.value_title]
+        if len(self._buffers) == 0:
+            return pd.DataFrame(columns=columns)
+        times, values, label_columns = [], [], [[] for _ in self.label_names]
+        for labels, buffer in self._buffers.items():
+            series_times, series_values = buffer.get_samples()
+            times.append(series_times)
+            values.append(series_values)
+            for label_column, label in zip(label_columns, labels):
+                label_column.append(np.full(len(series_times), label, dtype=object))
+        data = {'Time': np.concatenate(times)}
+        for label_name, label_column in zip(self.label_names, label_columns):
+            data[label_name] = np.concatenate(label_column)
+        data[self.value_title] = np.concatenate(values)
+        return pd.DataFrame(data, columns=columns).sort_values(
+            by=['Time'] + self.label_names, kind='stable').reset_index(drop=True)
@@ -0,0 +1,236 @@
+"""
+A dense view of a graph for questions across series (e.g. pods) at every time: which pods were in
+the top 5, what was the p95 across workers, how many pods were at zero.
+
+A SeriesMatrix holds a graph's values in one float64 array of shape (times, series). Its rows are
+a shared time axis (start, start + step, ..., end, in int64 ms) and its columns are the series,
+with NaN wherever a series has no sample. Every analytic works on the whole array at once with
+NumPy, so no long dataframes or pivots are built. NaNs are ignored by every analytic.
+"""
+import warnings
+import numpy as np
+import pandas as pd
+from helpers.series_set import SeriesSet, _label_matches
+from helpers.time_functions import datetime_ify, time_str_to_delta
+
+_AGGREGATIONS = {
+    'sum': np.nansum,
+    'mean': np.nanmean,
+    'median': np.nanmedian,
+    'min': np.nanmin,
+    'max': np.nanmax,
+    'std': np.nanstd
+}
+
+
+class SeriesMatrix():
+    """The values of one graph as a (times, series) array, with NaN where a series has no sample
+
+    Build one with SeriesMatrix.from_series_set() or SeriesMatrix.from_df(). The analytics return
+    NumPy arrays with a row per time in times_ms; top_k_df() and to_wide_df() return dataframes.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, label_names: list[str], series_labels: list[tuple], times_ms: np.ndarray,
+                 values: np.ndarray, value_title: str | None = None) -> None:
+        self.label_names = list(label_names)
+        self.series_labels = series_labels
+        self.times_ms = times_ms
+        self.values = values
+        self.value_title = value_title
+
+    # given a SeriesSet, return its values on the time axis start, start + step, ..., end.
+    # step is a time string (e.g. "1m") and defaults to the smallest time between two samples of a series
+    # (or between two sample times of any series, if no series has two samples). If there aren't two
+    # distinct sample times either, step has to be given unless start and end are the same time.
+    # start and end default to the first and last sample. Samples are placed at the nearest step
+    # and samples outside of start and end are left out
+    @classmethod
+    def from_series_set(cls, series_set: SeriesSet, step: str | None = None, start: any = None,
+                        end: any = None) -> "SeriesMatrix":
+        times_ms = series_set.times_ms
+        if start is not None:
+            start_ms = round(datetime_ify(start).timestamp() * 1000)
+        else:
+            start_ms = int(times_ms.min()) if len(times_ms) > 0 else 0
+        if end is not None:
+            end_ms = round(datetime_ify(end).timestamp() * 1000)
+        else:
+            end_ms = int(times_ms.max()) if len(times_ms) > 0 else start_ms
+        step_ms = _get_step_ms(series_set) if step is None else round(time_str_to_delta(step).total_seconds() * 1000)
+        if step_ms is None:
+            # a step of a guessed 1 ms over a long range would be a huge array
+            if end_ms > start_ms:
+                raise ValueError("step must be given: the series don't have two distinct sample times to get it from")
+            step_ms = 1
+        num_times = max(0, (end_ms - start_ms) // step_ms + 1)
+        time_axis = start_ms + step_ms * np.arange(num_times, dtype=np.int64)
+
+        values = np.full((num_times, len(series_set)), np.nan)
+        rows = np.rint((times_ms - start_ms) / step_ms).astype(np.int64)
+        in_range = (rows >= 0) & (rows < num_times)
+        values[rows[in_range], series_set.get_series_ids()[in_range]] = series_set.values[in_range]
+        return cls(series_set.label_names, series_set.series_labels, time_axis, values, series_set.value_title)
+
+    # given a long graph dataframe (Time, label columns, value column), return its SeriesMatrix.
+    # See from_series_set() for step, start, and end
+    @classmethod
+    def from_df(cls, graph_df: pd.DataFrame, value_title: str | None = None, step: str | None = None,
+                start: any = None, end: any = None) -> "SeriesMatrix":
+        return cls.from_series_set(SeriesSet.from_df(graph_df, value_title=value_title), step=step, start=start, end=end)
+
+    def __len__(self) -> int:
+        return len(self.series_labels)
+
+    def __repr__(self) -> str:
+        return f"SeriesMatrix({self.value_title!r}: {len(self.times_ms)} times x {len(self)} series)"
+
+    # the value of a label (e.g. 'pod') of every series (column)
+    def get_label_values(self, label_name: str) -> list:
+        position = self.label_names.index(label_name)
+        return [labels[position] for labels in self.series_labels]
+
+    # the time axis as unix seconds, or datetimes if time_as_datetime
+    def get_time_index(self, time_as_datetime: bool = False) -> pd.Index:
+        if time_as_datetime:
+            return pd.DatetimeIndex(pd.to_datetime(self.times_ms, unit="ms"), name='Time')
+        return pd.Index(self.times_ms / 1000, name='Time')
+
+    # returns a SeriesMatrix of only the series whose labels match, like SeriesSet.filter()
+    def filter(self, **matchers) -> "SeriesMatrix":
+        positions = {label_name: self.label_names.index(label_name) for label_name in matchers}
+        columns = [
+            i for i, labels in enumerate(self.series_labels)
+            if all(_label_matches(labels[positions[label_name]], matcher) for label_name, matcher in matchers.items())
+        ]
+        return SeriesMatrix(self.label_names, [self.series_labels[i] for i in columns], self.times_ms,
+                            self.values[:, columns], self.value_title)
+
+    # the number of series with a sample at every time. If where is given (a function of the values
+    # array that returns a boolean array, e.g. lambda values: values == 0), only samples where it is True are counted
+    def count(self, where=None) -> np.ndarray:
+        has_sample = ~np.isnan(self.values)
+        if where is not None:
+            with np.errstate(invalid="ignore"):
+                has_sample &= where(self.values)
+        return has_sample.sum(axis=1)
+
+    # the given percentile(s) (0 to 100) across series at every time. Returns an array of shape (times,)
+    # for one percentile or (times, percentiles) for a list. Times without any samples are NaN
+    def percentile(self, q: float | list[float]) -> np.ndarray:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", category=RuntimeWarning)
+            percentiles = np.nanpercentile(self.values, q, axis=1)
+        return percentiles.T if np.ndim(q) > 0 else percentiles
+
+    # sum, mean, median, min, max, or std across series at every time. Times without any samples are NaN
+    # (and 0 for sum)
+    def aggregate(self, how: str = 'mean') -> np.ndarray:
+        if how not in _AGGREGATIONS:
+            raise ValueError(f"how must be one of {list(_AGGREGATIONS)}, not {how!r}")
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", category=RuntimeWarning)
+            return _AGGREGATIONS[how](self.values, axis=1)
+
+    # the k series with the largest (or smallest) values at every time.
+    # Returns (series indices, values), both of shape (times, k), best first. If a time has fewer
+    # than k samples, the missing places have index -1 and value NaN
+    def top_k(self, k: int, largest: bool = True) -> tuple[np.ndarray, np.ndarray]:
+        num_times, num_series = self.values.shape
+        k = max(0, min(k, num_series))
+        # NaNs sort last, and largest is the smallest of the negated values
+        keys = np.where(np.isnan(self.values), np.inf, -self.values if largest else self.values)
+        if 0 < k < num_series:
+            candidates = np.argpartition(keys, k - 1, axis=1)[:, :k]
+        else:
+            candidates = np.broadcast_to(np.arange(num_series), (num_times, num_series))[:, :k]
+        order = np.argsort(np.take_along_axis(keys, candidates, axis=1), axis=1, kind='stable')
+        indices = np.take_along_axis(candidates, order, axis=1)
+        values = np.take_along_axis(self.values, indices, axis=1)
+        missing = np.isnan(values)
+        return np.where(missing, -1, indices), values
+
+    # top_k() as a long dataframe (Time, Rank, label columns, value column), without the missing places
+    def top_k_df(self, k: int, largest: bool = True, time_as_datetime: bool = False) -> pd.DataFrame:
+        indices, values = self.top_k(k, largest=largest)
+        found = indices >= 0
+        time_positions, ranks = np.nonzero(found)
+        series_indices = indices[found]
+        columns = {
+            'Time': self.get_time_index(time_as_datetime).to_numpy()[time_positions],
+            'Rank': ranks + 1
+        }
+        for position, label_name in enumerate(self.label_names):
+            series_values = np.array([labels[position] for labels in self.series_labels], dtype=object)
+            columns[label_name.title()] = series_values[series_indices]
+        columns[self.value_title if self.value_title is not None else 'Value'] = values[found]
+        return pd.DataFrame(columns)
+
+    # returns a SeriesMatrix of every series' value over the trailing window of times (the time itself
+    # and the window - 1 times before it). window is a number of times or a time string (e.g. "5m").
+    # how is sum, mean, min, max, or count. Windows with fewer than min_periods samples are NaN
+    def rolling(self, window: int | str, how: str = 'mean', min_periods: int = 1) -> "SeriesMatrix":
+        if isinstance(window, str):
+            window = int(time_str_to_delta(window).total_seconds() * 1000 // self._get_step_ms())
+        window = max(1, window)
+        has_sample = ~np.isnan(self.values)
+        counts = _rolling_sum(has_sample.astype(np.int64), window)
+
+        if how in ('sum', 'mean'):
+            sums = _rolling_sum(np.where(has_sample, self.values, 0.0), window)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                result = sums if how == 'sum' else sums / counts
+        elif how in ('min', 'max'):
+            padded = np.concatenate([np.full((window - 1, len(self)), np.nan), self.values])
+            windows = np.lib.stride_tricks.sliding_window_view(padded, window, axis=0)
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", category=RuntimeWarning)
+                result = (np.nanmin if how == 'min' else np.nanmax)(windows, axis=-1)
+        elif how == 'count':
+            result = counts.astype(np.float64)
+        else:
+            raise ValueError(f"how must be one of ['sum', 'mean', 'min', 'max', 'count'], not {how!r}")
+        result = np.where(counts >= min_periods, result, np.nan)
+        return SeriesMatrix(self.label_names, self.series_labels, self.times_ms, result, self.value_title)
+
+    # returns a dataframe with a row per time (the index) and a column per series, named like SeriesSet.to_wide_df()
+    def to_wide_df(self, column_label: str | None = None, time_as_datetime: bool = False) -> pd.DataFrame:
+        if column_label is not None:
+            columns = pd.Index(self.get_label_values(column_label), name=column_label.title())
+        elif len(self.label_names) == 1:
+            columns = pd.Index([labels[0] for labels in self.series_labels], name=self.label_names[0].title())
+        else:
+            columns = pd.MultiIndex.from_tuples(
+                self.series_labels, names=[label_name.title() for label_name in self.label_names])
+        return pd.DataFrame(self.values, index=self.get_time_index(time_as_datetime), columns=columns, copy=False)
+
+    def _get_step_ms(self) -> int:
+        if len(self.times_ms) < 2:
+            return 1
+        return int(self.times_ms[1] - self.times_ms[0])
+
+
+# the smallest time between two samples of the same series. If no series has two samples (e.g. short
+# lived pods), the smallest time between two distinct sample times of any series.
+# None if there aren't two distinct sample times
+def _get_step_ms(series_set: SeriesSet) -> int | None:
+    differences = np.diff(series_set.times_ms)
+    same_series = np.diff(series_set.get_series_ids()) == 0
+    differences = differences[same_series & (differences > 0)]
+    if len(differences) == 0:
+        differences = np.diff(np.unique(series_set.times_ms))
+    return int(differences.min()) if len(differences) > 0 else None
+
+
+# the sum of the trailing window rows of every column (fewer rows at the start)
+def _rolling_sum(values: np.ndarray, window: int) -> np.ndarray:
+    # sums of integers (counts) are exact, so they are differences of cumulative sums
+    if np.issubdtype(values.dtype, np.integer):
+        cumulative = np.cumsum(values, axis=0)
+        result = cumulative.copy()
+        result[window:] -= cumulative[:-window]
+        return result
+    # floats are summed window by window, so large values don't cost later windows precision
+    # and an inf only makes the windows it is in inf
+    padded = np.concatenate([np.zeros((window - 1, values.shape[1])), values])
+    return np.lib.stride_tricks.sliding_window_view(padded, window, axis=0).sum(axis=-1)
@@ -0,0 +1,279 @@
+"""
+A compact alternative to long graph dataframes (Time, Node, Pod, value), where every sample repeats
+its series' label strings.
+
+A SeriesSet keeps the label values of each series once (as an interned tuple) and the samples of
+every series in two flat arrays (times as int64 ms and values as float64), with series i's samples
+at offsets[i]:offsets[i + 1], in time order. Dataframes are only built when asked for.
+"""
+import sys
+from typing import Callable, Iterator
+import numpy as np
+import pandas as pd
+from helpers.decoding import decode_matrix
+from helpers.time_functions import datetime_ify
+
+
+class SeriesSet():
+    """The series of one graph: a tuple of label values and int64 ms times / float64 values per series
+
+    Build one with SeriesSet.from_result_list() or SeriesSet.from_df(). Slicing and filtering
+    return new SeriesSets; to_long_df() and to_wide_df() export dataframes.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, label_names: list[str], series_labels: list[tuple], offsets: np.ndarray,
+                 times_ms: np.ndarray, values: np.ndarray, value_title: str | None = None) -> None:
+        self.label_names = list(label_names)
+        self.series_labels = series_labels
+        self.value_title = value_title
+        self._offsets = offsets
+        self._times_ms = times_ms
+        self._values = values
+        # {labels: series index}, built the first time a series is looked up by its labels
+        self._index = None
+
+    # given a range query result list, return a SeriesSet of its series. label_names defaults to
+    # every label in the result list
+    @classmethod
+    def from_result_list(cls, result_list: list[dict], value_title: str | None = None,
+                         label_names: list[str] | None = None) -> "SeriesSet":
+        if label_names is None:
+            label_names = sorted({label for series in result_list for label in series['metric']})
+        times_ms, values, _ = decode_matrix(result_list)
+        lengths = np.fromiter(
+            (len(series['values']) for series in result_list), dtype=np.int64, count=len(result_list))
+        series_labels = [
+            tuple(_intern(series['metric'].get(label)) for label in label_names) for series in result_list]
+        return cls(label_names, series_labels, _lengths_to_offsets(lengths), times_ms, values, value_title)
+
+    # given a long graph dataframe (Time, label columns, value column), return a SeriesSet of its series.
+    # value_title defaults to the last column, and label_columns to every column but Time and the values
+    @classmethod
+    def from_df(cls, graph_df: pd.DataFrame, value_title: str | None = None,
+                label_columns: list[str] | None = None) -> "SeriesSet":
+        if value_title is None:
+            value_title = graph_df.columns[-1]
+        if label_columns is None:
+            label_columns = [column for column in graph_df.columns if column not in ('Time', value_title)]
+        return cls.from_df_columns(graph_df, [value_title], label_columns=label_columns)[value_title]
+
+    # given a dataframe of several graphs (Time, label columns, a value column per graph, like
+    # Graphs.get_graphs_as_one_df() returns), return {value title: SeriesSet} for the given value columns.
+    # The SeriesSets share one copy of the labels and times; only the values are kept per graph
+    @classmethod
+    def from_df_columns(cls, graphs_df: pd.DataFrame, value_titles: list[str],
+                        label_columns: list[str] | None = None) -> dict[str, "SeriesSet"]:
+        if label_columns is None:
+            label_columns = [column for column in graphs_df.columns if column != 'Time' and column not in value_titles]
+        label_names = [column[0].lower() + column[1:] for column in label_columns]
+        if len(graphs_df) == 0:
+            offsets, times_ms, series_labels = np.zeros(1, dtype=np.int64), np.empty(0, dtype=np.int64), []
+            return {value_title: cls(label_names, series_labels, offsets, times_ms, np.empty(0, dtype=np.float64), value_title)
+                    for value_title in value_titles}
+
+        # number every series, then order the samples by series and time
+        if len(label_columns) > 0:
+            series_ids = graphs_df.groupby(
+                label_columns, sort=False, dropna=False, observed=True).ngroup().to_numpy()
+        else:
+            series_ids = np.zeros(len(graphs_df), dtype=np.int64)
+        times_ms = _to_ms(graphs_df['Time'])
+        order = np.lexsort((times_ms, series_ids))
+        offsets = _lengths_to_offsets(np.bincount(series_ids))
+        times_ms = times_ms[order]
+
+        first_rows = graphs_df[label_columns].iloc[order[offsets[:-1]]]
+        series_labels = [tuple(_intern(value) for value in row) for row in first_rows.itertuples(index=False)]
+        return {
+            value_title: cls(label_names, series_labels, offsets, times_ms,
+                             graphs_df[value_title].to_numpy(dtype=np.float64)[order], value_title)
+            for value_title in value_titles
+        }
+
+    def __len__(self) -> int:
+        return len(self.series_labels)
+
+    def __iter__(self) -> Iterator[tuple[tuple, np.ndarray, np.ndarray]]:
+        for i, labels in enumerate(self.series_labels):
+            start, end = self._offsets[i], self._offsets[i + 1]
+            yield labels, self._times_ms[start:end], self._values[start:end]
+
+    def __contains__(self, labels: tuple) -> bool:
+        return labels in self._get_index()
+
+    def __repr__(self) -> str:
+        return f"SeriesSet({self.value_title!r}: {len(self)} series, {self.num_samples} samples)"
+
+    @property
+    def num_samples(self) -> int:
+        return len(self._values)
+
+    # bytes used by the sample arrays
+    @property
+    def nbytes(self) -> int:
+        return self._offsets.nbytes + self._times_ms.nbytes + self._values.nbytes
+
+    # every sample time (int64 ms), series after series
+    @property
+    def times_ms(self) -> np.ndarray:
+        return self._times_ms
+
+    # every sample value, series after series
+    @property
+    def values(self) -> np.ndarray:
+        return self._values
+
+    # the number of samples of every series
+    def get_lengths(self) -> np.ndarray:
+        return np.diff(self._offsets)
+
+    # the index of the series every sample belongs to
+    def get_series_ids(self) -> np.ndarray:
+        return np.repeat(np.arange(len(self), dtype=np.int64), self.get_lengths())
+
+    # the value of a label (e.g. 'pod') of every series
+    def get_label_values(self, label_name: str) -> list:
+        position = self.label_names.index(label_name)
+        return [labels[position] for labels in self.series_labels]
+
+    # returns (times in ms, values) of the series with the given labels (views, not copies)
+    def get_series(self, labels: tuple) -> tuple[np.ndarray, np.ndarray]:
+        i = self._get_index()[labels]
+        start, end = self._offsets[i], self._offsets[i + 1]
+        return self._times_ms[start:end], self._values[start:end]
+
+    # returns a SeriesSet of only the series at the given indices (in their original order)
+    def take(self, series_indices: list[int] | np.ndarray) -> "SeriesSet":
+        keep_series = np.zeros(len(self), dtype=bool)
+        keep_series[np.asarray(series_indices, dtype=np.int64)] = True
+        keep_samples = keep_series[self.get_series_ids()]
+        return SeriesSet(
+            self.label_names, [labels for labels, keep in zip(self.series_labels, keep_series) if keep],
+            _lengths_to_offsets(self.get_lengths()[keep_series]),
+            self._times_ms[keep_samples], self._values[keep_samples], self.value_title)
+
+    # returns a SeriesSet of only the series whose labels match, e.g. filter(pod="a"), filter(node=["n1", "n2"]),
+    # or filter(pod=lambda pod: pod.startswith("bp3d")). A function of the labels tuple can be given as func
+    def filter(self, func: Callable[[tuple], bool] | None = None, **matchers) -> "SeriesSet":
+        positions = {label_name: self.label_names.index(label_name) for label_name in matchers}
+        series_indices = []
+        for i, labels in enumerate(self.series_labels):
+            if func is not None and not func(labels):
+                continue
+            if all(_label_matches(labels[positions[label_name]], matcher) for label_name, matcher in matchers.items()):
+                series_indices.append(i)
+        return self.take(series_indices)
+
+    # returns a SeriesSet of only the samples between start and end (inclusive, datetimes or unix seconds).
+    # Series without samples in that time are dropped
+    def slice_time(self, start: any = None, end: any = None) -> "SeriesSet":
+        in_range = np.ones(self.num_samples, dtype=bool)
+        if start is not None:
+            in_range &= self._times_ms >= round(datetime_ify(start).timestamp() * 1000)
+        if end is not None:
+            in_range &= self._times_ms <= round(datetime_ify(end).timestamp() * 1000)
+        lengths = np.bincount(self.get_series_ids()[in_range], minlength=len(self))
+        has_samples = lengths > 0
+        return SeriesSet(
+            self.label_names, [labels for labels, keep in zip(self.series_labels, has_samples) if keep],
+            _lengths_to_offsets(lengths[has_samples]),
+            self._times_ms[in_range], self._values[in_range], self.value_title)
+
+    # returns a SeriesSet with one label of every series replaced by new_values (one per series).
+    # The sample arrays are shared, not copied
+    def relabel(self, label_name: str, new_values: list) -> "SeriesSet":
+        position = self.label_names.index(label_name)
+        series_labels = [
+            labels[:position] + (_intern(new_value),) + labels[position + 1:]
+            for labels, new_value in zip(self.series_labels, new_values)]
+        return SeriesSet(self.label_names, series_labels, self._offsets, self._times_ms, self._values, self.value_title)
+
+    # returns a SeriesSet of this one's samples plus the samples of other with the same labels and time
+    # (e.g. read + write). Samples that other doesn't have are NaN
+    def add(self, other: "SeriesSet") -> "SeriesSet":
+        if self.series_labels == other.series_labels and np.array_equal(self._offsets, other._offsets) \
+                and np.array_equal(self._times_ms, other._times_ms):
+            return SeriesSet(self.label_names, self.series_labels, self._offsets, self._times_ms,
+                             self._values + other._values, self.value_title)
+
+        # the series don't line up, so match the samples by their labels and time
+        keys = ['Time'] + [label_name.title() for label_name in self.label_names]
+        value_title = self.value_title if self.value_title is not None else 'Value'
+        other_df = other.to_long_df().rename(columns={other.value_title or 'Value': '_other'})
+        sum_df = self.to_long_df().merge(other_df, how='left', on=keys)
+        sum_df[value_title] = sum_df[value_title] + sum_df['_other']
+        return SeriesSet.from_df(sum_df.drop(columns='_other'), value_title=value_title,
+                                 label_columns=keys[1:])
+
+    # returns a long graph dataframe (Time, label columns in title case, value column) like the
+    # dataframes of Graphs.get_graphs_dict(). The value column shares memory with the SeriesSet.
+    # Times are unix seconds, or datetimes if time_as_datetime
+    def to_long_df(self, time_as_datetime: bool = False, categorical_labels: bool = False) -> pd.DataFrame:
+        columns = {'Time': self._export_times(self._times_ms, time_as_datetime)}
+        lengths = self.get_lengths()
+        for position, label_name in enumerate(self.label_names):
+            series_values = np.array([labels[position] for labels in self.series_labels], dtype=object)
+            if categorical_labels:
+                codes, categories = pd.factorize(series_values)
+                columns[label_name.title()] = pd.Categorical.from_codes(np.repeat(codes, lengths), categories)
+            else:
+                columns[label_name.title()] = np.repeat(series_values, lengths)
+        columns[self.value_title if self.value_title is not None else 'Value'] = self._values
+        return pd.DataFrame(columns, copy=False)
+
+    # returns a dataframe with a row per time (the index) and a column per series. Columns are named
+    # by column_label's value (e.g. 'pod'), or by the series' labels if column_label isn't given
+    def to_wide_df(self, column_label: str | None = None, time_as_datetime: bool = False) -> pd.DataFrame:
+        unique_times, time_positions = np.unique(self._times_ms, return_inverse=True)
+        wide_values = np.full((len(unique_times), len(self)), np.nan)
+        wide_values[time_positions, self.get_series_ids()] = self._values
+
+        if column_label is not None:
+            columns = pd.Index(self.get_label_values(column_label), name=column_label.title())
+        elif len(self.label_names) == 1:
+            columns = pd.Index([labels[0] for labels in self.series_labels], name=self.label_names[0].title())
+        else:
+            columns = pd.MultiIndex.from_tuples(
+                self.series_labels, names=[label_name.title() for label_name in self.label_names])
+        index = pd.Index(self._export_times(unique_times, time_as_datetime), name='Time')
+        return pd.DataFrame(wide_values, index=index, columns=columns)
+
+    def _export_times(self, times_ms: np.ndarray, time_as_datetime: bool) -> np.ndarray | pd.DatetimeIndex:
+        if time_as_datetime:
+            return pd.to_datetime(times_ms, unit="ms")
+        return times_ms / 1000
+
+    def _get_index(self) -> dict[tuple, int]:
+        if self._index is None:
+            self._index = {}
+            for i, labels in enumerate(self.series_labels):
+                self._index.setdefault(labels, i)
+        return self._index
+
+
+# label values are repeated across graphs and refreshes, so keep only one copy of each string
+def _intern(value: any) -> any:
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def _lengths_to_offsets(lengths: np.ndarray) -> np.ndarray:
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return offsets
+
+
+# given a Time column (unix seconds or datetimes), return its times as int64 ms
+def _to_ms(times: pd.Series) -> np.ndarray:
+    if pd.api.types.is_datetime64_any_dtype(times):
+        return times.to_numpy(dtype="datetime64[ms]").astype(np.int64)
+    return np.rint(times.to_numpy(dtype=np.float64) * 1000).astype(np.int64)
+
+
+# whether a label value matches a filter() matcher: a value, a list/set/tuple of values, or a function
+def _label_matches(value: any, matcher: any) -> bool:
+    if callable(matcher):
+        return bool(matcher(value))
+    if isinstance(matcher, (list, set, tuple)):
+        return value in matcher
+    return value == matcher
@@ -0,0 +1,343 @@
+"""
+A local columnar store of the samples returned by range queries, so history that was already
+queried is read from disk instead of being queried again.
+
+The store is partitioned by metric: every (server base url, normalized query, step, grid) gets its own
+directory, so samples of one server (e.g. a replay server) are never served for another.
+The grid matters because range queries are evaluated at start, start + step, ..., so two requests
+only return the same points if their starts are the same modulo the step. A partition has:
+    meta.json       the base url, query, step, and grid the partition is for
+    coverage.json   the time intervals (grid points, in ms) that have been queried
+    <block>.tsb     the samples of every series in one time block (SERIES_STORE_BLOCK_SEC long)
+A block file is:
+    b"TSB1", the header length (uint32), header (zlib compressed json of every series' labels and
+    number of samples), times column (zlib), values column (zlib)
+The columns hold every series' samples one series after another. Times are int64 ms stored as
+delta of deltas (a step grid becomes all zeros) and values are float64 stored as the XOR of each
+value's bits with the previous value's bits (unchanged values become zeros), restarting at every
+series. Block files are memory-mapped when read.
+
+Only samples older than QUERY_CACHE_SETTLE_SEC are stored, since newer ones may still change.
+"""
+import os
+import re
+import json
+import mmap
+import time
+import zlib
+import shutil
+import struct
+import hashlib
+import threading
+from typing import Callable
+import numpy as np
+from helpers.cache import normalize_query
+from helpers.decoding import decode_matrix, format_value
+from inputs import SERIES_STORE_DIR, SERIES_STORE_BLOCK_SEC, QUERY_CACHE_SETTLE_SEC
+
+_MAGIC = b"TSB1"
+_HEADER_LENGTH = struct.Struct("<I")
+# the first metric name in a query, to name its partition's directory
+_METRIC_PATTERN = re.compile(r'([a-zA-Z_:][a-zA-Z0-9_:]*)\s*\{')
+
+
+class SeriesStore():
+    """Stores range query results on disk and answers range queries from them, only querying the gaps
+
+    query_range() returns the same result list as a range query. Whatever part of the range is
+    already stored is read from disk, and every gap is passed to fetch (e.g. a query to the api).
+    The settled part of what was fetched is stored for next time.
+    """
+
+    def __init__(self, store_dir: str = SERIES_STORE_DIR, block_seconds: float = SERIES_STORE_BLOCK_SEC,
+                 settle_seconds: float = QUERY_CACHE_SETTLE_SEC) -> None:
+        self.store_dir = store_dir
+        self.block_ms = int(block_seconds * 1000)
+        self.settle_seconds = settle_seconds
+        # blocks are read, merged, and rewritten when samples are added, so writes are done one at a time
+        self._write_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {"requests": 0, "fully_stored": 0, "gaps_fetched": 0, "samples_stored": 0}
+
+    # return the result list of the range query (start and end in unix seconds, step in seconds).
+    # fetch(start, end) is called for every part of the range that isn't stored and must return
+    # the result list of the query over that part. If refresh, the whole range is fetched (and stored) again.
+    # base_url is the server fetch queries, to keep every server's samples apart
+    # pylint: disable=too-many-arguments,too-many-locals
+    def query_range(self, query: str, start: float, end: float, step: float,
+                    fetch: Callable[[float, float], list[dict]], refresh: bool = False,
+                    base_url: str = "") -> list[dict]:
+        step_ms = max(1, round(step * 1000))
+        start_ms = round(start * 1000)
+        # the last point of the grid that is before end
+        last_ms = start_ms + (round(end * 1000) - start_ms) // step_ms * step_ms
+        partition_dir = self._get_partition_dir(query, step_ms, start_ms % step_ms, base_url)
+
+        covered = [] if refresh else self._read_coverage(partition_dir)
+        gaps = subtract_intervals(start_ms, last_ms, step_ms, covered)
+        self._count("requests")
+        if len(gaps) == 0:
+            self._count("fully_stored")
+
+        fetched = []
+        settled_ms = round((time.time() - self.settle_seconds) * 1000)
+        for gap_start, gap_end in gaps:
+            result_list = fetch(gap_start / 1000, gap_end / 1000)
+            self._count("gaps_fetched")
+            fetched.append(result_list)
+            # the api sometimes returns no data for queries that do have data, so empty results aren't stored
+            if gap_start > settled_ms or len(result_list) == 0:
+                continue
+            stored_end = min(gap_end, gap_start + (settled_ms - gap_start) // step_ms * step_ms)
+            self.add(partition_dir, result_list, gap_start, stored_end, step_ms)
+
+        stored = [] if len(gaps) == 1 and gaps[0] == (start_ms, last_ms) else \
+            [self.read(partition_dir, start_ms, last_ms)]
+        return _merge_result_lists(stored + fetched)
+
+    # add the samples of a result list between start_ms and end_ms (inclusive) to a partition's
+    # blocks, and mark that time as covered
+    # pylint: disable=too-many-arguments
+    def add(self, partition_dir: str, result_list: list[dict], start_ms: int, end_ms: int, step_ms: int) -> None:
+        series = _result_list_to_series(result_list)
+        with self._write_lock:
+            os.makedirs(partition_dir, exist_ok=True)
+            num_samples = 0
+            for block_start in range(start_ms // self.block_ms * self.block_ms, end_ms + 1, self.block_ms):
+                block_end = min(end_ms, block_start + self.block_ms - 1)
+                block_series = {}
+                for labels, (times_ms, values) in series.items():
+                    in_block = (times_ms >= max(start_ms, block_start)) & (times_ms <= block_end)
+                    if in_block.any():
+                        block_series[labels] = (times_ms[in_block], values[in_block])
+                if len(block_series) == 0:
+                    continue
+                block_path = self._get_block_path(partition_dir, block_start)
+                merged = _merge_series([read_block(block_path), block_series]) \
+                    if os.path.exists(block_path) else block_series
+                write_block(block_path, merged)
+                num_samples += sum(len(times_ms) for times_ms, _ in block_series.values())
+            coverage = merge_intervals(self._read_coverage(partition_dir) + [(start_ms, end_ms)], step_ms)
+            _write_json_atomically(os.path.join(partition_dir, "coverage.json"), coverage)
+        self._count("samples_stored", num_samples)
+
+    # return the stored samples of a partition between start_ms and end_ms (inclusive) as a result list
+    def read(self, partition_dir: str, start_ms: int, end_ms: int) -> list[dict]:
+        blocks = []
+        for block_start in range(start_ms // self.block_ms * self.block_ms, end_ms + 1, self.block_ms):
+            block_path = self._get_block_path(partition_dir, block_start)
+            if not os.path.exists(block_path):
+                continue
+            block_series = {}
+            for labels, (times_ms, values) in read_block(block_path).items():
+                in_range = (times_ms >= start_ms) & (times_ms <= end_ms)
+                if in_range.any():
+                    block_series[labels] = (times_ms[in_range], values[in_range])
+            blocks.append(block_series)
+        return _series_to_result_list(_merge_series(blocks))
+
+    # returns how many range requests there were, how many were answered completely from the store,
+    # how many gaps had to be fetched, and how many samples were stored
+    def get_stats(self) -> dict[str, int]:
+        with self._stats_lock:
+            return dict(self._stats)
+
+    # delete everything in the store
+    def clear(self) -> None:
+        with self._write_lock:
+            shutil.rmtree(self.store_dir, ignore_errors=True)
+
+    # returns the directory of the partition for the query to base_url at the given step (ms)
+    # and grid (start % step in ms)
+    def _get_partition_dir(self, query: str, step_ms: int, phase_ms: int, base_url: str = "") -> str:
+        normalized = normalize_query(query)
+        key = hashlib.sha256(json.dumps([base_url, normalized, step_ms, phase_ms]).encode("utf-8")).hexdigest()[:16]
+        metric = _METRIC_PATTERN.search(normalized)
+        metric_name = metric.group(1).replace(":", "_") if metric is not None else "query"
+        partition_dir = os.path.join(self.store_dir, f"{metric_name}-{key}")
+        meta_path = os.path.join(partition_dir, "meta.json")
+        if not os.path.exists(meta_path):
+            os.makedirs(partition_dir, exist_ok=True)
+            _write_json_atomically(meta_path, {"base_url": base_url, "query": normalized,
+                                               "step_ms": step_ms, "phase_ms": phase_ms})
+        return partition_dir
+
+    def _get_block_path(self, partition_dir: str, block_start_ms: int) -> str:
+        return os.path.join(partition_dir, f"{block_start_ms // 1000}.tsb")
+
+    # returns the covered intervals of a partition as a sorted list of (start ms, end ms)
+    def _read_coverage(self, partition_dir: str) -> list[tuple[int, int]]:
+        try:
+            with open(os.path.join(partition_dir, "coverage.json"), encoding="utf-8") as file:
+                return [tuple(interval) for interval in json.load(file)]
+        except (OSError, ValueError):
+            return []
+
+    def _count(self, stat: str, amount: int = 1) -> None:
+        with self._stats_lock:
+            self._stats[stat] += amount
+
+
+# given a range of grid points (start and end are points of the grid, step apart) and sorted
+# covered intervals on the same grid, return the intervals of the range that aren't covered
+def subtract_intervals(start: int, end: int, step: int, covered: list[tuple[int, int]]) -> list[tuple[int, int]]:
+    gaps = []
+    cursor = start
+    for covered_start, covered_end in covered:
+        if covered_end < cursor:
+            continue
+        if covered_start > end:
+            break
+        if covered_start > cursor:
+            gaps.append((cursor, covered_start - step))
+        cursor = max(cursor, covered_end + step)
+    if cursor <= end:
+        gaps.append((cursor, end))
+    return gaps
+
+
+# given intervals of grid points, return them sorted with overlapping and adjacent intervals combined
+def merge_intervals(intervals: list[tuple[int, int]], step: int) -> list[tuple[int, int]]:
+    merged = []
+    for interval_start, interval_end in sorted(intervals):
+        if len(merged) > 0 and interval_start <= merged[-1][1] + step:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], interval_end))
+        else:
+            merged.append((interval_start, interval_end))
+    return merged
+
+
+# write {labels: (times in ms, values)} to a block file (see the module docstring)
+def write_block(path: str, series: dict[tuple, tuple[np.ndarray, np.ndarray]]) -> None:
+    labels = list(series)
+    lengths = np.array([len(series[series_labels][0]) for series_labels in labels], dtype=np.int64)
+    times_ms = np.concatenate([series[series_labels][0] for series_labels in labels]).astype(np.int64)
+    values = np.concatenate([series[series_labels][1] for series_labels in labels]).astype(np.float64)
+    series_starts = np.zeros(len(times_ms), dtype=bool)
+    series_starts[np.cumsum(lengths)[:-1]] = True
+    series_starts[:1] = True
+
+    times_column = zlib.compress(_encode_times(times_ms, series_starts).tobytes())
+    values_column = zlib.compress(_encode_values(values, series_starts).tobytes())
+    header = zlib.compress(json.dumps({
+        "labels": [dict(series_labels) for series_labels in labels],
+        "lengths": lengths.tolist(),
+        "times_bytes": len(times_column)
+    }).encode("utf-8"))
+
+    # write to a temporary file first so readers never see half a block
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as file:
+        file.write(_MAGIC + _HEADER_LENGTH.pack(len(header)) + header + times_column + values_column)
+    os.replace(tmp_path, path)
+
+
+# read a block file into {labels: (times in ms, values)}
+def read_block(path: str) -> dict[tuple, tuple[np.ndarray, np.ndarray]]:
+    with open(path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        with memoryview(mapped) as buffer:
+            if buffer[:len(_MAGIC)] != _MAGIC:
+                raise ValueError(f"{path} is not a series store block")
+            position = len(_MAGIC) + _HEADER_LENGTH.size
+            header_length, = _HEADER_LENGTH.unpack(buffer[len(_MAGIC):position])
+            header = json.loads(zlib.decompress(buffer[position:position + header_length]))
+            position += header_length
+            times_end = position + header["times_bytes"]
+            encoded_times = np.frombuffer(zlib.decompress(buffer[position:times_end]), dtype=np.int64)
+            encoded_values = np.frombuffer(zlib.decompress(buffer[times_end:]), dtype=np.uint64)
+
+    lengths = np.array(header["lengths"], dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    times_ms = _decode_times(encoded_times, offsets)
+    values = _decode_values(encoded_values, offsets)
+    return {
+        tuple(sorted(labels.items())): (times_ms[offsets[i]:offsets[i + 1]], values[offsets[i]:offsets[i + 1]])
+        for i, labels in enumerate(header["labels"])
+    }
+
+
+# every time minus the one before it, twice (delta of deltas). Both differences restart at every series
+def _encode_times(times_ms: np.ndarray, series_starts: np.ndarray) -> np.ndarray:
+    deltas = times_ms - np.where(series_starts, 0, np.roll(times_ms, 1))
+    return deltas - np.where(series_starts, 0, np.roll(deltas, 1))
+
+
+def _decode_times(encoded: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    return _segmented_cumsum(_segmented_cumsum(encoded, offsets), offsets)
+
+
+# the bits of every value XOR the bits of the value before it, restarting at every series
+def _encode_values(values: np.ndarray, series_starts: np.ndarray) -> np.ndarray:
+    bits = values.view(np.uint64)
+    return bits ^ np.where(series_starts, np.uint64(0), np.roll(bits, 1))
+
+
+def _decode_values(encoded: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    accumulated = np.bitwise_xor.accumulate(encoded) if len(encoded) > 0 else encoded.copy()
+    # undo the accumulation of the series before each series
+    before = np.concatenate([[np.uint64(0)], accumulated])[offsets[:-1]]
+    return (accumulated ^ np.repeat(before, np.diff(offsets))).view(np.float64)
+
+
+# a cumulative sum that restarts at every offset
+def _segmented_cumsum(values: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    cumulative = np.cumsum(values)
+    before = np.concatenate([[0], cumulative])[offsets[:-1]]
+    return cumulative - np.repeat(before, np.diff(offsets))
+
+
+# given a result list, return {labels: (times in ms, values)}
+def _result_list_to_series(result_list: list[dict]) -> dict[tuple, tuple[np.ndarray, np.ndarray]]:
+    times_ms, values, _ = decode_matrix(result_list)
+    series = {}
+    position = 0
+    for result in result_list:
+        length = len(result['values'])
+        series[tuple(sorted(result['metric'].items()))] = (
+            times_ms[position:position + length], values[position:position + length])
+        position += length
+    return series
+
+
+# given {labels: (times in ms, values)}, return a result list like the api returns
+def _series_to_result_list(series: dict[tuple, tuple[np.ndarray, np.ndarray]]) -> list[dict]:
+    return [
+        {'metric': dict(labels),
+         'values': [[time_ms / 1000, format_value(value)] for time_ms, value in zip(times_ms.tolist(), values.tolist())]}
+        for labels, (times_ms, values) in series.items()
+    ]
+
+
+# given several {labels: (times in ms, values)}, combine the samples of every series in time order.
+# If more than one has a sample at the same time, the last one's is kept
+def _merge_series(series_dicts: list[dict[tuple, tuple[np.ndarray, np.ndarray]]]) -> dict[tuple, tuple[np.ndarray, np.ndarray]]:
+    parts = {}
+    for series in series_dicts:
+        for labels, samples in series.items():
+            parts.setdefault(labels, []).append(samples)
+    merged = {}
+    for labels, samples in parts.items():
+        if len(samples) == 1:
+            merged[labels] = samples[0]
+            continue
+        times_ms = np.concatenate([times for times, _ in samples])
+        values = np.concatenate([series_values for _, series_values in samples])
+        # keep the last sample of every time: unique on the reversed arrays finds the last occurrences
+        _, last = np.unique(times_ms[::-1], return_index=True)
+        keep = len(times_ms) - 1 - last
+        merged[labels] = (times_ms[keep], values[keep])
+    return merged
+
+
+# given result lists of parts of the same range, return one result list with every series' samples in time order
+def _merge_result_lists(result_lists: list[list[dict]]) -> list[dict]:
+    if len(result_lists) == 1:
+        return result_lists[0]
+    return _series_to_result_list(_merge_series([_result_list_to_series(result_list) for result_list in result_lists]))
+
+
+def _write_json_atomically(path: str, data: any) -> None:
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        json.dump(data, file)
+    os.replace(tmp_path, path)
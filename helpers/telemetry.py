@@ -0,0 +1,226 @@
+import re
+import json
+import time
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+from helpers.printing import print_title, print_dataframe_dict
+
+# the workflow stage queries are currently being sent for (e.g. "phase_3"). Set with set_stage().
+# It is a context variable, so every thread (and task) has its own stage. Tasks run with
+# helpers.concurrency.run_concurrently() start with the stage of the thread that submitted them
+_current_stage = contextvars.ContextVar("telemetry_stage", default=None)
+
+
+# set the workflow stage that every query sent from now on (in this thread) is recorded under
+def set_stage(stage: str | None) -> None:
+    _current_stage.set(stage)
+
+
+def get_stage() -> str | None:
+    return _current_stage.get()
+
+
+# record every query sent inside of the with block under the given stage, e.g.
+#   with telemetry_stage("phase_3"):
+#       phase_3.run()
+@contextmanager
+def telemetry_stage(stage: str):
+    token = _current_stage.set(stage)
+    try:
+        yield
+    finally:
+        _current_stage.reset(token)
+
+
+# given a query, return the name of the first metric in it (e.g. "container_cpu_usage_seconds_total")
+# so queries without a title can still be grouped into families
+def get_query_family(query: str) -> str:
+    match = re.search(r"([a-zA-Z_:][a-zA-Z0-9_:]*)\s*\{", query)
+    if match is not None:
+        return match.group(1)
+    # no label selectors to find a metric name by, so use the start of the query
+    return query.strip()[:50]
+
+
+# given a result list, return (number of series, number of samples)
+def count_series_and_samples(result_list: list[dict]) -> tuple[int, int]:
+    num_samples = 0
+    for series in result_list:
+        if 'values' in series:
+            num_samples += len(series['values'])
+        else:
+            num_samples += 1
+    return len(result_list), num_samples
+
+
+class QueryTelemetry():
+    """Ledger of every query sent: what it was for, how long it took, and how much data came back
+
+    Each entry records the query title, family (the title, or the query's metric name if there is no
+    title), workflow stage, endpoint, latency, response bytes, series and sample counts, retries,
+    cache status, and whether it failed. The latest max_entries entries are kept in memory (unless
+    keep_in_memory is False) and every entry is appended to a JSONL file if file_path is given. The file
+    is opened once, on the first entry, and kept open until close().
+    Running totals of every entry ever recorded are kept either way (see get_totals()).
+    """
+
+    def __init__(self, file_path: str | None = None, keep_in_memory: bool = True,
+                 max_entries: int | None = 10000) -> None:
+        self.file_path = file_path
+        self.keep_in_memory = keep_in_memory
+        self._entries = deque(maxlen=max_entries)
+        self._totals = _get_empty_totals()
+        self._lock = threading.Lock()
+        self._file = None
+
+    # pylint: disable=too-many-arguments
+    def record(self, query: str, endpoint: str, latency_sec: float, title: str | None = None,
+               num_bytes: int = 0, num_series: int = 0, num_samples: int = 0, retries: int = 0,
+               cache_status: str = "off", error: str | None = None) -> dict:
+        entry = {
+            "time": time.time(),
+            "title": title,
+            "family": title if title is not None else get_query_family(query),
+            "stage": get_stage(),
+            "endpoint": endpoint,
+            "latency_sec": round(latency_sec, 6),
+            "bytes": num_bytes,
+            "series": num_series,
+            "samples": num_samples,
+            "retries": retries,
+            "cache": cache_status,
+            "error": error,
+            "query": query
+        }
+        with self._lock:
+            _add_to_totals(self._totals, entry)
+            if self.keep_in_memory:
+                self._entries.append(entry)
+            if self.file_path is not None:
+                if self._file is None:
+                    # line buffered, so every entry is in the file as soon as it is recorded
+                    # pylint: disable=consider-using-with
+                    self._file = open(self.file_path, "a", encoding="utf-8", buffering=1)
+                self._file.write(json.dumps(entry) + "\n")
+        return entry
+
+    # returns the entries kept in memory, optionally only those recorded at or after since (unix time)
+    def get_entries(self, since: float | None = None) -> list[dict]:
+        with self._lock:
+            entries = list(self._entries)
+        if since is not None:
+            entries = [entry for entry in entries if entry["time"] >= since]
+        return entries
+
+    # returns the totals of every entry ever recorded (or since the last clear()), including the ones
+    # that no longer fit in memory, in the same format as the 'Totals' of summarize_entries()
+    def get_totals(self) -> dict[str, int | float]:
+        with self._lock:
+            totals = dict(self._totals)
+        totals["total_latency_sec"] = round(totals["total_latency_sec"], 3)
+        # bytes as total_mb, in its place
+        return {("total_mb" if key == "bytes" else key): (round(value / 2**20, 3) if key == "bytes" else value)
+                for key, value in totals.items()}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._totals = _get_empty_totals()
+
+    # close the telemetry file. It is opened again if more entries are recorded
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    # returns a summary of the entries (see summarize_entries()). Without since, 'Totals' covers every
+    # entry ever recorded, the rest only covers the entries kept in memory
+    def summarize(self, since: float | None = None, top_n: int = 10,
+                  bucket_seconds: int = 60) -> dict[str, pd.DataFrame]:
+        summary = summarize_entries(self.get_entries(since=since), top_n=top_n, bucket_seconds=bucket_seconds)
+        if since is None and self.get_totals()["queries"] > 0:
+            summary["Totals"] = pd.DataFrame([self.get_totals()])
+        return summary
+
+    # print a summary of the entries
+    def print_summary(self, since: float | None = None, top_n: int = 10, bucket_seconds: int = 60) -> None:
+        print_title("Query Telemetry")
+        print_dataframe_dict(self.summarize(since=since, top_n=top_n, bucket_seconds=bucket_seconds))
+
+
+def _get_empty_totals() -> dict[str, int | float]:
+    return {"queries": 0, "failed": 0, "cache_hits": 0, "coalesced": 0, "retries": 0,
+            "total_latency_sec": 0.0, "bytes": 0, "series": 0, "samples": 0}
+
+
+# add an entry to running totals (see _get_empty_totals())
+def _add_to_totals(totals: dict[str, int | float], entry: dict) -> None:
+    totals["queries"] += 1
+    totals["failed"] += entry["error"] is not None
+    totals["cache_hits"] += entry["cache"] == "hit"
+    totals["coalesced"] += entry["cache"] == "coalesced"
+    totals["retries"] += entry["retries"]
+    totals["total_latency_sec"] += entry["latency_sec"]
+    totals["bytes"] += entry["bytes"]
+    totals["series"] += entry["series"]
+    totals["samples"] += entry["samples"]
+
+
+# read the entries of a JSONL telemetry file
+def read_entries(file_path: str) -> list[dict]:
+    with open(file_path, "r", encoding="utf-8") as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+# given telemetry entries, return a dict of dataframes:
+#   'Totals': number of queries, failures, cache hits, coalesced queries, retries, total latency, bytes, series, samples
+#   'Slowest Queries': the top_n slowest queries
+#   'Throughput': queries, bytes, and samples per bucket_seconds of time
+#   'Latency by Family': count and p50/p95/p99/max latency of every query family
+def summarize_entries(entries: list[dict], top_n: int = 10, bucket_seconds: int = 60) -> dict[str, pd.DataFrame]:
+    df = pd.DataFrame(entries)
+    if len(df) == 0:
+        return {"Totals": pd.DataFrame(), "Slowest Queries": pd.DataFrame(),
+                "Throughput": pd.DataFrame(), "Latency by Family": pd.DataFrame()}
+
+    totals = pd.DataFrame([{
+        "queries": len(df),
+        "failed": int(df["error"].notna().sum()),
+        "cache_hits": int((df["cache"] == "hit").sum()),
+        "coalesced": int((df["cache"] == "coalesced").sum()),
+        "retries": int(df["retries"].sum()),
+        "total_latency_sec": round(df["latency_sec"].sum(), 3),
+        "total_mb": round(df["bytes"].sum() / 2**20, 3),
+        "series": int(df["series"].sum()),
+        "samples": int(df["samples"].sum())
+    }])
+
+    slowest_cols = ["title", "family", "stage", "latency_sec", "bytes", "series", "samples", "retries", "cache"]
+    slowest = df.nlargest(top_n, "latency_sec")[slowest_cols].reset_index(drop=True)
+
+    bucket_start = (df["time"] // bucket_seconds * bucket_seconds).astype(np.int64)
+    throughput = df.groupby(bucket_start).agg(
+        queries=("latency_sec", "size"), bytes=("bytes", "sum"), samples=("samples", "sum"))
+    throughput.index = pd.to_datetime(throughput.index, unit="s")
+    throughput.index.name = "bucket_start"
+    throughput["bytes_per_sec"] = throughput["bytes"] / bucket_seconds
+
+    latency_by_family = df.groupby("family")["latency_sec"].agg(
+        count="size",
+        p50=lambda latencies: latencies.quantile(0.5),
+        p95=lambda latencies: latencies.quantile(0.95),
+        p99=lambda latencies: latencies.quantile(0.99),
+        max="max"
+    ).sort_values(by="p95", ascending=False)
+
+    return {
+        "Totals": totals,
+        "Slowest Queries": slowest,
+        "Throughput": throughput,
+        "Latency by Family": latency_by_family
+    }
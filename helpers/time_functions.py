@@ -101,6 +101,24 @@ def calculate_offset(start: datetime, duration: int) -> str:
     return offset
 
 
+# given a start (datetime object) of a run and duration in seconds, return the unix time of the end
+# of the run as a string for the promql @ modifier (e.g. 'metric[1h] @ 1700000000').
+# Unlike calculate_offset(), the result doesn't depend on when it is called, so the same run always
+# gives the same query
+def calculate_eval_time(start: datetime, duration: int) -> str:
+    # check for proper inputs
+    assert isinstance(start, datetime), "start must be a datetime object"
+    try:
+        duration = float(duration)
+    except ValueError:
+        # pylint: disable=raise-missing-from
+        raise ValueError("duration must be a float or int")
+
+    end = start + timedelta(seconds=duration)
+    # whole ms are enough, and trailing zeros are dropped so whole seconds look like '1700000000'
+    return f"{end.timestamp():.3f}".rstrip("0").rstrip(".")
+
+
 # given an end_time (datetime) and an offset (string) (e.g. "12h5m30s"),
 # return a new datetime object offset away from the end_time
 def find_time_from_offset(end: datetime, offset: str) -> datetime:
@@ -1,5 +1,7 @@
 #!/usr/bin/python3
 # -*- coding: utf-8 -*-
+import os
+import tempfile
 from datetime import datetime
 
 
@@ -17,5 +19,108 @@ DEFAULT_FINAL_GRAPH_TIME = datetime.now()  # must be a datetime object
 # requerying
 # a value of 10 means there will be 10x the number of datapoints for a given timeframe
 REQUERY_GRAPH_STEP_DIVISOR = 10
+# dropped/recovered pods with overlapping time windows are requeried together in one query
+# (pod=~"a|b|c"). At most this many pods are put in one query
+REQUERY_MAX_PODS_PER_QUERY = 50
+# watch mode (see watch.py)
+# how often to refresh the header, tables, and graphs. Each refresh only queries graph data since the last one
+WATCH_INTERVAL_SEC = 60
+# how many samples to keep per graph series. None keeps DEFAULT_GRAPH_TIME_OFFSET's worth of samples
+WATCH_BUFFER_CAPACITY = None
 # how long to wait for data from a query before abandoning it
-QUERY_TIMEOUT_SEC = 20
\ No newline at end of file
+QUERY_TIMEOUT_SEC = 20
+
+# query client settings
+# prometheus (thanos) api to query. Set the PROMETHEUS_BASE_URL environment variable to point
+# somewhere else, e.g. a local replay server (see helpers/replay_server.py)
+BASE_URL = os.environ.get("PROMETHEUS_BASE_URL", "https://thanos.nrp-nautilus.io/api/v1/")
+# if set, every response from the api is saved to this directory as a fixture for the replay server.
+# Can also be set with the QUERY_RECORD_DIR environment variable
+QUERY_RECORD_DIR = os.environ.get("QUERY_RECORD_DIR")
+# query telemetry: the latest QUERY_TELEMETRY_MAX_ENTRIES queries' title, latency, response size, etc.
+# are kept in memory (for summaries, see helpers/telemetry.py) and, if QUERY_TELEMETRY_FILE is set, every
+# query is appended to that JSONL file
+QUERY_TELEMETRY_IN_MEMORY = True
+QUERY_TELEMETRY_MAX_ENTRIES = 10000
+QUERY_TELEMETRY_FILE = os.environ.get("QUERY_TELEMETRY_FILE")
+# how many connections to keep open to thanos at once (should be >= the number of query threads)
+QUERY_POOL_SIZE = 10
+# how many times to retry a query that failed to connect, timed out, or got a 429/5xx response
+QUERY_MAX_RETRIES = 3
+# how many times to retry a query that came back with no data (the api sometimes returns nothing)
+QUERY_EMPTY_RETRIES = 1
+# base and max wait (in seconds) between retries. Each retry waits a random time up to
+# QUERY_BACKOFF_SEC * 2^attempt, capped at QUERY_MAX_BACKOFF_SEC
+QUERY_BACKOFF_SEC = 0.5
+QUERY_MAX_BACKOFF_SEC = 10
+
+# load limiting toward thanos (see helpers/rate_limiting.py)
+# requests in flight start at QUERY_INITIAL_CONCURRENCY and are adjusted between the min and max:
+# raised while requests finish within QUERY_TARGET_LATENCY_SEC, halved when they are slower or fail
+QUERY_ADAPTIVE_CONCURRENCY = True
+QUERY_MIN_CONCURRENCY = 1
+QUERY_INITIAL_CONCURRENCY = 4
+QUERY_MAX_CONCURRENCY = QUERY_POOL_SIZE
+QUERY_TARGET_LATENCY_SEC = 5
+# most requests per second sent from this host, shared by every thread and process (None for no limit)
+QUERY_MAX_RPS = 20
+QUERY_RATE_LIMIT_FILE = os.path.join(tempfile.gettempdir(), 'premoa_query_rate_limit')
+# after QUERY_BREAKER_FAILURES failed requests in a row, queries fail immediately for
+# QUERY_BREAKER_RESET_SEC seconds before a trial request is let through
+QUERY_BREAKER_FAILURES = 10
+QUERY_BREAKER_RESET_SEC = 30
+# wait for the result of an identical query that is already in flight instead of sending it again
+QUERY_SINGLE_FLIGHT = True
+# queries longer than this many characters are sent in a POST body instead of the url
+QUERY_MAX_GET_LENGTH = 4000
+# instant queries of Header and Tables are combined into as few requests as possible
+# (see helpers/multiplexing.py). A combined query is at most QUERY_MUX_MAX_LENGTH characters
+QUERY_MULTIPLEX_INSTANT = True
+QUERY_MUX_MAX_LENGTH = 20000
+
+# query result cache
+# results of queries are saved to disk so re-running over the same time windows doesn't re-download
+QUERY_CACHE_ENABLED = True
+QUERY_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.query_cache')
+# least recently used results are deleted once the cache is bigger than this
+QUERY_CACHE_MAX_MB = 500
+# windows that end within QUERY_CACHE_SETTLE_SEC of now may still change, so they are only kept for
+# QUERY_CACHE_RECENT_TTL_SEC. Windows that ended before that are kept until evicted.
+QUERY_CACHE_SETTLE_SEC = 600
+QUERY_CACHE_RECENT_TTL_SEC = 60
+# instant queries without a time or @ modifiers are live snapshots of "now", so they skip the cache
+# unless this is True (then they are kept for QUERY_CACHE_RECENT_TTL_SEC)
+QUERY_CACHE_LIVE_QUERIES = False
+
+# range queries are snapped to multiples of their step. The whole, ended buckets (aligned to multiples of
+# the bucket size) a range covers are requested on their own, so windows relative to now (which move
+# every run) still re-use them from the cache. The rest of the range is requested as is.
+# The bucket size is the first of QUERY_RANGE_BUCKET_SEC with at least QUERY_RANGE_BUCKET_MIN_POINTS
+# points at the query's step (1 hour at a 1m step, 1 day at a 1h step)
+QUERY_RANGE_STEP_ALIGN = True
+QUERY_RANGE_BUCKET_SEC = [60 * 60, 6 * 60 * 60, 24 * 60 * 60, 7 * 24 * 60 * 60]
+QUERY_RANGE_BUCKET_MIN_POINTS = 60
+# buckets of one range query requested at once
+QUERY_RANGE_BUCKET_CONCURRENCY = 4
+# prometheus/thanos limit how many points one series can have in a single range query (11,000).
+# Any part of a range query that would return more points per series than this is split into
+# step-aligned sub-ranges, requested like buckets, and stitched back together
+QUERY_RANGE_MAX_POINTS = 10000
+
+# local store of range query samples (see helpers/series_store.py)
+# range queries are answered from the store first, and only the time that isn't stored is queried.
+# Only samples older than QUERY_CACHE_SETTLE_SEC are stored
+SERIES_STORE_ENABLED = True
+SERIES_STORE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.series_store')
+# every block file of the store holds this many seconds of samples
+SERIES_STORE_BLOCK_SEC = 6 * 60 * 60
+
+# replay server (helpers/replay_server.py) for running without access to the real api
+REPLAY_FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+REPLAY_PORT = 9090
+# seconds each response is delayed by, plus a random extra delay of up to REPLAY_LATENCY_JITTER_SEC
+REPLAY_LATENCY_SEC = 0
+REPLAY_LATENCY_JITTER_SEC = 0
+# fraction of requests that get a 503 error / an empty result (like the real api sometimes returns)
+REPLAY_ERROR_RATE = 0
+REPLAY_EMPTY_RATE = 0
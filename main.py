@@ -26,6 +26,8 @@ result_dict = get_all_data(
     get_graphs_as_one_df=False,
     # puts all tables into one dataframe instead of a dictionary with multiple tables.
     get_tables_as_one_df=False,
+    # number of queries to send at once. None sends them one at a time.
+    max_concurrency=None,
 )
 
 # print data and collect graphs info
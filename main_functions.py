@@ -1,10 +1,17 @@
 # Contains the definitions for all the functions that are called or can be called in main.py
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable
 import pandas as pd
 from termcolor import colored
 from header import Header
 from tables import Tables
 from graphs import Graphs
 from helpers.printing import print_heading, print_title, print_sub_title, print_dataframe_dict
+from helpers.concurrency import run_concurrently
+from helpers.query_planner import QueryPlanner
+from watch import Watcher
+from inputs import WATCH_INTERVAL_SEC
 
 # create variables for classes
 header_class = Header()
@@ -12,13 +19,14 @@ tables_class = Tables()
 graphs_class = Graphs()
 
 
-def get_header_data() -> dict[str, pd.DataFrame]:
-    return header_class.get_header_dict()
+def get_header_data(max_concurrency: int | None = None) -> dict[str, pd.DataFrame]:
+    return header_class.get_header_dict(max_concurrency=max_concurrency)
 
 
-def get_tables_data(only_include_worker_pods: bool = True) -> dict[str, pd.DataFrame]:
+def get_tables_data(only_include_worker_pods: bool = True, max_concurrency: int | None = None) -> dict[str, pd.DataFrame]:
     return tables_class.get_tables_dict(
         only_include_worker_pods=only_include_worker_pods,
+        max_concurrency=max_concurrency
     )
 
 
@@ -26,9 +34,11 @@ def get_graphs_data(
         get_graphs_as_one_df: bool = False,
         only_include_worker_pods: bool = False,
         display_time_as_datetime: bool = True,
-        show_runtimes: bool = False) -> dict[str, pd.DataFrame] | pd.DataFrame:
+        show_runtimes: bool = False,
+        max_concurrency: int | None = None) -> dict[str, pd.DataFrame] | pd.DataFrame:
     graphs_dict = graphs_class.get_graphs_dict(only_include_worker_pods=only_include_worker_pods,
-                                               display_time_as_datetime=display_time_as_datetime, show_runtimes=show_runtimes)
+                                               display_time_as_datetime=display_time_as_datetime, show_runtimes=show_runtimes,
+                                               max_concurrency=max_concurrency)
     if get_graphs_as_one_df:
         return graphs_class.get_graphs_as_one_df(graphs_dict=graphs_dict)
     return graphs_dict
@@ -36,28 +46,49 @@ def get_graphs_data(
 
 # returns three dicts: one containing all header data,
 # one with all tables, and one with all graph data
+# if max_concurrency is given, every header, tables, and graphs query is sent at once
+# using at most max_concurrency worker threads. Otherwise queries are sent one at a time.
+# if share_queries is True, the header and tables queries are planned together so series they
+# have in common are only queried once. Off by default: the header divides by kube-state-metrics
+# series while the tables use recording rules, so today the two don't have any series in common
 def get_all_data(only_include_worker_pods: bool = False, display_time_as_datetime: bool = True,
                  show_graph_runtimes: bool = False, get_graphs_as_one_df: bool = False,
-                 get_tables_as_one_df: bool = False) -> dict:
-    # get header data
-    print("    Retrieving Header Data")
-    header_dict = header_class.get_header_dict(
-        only_include_worker_pods=only_include_worker_pods
-    )
+                 get_tables_as_one_df: bool = False, max_concurrency: int | None = None,
+                 share_queries: bool = False) -> dict:
+    header_results, tables_results = None, None
+    if share_queries:
+        header_results, tables_results = _get_planned_results(
+            max_concurrency=max_concurrency, only_include_worker_pods=only_include_worker_pods)
 
-    # get tables data
-    print("    Retrieving Tables Data")
-    tables_dict = tables_class.get_tables_dict(
-        only_include_worker_pods=only_include_worker_pods
-    )
+    if max_concurrency is not None:
+        header_dict, tables_dict, graphs_dict = _get_all_data_concurrently(
+            max_concurrency=max_concurrency,
+            only_include_worker_pods=only_include_worker_pods,
+            display_time_as_datetime=display_time_as_datetime,
+            show_graph_runtimes=show_graph_runtimes,
+            header_results=header_results, tables_results=tables_results)
+    else:
+        # get header data
+        print("    Retrieving Header Data")
+        header_dict = header_class.get_header_dict(
+            only_include_worker_pods=only_include_worker_pods,
+            results=header_results
+        )
 
-    # get graphs data
-    print("    Retrieving Graphs Data")
-    graphs_dict = graphs_class.get_graphs_dict(
-        only_include_worker_pods=only_include_worker_pods,
-        display_time_as_datetime=display_time_as_datetime,
-        show_runtimes=show_graph_runtimes
-    )
+        # get tables data
+        print("    Retrieving Tables Data")
+        tables_dict = tables_class.get_tables_dict(
+            only_include_worker_pods=only_include_worker_pods,
+            results=tables_results
+        )
+
+        # get graphs data
+        print("    Retrieving Graphs Data")
+        graphs_dict = graphs_class.get_graphs_dict(
+            only_include_worker_pods=only_include_worker_pods,
+            display_time_as_datetime=display_time_as_datetime,
+            show_runtimes=show_graph_runtimes
+        )
 
     # set up dict to be returned
     return_dict = {
@@ -78,6 +109,57 @@ def get_all_data(only_include_worker_pods: bool = False, display_time_as_datetim
     return return_dict
 
 
+# get the header, tables, and graphs dicts with all of their queries sharing one pool of
+# max_concurrency worker threads. Returns (header_dict, tables_dict, graphs_dict)
+def _get_all_data_concurrently(max_concurrency: int, only_include_worker_pods: bool = False,
+                               display_time_as_datetime: bool = True,
+                               show_graph_runtimes: bool = False,
+                               header_results: dict | None = None,
+                               tables_results: dict | None = None) -> tuple[dict, dict, dict]:
+    print(f"    Retrieving Header, Tables, and Graphs Data ({max_concurrency} workers)")
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        # each class submits its queries to the shared executor and waits on them,
+        # so the three of them run side by side in their own threads, outside of the pool
+        collectors = {
+            'header': partial(header_class.get_header_dict,
+                              only_include_worker_pods=only_include_worker_pods,
+                              executor=executor, results=header_results),
+            'tables': partial(tables_class.get_tables_dict,
+                              only_include_worker_pods=only_include_worker_pods,
+                              executor=executor, results=tables_results),
+            'graphs': partial(graphs_class.get_graphs_dict,
+                              only_include_worker_pods=only_include_worker_pods,
+                              display_time_as_datetime=display_time_as_datetime,
+                              show_runtimes=show_graph_runtimes, executor=executor)
+        }
+        results = run_concurrently(collectors, max_concurrency=len(collectors))
+
+    # failures of individual queries are already handled by each class, so anything
+    # left here is a real error
+    for result in results.values():
+        if isinstance(result, Exception):
+            raise result
+    return results['header'], results['tables'], results['graphs']
+
+
+# query every header and tables series once, planned together by a QueryPlanner, and print how
+# many queries that saved. Returns (header results, tables results), each a dict of {title: result_list}
+# if only_include_worker_pods, only worker pods are queried
+def _get_planned_results(max_concurrency: int | None = None,
+                         only_include_worker_pods: bool = False) -> tuple[dict, dict]:
+    tables_queries, tables_partial_queries = tables_class.get_queries(
+        only_include_worker_pods=only_include_worker_pods)
+    planner = QueryPlanner()
+    planner.add_queries('tables', {**tables_queries, **tables_partial_queries})
+    planner.add_queries('header', header_class.get_queries(only_include_worker_pods=only_include_worker_pods))
+    report = planner.get_report()
+    print(f"    Query planner: {report['queries_sent']} of {report['queries']} header and tables queries sent "
+          f"({report['queries_eliminated']} eliminated, calculated locally: {', '.join(report['calculated_locally'])})")
+    results = planner.execute(
+        max_concurrency=max_concurrency, multiplex=tables_class.multiplex_queries)
+    return results.get('header', {}), results.get('tables', {})
+
+
 # prints data for headers, tables, and graphs.
 def print_all_data(data_dict: dict | None = None) -> None:
     # if there is no data passed in, generate it
@@ -104,6 +186,18 @@ def print_all_data(data_dict: dict | None = None) -> None:
         print(graphs)
 
 
+# keep refreshing the header, tables, and graphs every interval_sec (until ctrl+c, or until iterations
+# refreshes have been done). Only the changed rows and new graph samples of every refresh are
+# printed, or passed to callback if given. Returns the Watcher, which has the latest data
+def watch_all_data(interval_sec: float = WATCH_INTERVAL_SEC, only_include_worker_pods: bool = False,
+                   max_concurrency: int | None = None, callback: Callable[[dict], None] | None = None,
+                   iterations: int | None = None) -> Watcher:
+    watcher = Watcher(interval_sec=interval_sec, only_include_worker_pods=only_include_worker_pods,
+                      max_concurrency=max_concurrency, callback=callback)
+    watcher.run(iterations=iterations)
+    return watcher
+
+
 # get information on dropped/recovered pods and requery if requested.
 # Then return a dict of 'losses' (dropped/recovered pods) and 'requeried' graphs
 def check_graphs_losses(
@@ -1,10 +1,16 @@
 import shutil
+from concurrent.futures import Executor, ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
+from functools import partial
+from typing import Callable, Iterator
 import pandas as pd
+from tqdm import tqdm
+from termcolor import colored
 
 # modules
 from tables import Tables
-from helpers.time_functions import delta_to_time_str, datetime_ify, calculate_offset
+from helpers.concurrency import submit_in_context
+from helpers.time_functions import delta_to_time_str, datetime_ify, calculate_eval_time
 
 
 class TableQueryer():
@@ -12,53 +18,43 @@ class TableQueryer():
 
     def __init__(self, namespace: str = "wifire-quicfire") -> None:
         self.namespace = namespace
-        self._tables_class = Tables(namespace=namespace)
 
     # given a dataframe of runs, and list of indices of runs in the dataframe, (can also specify as_one_df and only_include_worker_pods)
     # return a dataframe (if as_one_df==True) of all of the tables queried for those runs
     # or return a list of dataframes (if_as_one_df==False) of all the tables queried for that run
-    def get_tables_for_many_runs(self, runs_df: pd.DataFrame, run_indices: list[int], as_one_df: bool = False, only_include_worker_pods: bool = False) -> list[pd.DataFrame]:
-        # get run start times as datetimes
-        runs_df['start'] = runs_df['start'].apply(datetime_ify)
-
-        # get all the selected runs into a single df to iterate over
-        selected_runs_df = runs_df.iloc[run_indices]
-
-        # get tables as a single dataframe for each run, add it to dfs_list
-        dfs_list = []
-        for index, run in selected_runs_df.iterrows():
-            # get duration and start of run
-            start = run['start']
-            duration_seconds = run['runtime']
-
-            # get queries and partial_queries to be passed into tables_class methods
-            run_queries, run_partial_queries = self._get_queries(
-                start, duration_seconds)
-
-            # get tables as one df from queries
-            tables_df = self._tables_class.get_tables_as_one_df(
-                only_include_worker_pods=only_include_worker_pods,
-                queries=run_queries,
-                partial_queries=run_partial_queries)
-            # fill in missing values in requests and limits
-            tables_df = self._fill_in_static_na(tables_df, "cpu")
-            tables_df = self._fill_in_static_na(tables_df, "mem")
-
-            # add tables_df to dfs_list
-            tables_df = self._rename_tables(tables_df)
-            tables_df.insert(0, 'run_index', index)
-            if 'run_uuid' in run:
-                tables_df.insert(0, 'run_id', run['run_uuid'])
-            dfs_list.append(tables_df)
+    # if max_concurrency (or a shared executor) is given, that many runs are queried at once. Otherwise runs are
+    # queried one at a time. Either way, a run that fails prints a warning and is left out, so the tables of
+    # every run that succeeded are still returned (a summary of the failed runs is printed at the end).
+    # the tables are in the same order as run_indices
+    def get_tables_for_many_runs(self, runs_df: pd.DataFrame, run_indices: list[int], as_one_df: bool = False, only_include_worker_pods: bool = False,
+                                 max_concurrency: int | None = None, executor: Executor | None = None) -> list[pd.DataFrame] | pd.DataFrame:
+        # runs finish in any order, so put them back in the order of run_indices
+        tables_by_position = dict(self._iter_run_tables(
+            runs_df, run_indices, only_include_worker_pods=only_include_worker_pods,
+            max_concurrency=max_concurrency, executor=executor, raise_failures=False))
+        dfs_list = [tables_by_position[position] for position in sorted(tables_by_position)]
 
         # get all runs as a single dataframe
         if as_one_df:
+            if len(dfs_list) == 0:
+                return pd.DataFrame()
             table_runs_df = pd.concat(dfs_list, ignore_index=True)
             return table_runs_df
 
         # otherwise, return a list of dataframes
         return dfs_list
 
+    # same as get_tables_for_many_runs(), but yields (run index, tables dataframe) for every run as soon as
+    # it is done (in the order they finish if max_concurrency or executor is given), so results can be
+    # saved or processed while the other runs are still being queried. If any runs failed, a RuntimeError
+    # is raised after every other run has been yielded
+    def iter_tables_for_many_runs(self, runs_df: pd.DataFrame, run_indices: list[int], only_include_worker_pods: bool = False,
+                                  max_concurrency: int | None = None, executor: Executor | None = None) -> Iterator[tuple[int, pd.DataFrame]]:
+        for position, tables_df in self._iter_run_tables(
+                runs_df, run_indices, only_include_worker_pods=only_include_worker_pods,
+                max_concurrency=max_concurrency, executor=executor):
+            yield run_indices[position], tables_df
+
     # given a dataframe of runs, and an index of a run in the dataframe, (can also specify as_one_df and only_include_worker_pods)
     # return a dataframe (if as_one_df==True) of all of the tables queried for that run
     # or return a dict of dataframes (if_as_one_df==False) of all the tables queried for that run separated by table type
@@ -107,6 +103,80 @@ class TableQueryer():
 
         return tables_dict
 
+    # yields (position in run_indices, tables dataframe) for every run as it is done. See get_tables_for_many_runs().
+    # Once every run is done, a RuntimeError is raised for the runs that failed if raise_failures,
+    # otherwise a warning listing them is printed
+    # pylint: disable=too-many-arguments
+    def _iter_run_tables(self, runs_df: pd.DataFrame, run_indices: list[int], only_include_worker_pods: bool = False,
+                         max_concurrency: int | None = None, executor: Executor | None = None,
+                         raise_failures: bool = True) -> Iterator[tuple[int, pd.DataFrame]]:
+        # get run start times as datetimes
+        runs_df['start'] = runs_df['start'].apply(datetime_ify)
+        # get all the selected runs into a single df to iterate over
+        selected_runs_df = runs_df.iloc[run_indices]
+        tasks = [
+            partial(self._get_run_tables_df, index, run, only_include_worker_pods=only_include_worker_pods)
+            for index, run in selected_runs_df.iterrows()
+        ]
+
+        new_executor = None
+        if max_concurrency is None and executor is None:
+            outcomes = _run_in_order(tasks)
+        elif executor is None:
+            new_executor = ThreadPoolExecutor(max_workers=max_concurrency)
+            outcomes = _run_on(new_executor, tasks)
+        else:
+            outcomes = _run_on(executor, tasks)
+
+        # a failed run doesn't stop the others. The failures are reported once every run is done
+        failed_runs = []
+        try:
+            for position, outcome in outcomes:
+                if isinstance(outcome, Exception):
+                    run_label = selected_runs_df.index.tolist()[position]
+                    print(colored(f"\nQuerying tables for run {run_label} failed: {outcome!r}", "red"))
+                    failed_runs.append((run_label, outcome))
+                    continue
+                yield position, outcome
+        finally:
+            if new_executor is not None:
+                new_executor.shutdown()
+        if len(failed_runs) == 0:
+            return
+        message = (f"Querying tables failed for {len(failed_runs)} of {len(tasks)} runs: "
+                   f"{[run_label for run_label, _ in failed_runs]}")
+        if raise_failures:
+            raise RuntimeError(message) from failed_runs[0][1]
+        print(colored(f"\n{message}. Returning the tables of the other runs", "yellow"))
+
+    # given a run's index and row in the runs dataframe, return its tables as one dataframe with the
+    # run_index (and run_id if the run has a run_uuid) inserted as the first columns.
+    # Every run gets its own Tables, since Tables keeps the tables it filled in and returns them again
+    def _get_run_tables_df(self, index: int, run: pd.Series, only_include_worker_pods: bool = False) -> pd.DataFrame:
+        # get duration and start of run
+        start = run['start']
+        duration_seconds = run['runtime']
+
+        # get queries and partial_queries to be passed into tables_class methods
+        run_queries, run_partial_queries = self._get_queries(
+            start, duration_seconds)
+
+        # get tables as one df from queries
+        tables_class = Tables(namespace=self.namespace)
+        tables_df = tables_class.get_tables_as_one_df(
+            only_include_worker_pods=only_include_worker_pods,
+            queries=run_queries,
+            partial_queries=run_partial_queries)
+        # fill in missing values in requests and limits
+        tables_df = self._fill_in_static_na(tables_df, "cpu")
+        tables_df = self._fill_in_static_na(tables_df, "mem")
+
+        tables_df = self._rename_tables(tables_df)
+        tables_df.insert(0, 'run_index', index)
+        if 'run_uuid' in run:
+            tables_df.insert(0, 'run_id', run['run_uuid'])
+        return tables_df
+
     def _get_static_query_bodies(self) -> dict[str, str]:
         # Static Metrics: metrics that never change throughout a run, e.g. Memory Limits
         static_query_bodies = {
@@ -180,14 +250,14 @@ class TableQueryer():
     # assemble queries for all max based metrics
     def _assemble_max_queries(self, start: datetime, duration_seconds: int) -> dict[str, str]:
         duration_seconds = int(duration_seconds)
-        # get offset and duration for query
-        offset = calculate_offset(start, duration_seconds)
+        # get evaluation time (end of the run) and duration for query
+        eval_time = calculate_eval_time(start, duration_seconds)
         duration = delta_to_time_str(timedelta(seconds=duration_seconds))
 
         # get components of query ready to be assembled
         prefix = "sum by (node, pod) (max_over_time("
         suffix = '{namespace="' + self.namespace + \
-            '"}[' + str(duration) + '] offset ' + str(offset) + '))'
+            '"}[' + str(duration) + '] @ ' + eval_time + '))'
 
         # assemble queries
         max_queries = {}
@@ -200,14 +270,14 @@ class TableQueryer():
     # assemble queries for all increase based metrics
     def _assemble_increase_queries(self, start: datetime, duration_seconds: int) -> dict[str, str]:
         duration_seconds = int(duration_seconds)
-        # get offset and duration for query
-        offset = calculate_offset(start, duration_seconds)
+        # get evaluation time (end of the run) and duration for query
+        eval_time = calculate_eval_time(start, duration_seconds)
         duration = delta_to_time_str(timedelta(seconds=duration_seconds))
 
         # get components of query ready to be assembled
         prefix = "sum by (node, pod) (increase("
         suffix = '{namespace="' + self.namespace + \
-            '"}[' + str(duration) + '] offset ' + str(offset) + '))'
+            '"}[' + str(duration) + '] @ ' + eval_time + '))'
 
         # assemble queries
         increase_queries = {}
@@ -219,9 +289,9 @@ class TableQueryer():
 
     # assemble queries for all static metrics
     def _assemble_static_queries(self, start: datetime, duration_seconds: int) -> dict[str, str]:
-        # get offset for query 5 seconds after run started instead of as run ends - fewer NA pods for limits and requests
-        # to get offset for when the run ends, use `offset = calculate_offset(start, duration_seconds)`
-        offset = calculate_offset(start, 5)
+        # evaluate query 5 seconds after run started instead of as run ends - fewer NA pods for limits and requests
+        # to evaluate when the run ends, use `eval_time = calculate_eval_time(start, duration_seconds)`
+        eval_time = calculate_eval_time(start, 5)
 
         # get prefix of query ready for assembly (suffix gets defined while looping over query_bodies)
         prefix = "sum by (node, pod) ("
@@ -229,8 +299,8 @@ class TableQueryer():
         # get the right suffix depending on the resource
         suffixes = {
             # change metric from measuring cpu cores to cpu seconds by multiplying by seconds
-            'cpu': '{resource="cpu", namespace="' + self.namespace + '"} offset ' + str(offset) + ') * ' + str(duration_seconds),
-            'mem': '{resource="memory", namespace="' + self.namespace + '"} offset ' + str(offset) + ')'
+            'cpu': '{resource="cpu", namespace="' + self.namespace + '"} @ ' + eval_time + ') * ' + str(duration_seconds),
+            'mem': '{resource="memory", namespace="' + self.namespace + '"} @ ' + eval_time + ')'
         }
 
         # assemble queries
@@ -342,6 +412,30 @@ class TableQueryer():
             return tables_list
 
 
+# run the tasks one at a time and yield (position, result), with the exception as the result if a task fails
+def _run_in_order(tasks: list[Callable]) -> Iterator[tuple[int, any]]:
+    for position, task in enumerate(tasks):
+        try:
+            result = task()
+        # pylint: disable=broad-exception-caught
+        except Exception as exc:
+            result = exc
+        yield position, result
+
+
+# submit every task to the executor and yield (position, result) as they finish, with the exception as
+# the result if a task fails
+def _run_on(executor: Executor, tasks: list[Callable]) -> Iterator[tuple[int, any]]:
+    futures = {submit_in_context(executor, task): position for position, task in enumerate(tasks)}
+    for future in tqdm(as_completed(futures), total=len(futures)):
+        try:
+            result = future.result()
+        # pylint: disable=broad-exception-caught
+        except Exception as exc:
+            result = exc
+        yield futures[future], result
+
+
 # ============================
 #         Main Program
 # ============================
@@ -382,6 +476,8 @@ if __name__ == "__main__":
             run_indices=RUN_INDICES,
             as_one_df=True,  # if set to False, returns a dictionary of titles, tables
             # if set to True, only includes bp3d-worker pods and changes their name to be just their ensemble id
-            only_include_worker_pods=False
+            only_include_worker_pods=False,
+            # number of runs to query at once. None queries them one at a time
+            max_concurrency=8
         )
         print(runs_tables_df)
@@ -1,17 +1,27 @@
 #!/usr/bin/python3
 # -*- coding: utf-8 -*-
+from concurrent.futures import Executor
+from functools import partial
 import pandas as pd
 from tqdm import tqdm
 from helpers.querying import query_data
-from helpers.filtering import filter_df_for_workers
-from inputs import NAMESPACE, DEFAULT_DURATION, QUERY_TIMEOUT_SEC
+from helpers.concurrency import run_concurrently, replace_failures
+from helpers.multiplexing import query_multiplexed
+from helpers.decoding import vector_to_df
+from helpers.joining import join_on_labels
+from helpers.filtering import filter_df_for_workers, add_worker_pod_matcher_to_queries
+from inputs import NAMESPACE, DEFAULT_DURATION, QUERY_TIMEOUT_SEC, QUERY_MULTIPLEX_INSTANT
 
 
 class Tables():
-    def __init__(self, namespace: str = NAMESPACE, duration: str = DEFAULT_DURATION, query_timeout_seconds:int = QUERY_TIMEOUT_SEC) -> None:
+    # if multiplex_queries is True, all table queries are combined into as few requests as possible
+    # (see helpers/multiplexing.py)
+    def __init__(self, namespace: str = NAMESPACE, duration: str = DEFAULT_DURATION, query_timeout_seconds:int = QUERY_TIMEOUT_SEC,
+                 multiplex_queries: bool = QUERY_MULTIPLEX_INSTANT) -> None:
         self.namespace = namespace
         self.duration = duration
         self.query_timeout_seconds = query_timeout_seconds
+        self.multiplex_queries = multiplex_queries
         self.cpu_quota = pd.DataFrame(columns=[
                                       "Node", "Pod", "CPU Usage", "CPU Requests", "CPU Requests %", "CPU Limits", "CPU Limits %"])
         self.mem_quota = pd.DataFrame(columns=["Node", "Pod", "Memory Usage", "Memory Requests",  "Memory Requests %",
@@ -20,6 +30,8 @@ class Tables():
                                           "Rate of Transmitted Packets", "Rate of Received Packets Dropped", "Rate of Transmitted Packets Dropped"])
         self.storage_io = pd.DataFrame(columns=["Node", "Pod", "IOPS(Reads)", "IOPS(Writes)",
                                        "IOPS(Reads + Writes)", "Throughput(Read)", "Throughput(Write)", "Throughput(Read + Write)"])
+        # whether the tables above were filled in with only worker pods queried
+        self._worker_pods_only = False
         self.queries = {
             # CPU Quota
             'CPU Usage': 'sum by(node, pod) (node_namespace_pod_container:container_cpu_usage_seconds_total:sum_irate{cluster="", namespace="' + self.namespace + '"})',
@@ -48,14 +60,31 @@ class Tables():
         }
 
     # get a dictionary of all the tables
-    def get_tables_dict(self, only_include_worker_pods: bool = False, queries: dict[str, str] = None, partial_queries: dict[str, str] = None) -> dict[str, pd.DataFrame]:
+    # if max_concurrency (or a shared executor) is given, all table queries are sent at once
+    # if results (a dict of {column title: result_list}) is given, it is used instead of querying
+    # if only_include_worker_pods, only worker pods are queried (see get_queries())
+    def get_tables_dict(self, only_include_worker_pods: bool = False, queries: dict[str, str] = None, partial_queries: dict[str, str] = None,
+                        max_concurrency: int | None = None, executor: Executor | None = None,
+                        results: dict[str, list[dict]] | None = None) -> dict[str, pd.DataFrame]:
         # Note: queries and partial_queries can be passed in as None and will be updated in
         # _fill_df_by_queries() for the first 3 and _get_storage_io() for 'Current Storage IO'
+        queries, partial_queries = self.get_queries(
+            only_include_worker_pods=only_include_worker_pods, queries=queries, partial_queries=partial_queries)
+        # tables filled in for the other kind of pods can't be reused
+        if only_include_worker_pods != self._worker_pods_only:
+            self.clear_tables()
+            self._worker_pods_only = only_include_worker_pods
+
+        if results is None and (max_concurrency is not None or executor is not None or self.multiplex_queries):
+            results = self._prefetch_results(
+                queries=queries, partial_queries=partial_queries,
+                max_concurrency=max_concurrency, executor=executor)
+
         tables_dict = {
-            'CPU Quota': self._get_cpu_quota(queries=queries),
-            'Memory Quota': self._get_mem_quota(queries=queries),
-            'Current Network Usage': self._get_network_usage(queries=queries),
-            'Current Storage IO': self._get_storage_io(partial_queries=partial_queries)
+            'CPU Quota': self._get_cpu_quota(queries=queries, results=results),
+            'Memory Quota': self._get_mem_quota(queries=queries, results=results),
+            'Current Network Usage': self._get_network_usage(queries=queries, results=results),
+            'Current Storage IO': self._get_storage_io(partial_queries=partial_queries, results=results)
         }
 
         # filter by worker pods if requested
@@ -65,6 +94,20 @@ class Tables():
 
         return tables_dict
 
+    # returns the (queries, partial_queries) of the tables, defaulting to self.queries and self.partial_queries.
+    # If only_include_worker_pods, every query only selects bp3d-worker pods, so the other pods in
+    # the namespace aren't sent back at all
+    def get_queries(self, only_include_worker_pods: bool = False, queries: dict[str, str] | None = None,
+                    partial_queries: dict[str, str] | None = None) -> tuple[dict[str, str], dict[str, str]]:
+        if queries is None:
+            queries = self.queries
+        if partial_queries is None:
+            partial_queries = self.partial_queries
+        if only_include_worker_pods:
+            queries = add_worker_pod_matcher_to_queries(queries)
+            partial_queries = add_worker_pod_matcher_to_queries(partial_queries)
+        return queries, partial_queries
+
     # Given a dictionary of queries, generate a table based on those queries
     # Note: if the queries do not start with "sum by(node, pod)", then you must set sum_by
     #        to be what the query has in "sum by(_____)""
@@ -106,126 +149,135 @@ class Tables():
 
     # combines all table dataframes into one large dataframe.
     # Each table is represented as a few columns.
-    # this works because all tables are queried for the same time frame and they have the same pods
-    def get_tables_as_one_df(self, tables_dict: dict[str, pd.DataFrame] | None = None, only_include_worker_pods: bool = False, queries: dict[str, str] = None, partial_queries: dict[str, str] = None) -> pd.DataFrame:
-        # initialize total df
-        total_df = pd.DataFrame(columns=['Node', 'Pod'])
-
+    # Rows are matched by Node and Pod, so tables don't need to have the same pods in the same order
+    def get_tables_as_one_df(self, tables_dict: dict[str, pd.DataFrame] | None = None, only_include_worker_pods: bool = False, queries: dict[str, str] = None, partial_queries: dict[str, str] = None,
+                             max_concurrency: int | None = None) -> pd.DataFrame:
         # Generate tables if none given
         if tables_dict is None:
             tables_dict = self.get_tables_dict(
                 only_include_worker_pods=only_include_worker_pods,
-                queries=queries, partial_queries=partial_queries)
+                queries=queries, partial_queries=partial_queries,
+                max_concurrency=max_concurrency)
 
-        # get first table_df that isn't empty and use its Node and Pod columns
+        # Join the tables' columns on Node and Pod. A column that is in several tables is only kept once
+        table_dfs = []
+        columns_added = {'Node', 'Pod'}
         for table_df in tables_dict.values():
-            if not table_df.empty:
-                total_df = table_df[['Node', 'Pod']].copy()
-                break
-
-        # Fill in tables columns
-        for table_df in tables_dict.values():
-            for column in table_df.columns:
-                # Node and Pod columns are all the same for each table_df
-                if column in ["Node", "Pod"]:
-                    continue
-                # Add unique columns to total_df
-                total_df[column] = table_df[column].copy()
-
-        return total_df
+            new_columns = [column for column in table_df.columns if column not in columns_added]
+            columns_added.update(new_columns)
+            table_dfs.append(table_df[['Node', 'Pod'] + new_columns])
+        return join_on_labels(table_dfs, keys=['Node', 'Pod'])
 
     # return a dataframe of pods, nodes, and values for a given result_list for a
     # column in a table (e.g. CPUQuota: CPU usage)
     def _generate_df(self, col_title: str, res_list: list[dict]) -> pd.DataFrame:
-        # initialize dataframe and filter json data
-        df = pd.DataFrame(columns=['Node', 'Pod', col_title])
-        # df = pd.DataFrame(columns=['Time', 'Node', 'Pod', col_title])  # for timestamp
-        # fill in dataframe
-        for datapoint in res_list:
-            # each datapoint in parsed_data is a dictionary with node (str), pod (str), (int)
-            node = datapoint['metric']['node']
-            pod = datapoint['metric']['pod']
-            value = datapoint['value'][1]
-            # timestamp = data_point['value'][0]  # for timestamp
-            # add a row to the end of the dataframe containing a node, pod, and value
-            df.loc[len(df.index)] = [node, pod, value]
-            # df.loc[len(df.index)] = [timestamp, node, pod, value]  # for timestamp
+        # each datapoint in res_list is a dictionary with node (str), pod (str), and value
+        df = vector_to_df(res_list, col_title, label_names=['node', 'pod'])
         return df
 
     # returns an updated dataframe by filling in data queried from the
     # columns in a passed in dataframe
+    # if results (a dict of {column title: result_list}) contains a column, it is used instead of querying
     def _fill_df_by_queries(
-            self, table_df: pd.DataFrame, queries: dict[str, str] | None = None) -> pd.DataFrame:
+            self, table_df: pd.DataFrame, queries: dict[str, str] | None = None,
+            results: dict[str, list[dict]] | None = None) -> pd.DataFrame:
         # check if they passed in a dict of queries.
         if queries is None:
             queries = self.queries
 
-        # update the columns of the database with the data from querying
-        for col_title in tqdm(table_df.columns):
+        # query for every column that has a query (no progress bar if the results are already given,
+        # e.g. prefetched or by a watch refresh, since nothing is queried here)
+        new_dfs = []
+        for col_title in tqdm(table_df.columns, disable=results is not None):
             # get the corresponding query for each column
             query = queries.get(col_title)
             if query is None:
                 continue
 
-            # update the table with the new column information
-            result_list = query_data(query, timeout_sec=self.query_timeout_seconds)
-            new_df = self._generate_df(col_title, result_list)
-
-            # if table_df is not empty
-            if len(table_df.index) > 0:
-                # add column to the rightmost end of the dataframe
-                final_col = new_df.columns[-1]
-                table_df[final_col] = new_df[final_col]
-            else:  # table_df is empty.
-                # set table_df equal to the new df to fill in node and pod too
-                for column in new_df.columns:
-                    table_df[column] = new_df[column]
-        return table_df
+            if results is not None and col_title in results:
+                result_list = results[col_title]
+            else:
+                result_list = query_data(
+                    query, timeout_sec=self.query_timeout_seconds, title=col_title)
+            new_dfs.append(self._generate_df(col_title, result_list))
+
+        # join the new columns (and any columns the table already has) on Node and Pod,
+        # keeping the table's column order. Columns without a query (e.g. percents) are left empty
+        new_columns = [new_df.columns[-1] for new_df in new_dfs]
+        if len(table_df.index) > 0:
+            new_dfs.insert(0, table_df.drop(columns=new_columns))
+        joined_df = join_on_labels(new_dfs, keys=['Node', 'Pod'])
+        columns = list(dict.fromkeys(list(table_df.columns) + list(joined_df.columns)))
+        return joined_df.reindex(columns=columns)
 
     def _generate_table_df(self, query_title: str, query: str, sum_by: list[str] | str | None = "_") -> pd.DataFrame:
         # set ['node', 'pod'] as default for sum_by without putting dangerous default list in definition
         if sum_by == "_":
             sum_by = ["node", "pod"]
         # query for data
-        result_list = query_data(query, timeout_sec=self.query_timeout_seconds)
+        result_list = query_data(
+            query, timeout_sec=self.query_timeout_seconds, title=query_title)
         if len(result_list) == 0:
             return None
 
-        # prepare columns for table. columns will be appended to one pod at a time
-        values_column = []
-
-        # initialize sum_by columns to eventually be put into the table
-        if sum_by is not None:  # if sum_by is None, don't add a sum_by column
-            sum_by_columns = {metric: [] for metric in sum_by}
+        # decode the result list into sum_by (title case) and value columns
+        table_df = vector_to_df(result_list, query_title, label_names=sum_by)
 
-        # loop through the data for each pod. The data has: node, pod, values, timestamps
-        for datapoint in result_list:
-            # prepare data to be extracted
-            values_list = []
-
-            # fill in lists
-            time_value_pair = datapoint['value']
-            values_list.append(float(time_value_pair[1]))
+        return table_df
 
-            # add pod's lists to the table's columns
-            values_column.extend(values_list)
-            # add sum_by column (e.g. pod name)
-            if sum_by is not None:
-                for item in sum_by:
-                    item_list = [datapoint['metric'][item]]*len(values_list)
-                    sum_by_columns[item].extend(item_list)
+    # query every column of the tables that haven't been filled in yet concurrently (or combined into
+    # as few queries as possible if multiplex_queries is set).
+    # returns a dict of {column title: result_list} to be passed into _fill_df_by_queries()
+    def _prefetch_results(self, queries: dict[str, str] | None = None, partial_queries: dict[str, str] | None = None,
+                          max_concurrency: int | None = None, executor: Executor | None = None) -> dict[str, list[dict]]:
+        queries_to_send = self.get_queries_to_send(queries=queries, partial_queries=partial_queries)
+        if self.multiplex_queries:
+            results = query_multiplexed(queries_to_send, timeout_sec=self.query_timeout_seconds,
+                                        max_concurrency=max_concurrency, executor=executor)
+            return replace_failures(results, default=[])
+
+        tasks = {
+            col_title: partial(query_data, query, timeout_sec=self.query_timeout_seconds, title=col_title)
+            for col_title, query in queries_to_send.items()
+        }
+        results = run_concurrently(
+            tasks, max_concurrency=max_concurrency, executor=executor,
+            progress_bar=executor is None)
+        return replace_failures(results, default=[])
+
+    # returns a dict of {column title: query} for every column of every table that hasn't been filled in yet,
+    # in the order _prefetch_results() sends them
+    def get_queries_to_send(self, queries: dict[str, str] | None = None,
+                            partial_queries: dict[str, str] | None = None) -> dict[str, str]:
+        if queries is None:
+            queries = self.queries
+        if partial_queries is None:
+            partial_queries = self.partial_queries
 
-        # create and populate table dataframe
-        table_df = pd.DataFrame()
-        # add in sum_by columns
-        if sum_by is not None:  # if sum_by is None, don't add a sum_by column
-            for item in sum_by:
-                # make sure item cols in table are title case (Capitalized First Letters Of Words)
-                table_df[item.title()] = sum_by_columns[item]
-        # add in values column
-        table_df[query_title] = values_column
+        # collect the queries for every column of every empty table
+        tables_and_queries = [
+            (self.cpu_quota, queries),
+            (self.mem_quota, queries),
+            (self.network_usage, queries),
+            (self.storage_io, partial_queries)
+        ]
+        queries_to_send = {}
+        for table_df, table_queries in tables_and_queries:
+            if len(table_df.index) > 0:
+                continue
+            for col_title in table_df.columns:
+                query = table_queries.get(col_title)
+                if query is None:
+                    continue
+                queries_to_send[col_title] = query
+        return queries_to_send
 
-        return table_df
+    # empty every table (keeping its columns) so they are filled in again the next time they are needed
+    def clear_tables(self) -> None:
+        self.cpu_quota = self.cpu_quota.iloc[0:0]
+        self.mem_quota = self.mem_quota.iloc[0:0]
+        self.network_usage = self.network_usage.iloc[0:0]
+        self.storage_io = self.storage_io.iloc[0:0]
 
     def _calc_percent(self, numerator_col: pd.Series, divisor_col: pd.Series) -> pd.Series:
         # divide the two columns, then multiply by 100 to get the percentage
@@ -233,7 +285,8 @@ class Tables():
         return result.multiply(100)
 
     # get the cpu_quota dataframe. If it is empty, generate it
-    def _get_cpu_quota(self, queries: dict[str, str] | None = None) -> pd.DataFrame:
+    def _get_cpu_quota(self, queries: dict[str, str] | None = None,
+                       results: dict[str, list[dict]] | None = None) -> pd.DataFrame:
         # check if the table has been filled in. If it has, return it
         if len(self.cpu_quota.index) > 0:
             return self.cpu_quota
@@ -243,7 +296,7 @@ class Tables():
 
         # if not, fill in the table then return it
         self.cpu_quota = self._fill_df_by_queries(
-            table_df=self.cpu_quota, queries=queries)
+            table_df=self.cpu_quota, queries=queries, results=results)
         # calculate each percent column by dividing the two columns
         # responsible for it then multiplying by 100
         self.cpu_quota['CPU Requests %'] = \
@@ -255,7 +308,8 @@ class Tables():
         return self.cpu_quota
 
     # get the mem_quota dataframe. If it is empty, generate it
-    def _get_mem_quota(self, queries: dict[str, str] | None = None) -> pd.DataFrame:
+    def _get_mem_quota(self, queries: dict[str, str] | None = None,
+                       results: dict[str, list[dict]] | None = None) -> pd.DataFrame:
         # check if the table has been filled in. If it has, return it
         if len(self.mem_quota.index) > 0:
             return self.mem_quota
@@ -265,7 +319,7 @@ class Tables():
 
         # if not, fill in the table then return it
         self.mem_quota = self._fill_df_by_queries(
-            table_df=self.mem_quota, queries=queries)
+            table_df=self.mem_quota, queries=queries, results=results)
         # calculate each percent column by dividing the two columns
         # responsible for it
         self.mem_quota['Memory Requests %'] = \
@@ -277,7 +331,8 @@ class Tables():
         return self.mem_quota
 
     # get the network_usage dataframe. If it is empty, generate it
-    def _get_network_usage(self, queries: dict[str, str] | None = None) -> pd.DataFrame:
+    def _get_network_usage(self, queries: dict[str, str] | None = None,
+                           results: dict[str, list[dict]] | None = None) -> pd.DataFrame:
         # check if the table has been filled in. If it has, return it
         if len(self.network_usage.index) > 0:
             return self.network_usage
@@ -287,11 +342,12 @@ class Tables():
 
         # if not, fill in the table then return it
         self.network_usage = self._fill_df_by_queries(
-            table_df=self.network_usage, queries=queries)
+            table_df=self.network_usage, queries=queries, results=results)
         return self.network_usage
 
     # get the storage_io dataframe. If it is empty, generate it
-    def _get_storage_io(self, partial_queries: dict[str, str] | None = None) -> pd.DataFrame:
+    def _get_storage_io(self, partial_queries: dict[str, str] | None = None,
+                        results: dict[str, list[dict]] | None = None) -> pd.DataFrame:
         # check if the table has been filled in. If it has, return it
         if len(self.storage_io.index) > 0:
             return self.storage_io
@@ -301,7 +357,7 @@ class Tables():
 
         # if not, fill in the table then return it
         self.storage_io = self._fill_df_by_queries(
-            table_df=self.storage_io, queries=partial_queries)
+            table_df=self.storage_io, queries=partial_queries, results=results)
         # calculate each sum column by adding the two columns responsible for it
         self.storage_io['IOPS(Reads + Writes)'] = \
             self.storage_io['IOPS(Reads)'].astype(
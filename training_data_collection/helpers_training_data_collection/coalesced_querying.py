@@ -0,0 +1,278 @@
+"""
+Coalesced querying for phase 3: the same columns as query_and_insert_columns() in query_resources.py,
+with far fewer queries.
+
+query_and_insert_columns() sends an instant query per metric, per duration column, per run. Runs that
+are close in time ask for mostly the same samples, so here every run's time window is collected first
+and the windows are merged into spans (see plan_spans()). For every span, each base metric (e.g.
+container_cpu_usage_seconds_total{namespace="..."}) is queried once for its raw samples, and each run's
+increase, max_over_time, or request value is worked out locally over its exact window, the same way
+prometheus does. The number of queries goes from runs * metrics * durations to spans * metrics.
+"""
+import sys
+import time
+from datetime import timedelta
+import numpy as np
+import pandas as pd
+from termcolor import colored
+from helpers_training_data_collection import query_resources
+from helpers_training_data_collection.query_resources import NAMESPACE, QUERY_BODIES, STATIC_METRICS
+from helpers.concurrency import run_concurrently, replace_failures
+from helpers.decoding import decode_matrix, format_value
+from helpers.printing import print_heading, print_title
+from helpers.querying import query_data
+from helpers.time_functions import calculate_eval_time, datetime_ify, delta_to_time_str, time_str_to_delta
+
+# Settings
+# longest time span to request raw samples for at once. Runs are only merged into a span up to this
+# length (a single run longer than it gets a span of its own)
+MAX_SPAN_SECONDS = 3 * 60 * 60
+# runs whose windows are at most this far apart are merged into the same span
+MAX_SPAN_GAP_SECONDS = 10 * 60
+# how far back an instant query looks for a sample (prometheus' default lookback delta)
+LOOKBACK_SECONDS = 5 * 60
+
+# the resource label of the static metrics, by the start of their names
+_STATIC_RESOURCES = {'cpu': 'cpu', 'mem': 'memory'}
+
+
+# given a metric (one of the keys in QUERY_BODIES), return (function, selector): the function applied
+# over each run's window ("increase", "max_over_time", or "last" for static metrics) and the selector of
+# its raw samples
+def get_metric_selector(metric: str) -> tuple[str, str]:
+    if metric not in QUERY_BODIES:
+        raise ValueError(
+            f'query metric "{metric}" must be within one of the following metrics:\n{QUERY_BODIES.keys()}')
+    if metric in STATIC_METRICS:
+        resource = _STATIC_RESOURCES[metric[:3]]
+        return "last", QUERY_BODIES[metric] + '{resource="' + resource + '", namespace="' + NAMESPACE + '"}'
+    function, metric_name = QUERY_BODIES[metric].split("(")
+    return function, metric_name + '{namespace="' + NAMESPACE + '"}'
+
+
+# given windows as (start, end) unix seconds, group them into spans of windows that overlap or are at most
+# max_gap_seconds apart, as long as the span is at most max_span_seconds long.
+# Returns a list of (span start, span end, list of the positions of its windows)
+def plan_spans(windows: list[tuple[float, float]], max_span_seconds: float = MAX_SPAN_SECONDS,
+               max_gap_seconds: float = MAX_SPAN_GAP_SECONDS) -> list[tuple[float, float, list[int]]]:
+    spans = []
+    for position in sorted(range(len(windows)), key=lambda i: windows[i]):
+        window_start, window_end = windows[position]
+        if spans:
+            span_start, span_end, positions = spans[-1]
+            new_end = max(span_end, window_end)
+            if window_start <= span_end + max_gap_seconds and new_end - span_start <= max_span_seconds:
+                spans[-1] = (span_start, new_end, positions + [position])
+                continue
+        spans.append((window_start, window_end, [position]))
+    return spans
+
+
+# increase() of one series over windows of its samples, like prometheus' extrapolatedRate().
+# times_ms and values are the series' samples, first and end are arrays with the position of the first
+# sample in each window and one past its last. Windows with fewer than 2 samples are NaN
+# pylint: disable=too-many-arguments,too-many-locals
+def extrapolated_increase(times_ms: np.ndarray, values: np.ndarray, first: np.ndarray, end: np.ndarray,
+                          range_start_ms: np.ndarray, range_end_ms: np.ndarray) -> np.ndarray:
+    result = np.full(len(first), np.nan)
+    valid = (end - first) >= 2
+    if not valid.any():
+        return result
+    first, last = first[valid], end[valid] - 1
+    # a counter reset (a drop in value) adds the value before the reset back
+    resets = np.zeros(len(values))
+    resets[1:] = np.where(values[1:] < values[:-1], values[:-1], 0.0)
+    cumulative_resets = np.concatenate([[0.0], np.cumsum(resets)])
+    increase = values[last] - values[first] + cumulative_resets[last + 1] - cumulative_resets[first + 1]
+
+    # extrapolate to the edges of the range, but not further than half an average sample interval
+    # past a gap, nor below zero at the start
+    first_value = values[first]
+    duration_to_start = (times_ms[first] - range_start_ms[valid]) / 1000
+    duration_to_end = (range_end_ms[valid] - times_ms[last]) / 1000
+    sampled_interval = (times_ms[last] - times_ms[first]) / 1000
+    average_interval = sampled_interval / (last - first)
+    threshold = average_interval * 1.1
+    duration_to_start = np.where(duration_to_start >= threshold, average_interval / 2, duration_to_start)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        duration_to_zero = np.where((increase > 0) & (first_value >= 0),
+                                    sampled_interval * (first_value / increase), np.inf)
+    duration_to_start = np.minimum(duration_to_start, duration_to_zero)
+    duration_to_end = np.where(duration_to_end >= threshold, average_interval / 2, duration_to_end)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        factor = (sampled_interval + duration_to_start + duration_to_end) / sampled_interval
+    result[valid] = increase * factor
+    return result
+
+
+# max_over_time() of one series over windows of its samples (see extrapolated_increase()).
+# Windows without samples are NaN
+def windowed_max(values: np.ndarray, first: np.ndarray, end: np.ndarray) -> np.ndarray:
+    return np.array([values[lo:hi].max() if hi > lo else np.nan for lo, hi in zip(first, end)])
+
+
+# the value an instant query would see for one series in each window (its last sample).
+# Windows without samples are NaN
+def windowed_last(values: np.ndarray, first: np.ndarray, end: np.ndarray) -> np.ndarray:
+    result = np.full(len(first), np.nan)
+    has_sample = end > first
+    result[has_sample] = values[end[has_sample] - 1]
+    return result
+
+
+# given a raw samples result list and windows as arrays of (start, end] in ms, return
+# 'sum by (node, pod) (function(samples over each window))' as a result list per window, in the same
+# format as an instant query's result. value_time is the timestamp of the returned values
+def evaluate_windows(result_list: list[dict], function: str, range_start_ms: np.ndarray,
+                     range_end_ms: np.ndarray, value_time: float) -> list[list[dict]]:
+    times_ms, values, _ = decode_matrix(result_list)
+    series_ends = np.cumsum([len(series['values']) for series in result_list])
+    sums = [{} for _ in range_start_ms]
+    for series, series_end, num_samples in zip(result_list, series_ends, np.diff(series_ends, prepend=0)):
+        series_times = times_ms[series_end - num_samples:series_end]
+        series_values = values[series_end - num_samples:series_end]
+        # the samples of each window: (range start, range end], found by binary search
+        first = np.searchsorted(series_times, range_start_ms, side='right')
+        end = np.searchsorted(series_times, range_end_ms, side='right')
+        if function == "increase":
+            window_values = extrapolated_increase(series_times, series_values, first, end,
+                                                  range_start_ms, range_end_ms)
+        elif function == "max_over_time":
+            window_values = windowed_max(series_values, first, end)
+        else:
+            window_values = windowed_last(series_values, first, end)
+
+        group = (series['metric'].get('node', ''), series['metric'].get('pod', ''))
+        for window_sums, value in zip(sums, window_values):
+            if not np.isnan(value):
+                window_sums[group] = window_sums.get(group, 0.0) + value
+
+    # empty labels are left out, like prometheus does
+    return [
+        [
+            {'metric': {name: label for name, label in zip(('node', 'pod'), group) if label != ''},
+             'value': [value_time, format_value(value)]}
+            for group, value in sorted(window_sums.items())
+        ]
+        for window_sums in sums
+    ]
+
+
+# a query for the raw samples of selector over (span_start, span_end]
+def get_span_query(selector: str, span_start: float, span_end: float) -> str:
+    range_seconds = int(np.ceil(span_end - span_start))
+    return selector + '[' + str(range_seconds) + 's] @ ' + f"{span_end:.3f}".rstrip("0").rstrip(".")
+
+
+# the (start, end] of the window of a run's query, in unix seconds, the same as the window
+# get_resource_query() would query over
+def get_run_window(start, duration_seconds) -> tuple[float, float]:
+    start = datetime_ify(start)
+    window_end = float(calculate_eval_time(start, duration_seconds))
+    # the duration is rounded to whole seconds in the query
+    duration = time_str_to_delta(delta_to_time_str(timedelta(seconds=duration_seconds))).total_seconds()
+    return window_end - duration, window_end
+
+
+# the eval times of a static metric's query and requery (see get_static_query_suffix())
+def get_static_eval_times(start, duration_seconds) -> tuple[float, float]:
+    start = datetime_ify(start)
+    return float(calculate_eval_time(start, 10)), float(calculate_eval_time(start, duration_seconds//2))
+
+
+# return the index labels of the rows to query for insert_col, the same ones insert_column() would query
+def _get_rows_to_query(df: pd.DataFrame, insert_col: str, n_rows: int) -> list:
+    if not df[insert_col].isna().any():
+        print(colored("\n\nNo NA rows", "yellow"))
+        return []
+    start_row = df[insert_col].isna().idxmax()
+    end_row = start_row + n_rows - 1
+    return [row for row in df.index if start_row <= row <= end_row]
+
+
+# query the raw samples of every metric in a span once, and return {cell position: result list} for
+# the span's cells. cells are (row, metric, column name, window, static eval times) tuples
+def _query_span(span: tuple[float, float, list[int]], cells: list[tuple]) -> dict[int, list[dict]]:
+    span_start, span_end, positions = span
+    results = {}
+    for metric in dict.fromkeys(cells[position][1] for position in positions):
+        metric_positions = [position for position in positions if cells[position][1] == metric]
+        function, selector = get_metric_selector(metric)
+        raw_samples = query_data(get_span_query(selector, span_start, span_end), title=metric)
+        value_time = round(time.time(), 3)
+        if function != "last":
+            windows = np.array([cells[position][3] for position in metric_positions])
+            window_results = evaluate_windows(raw_samples, function, np.rint(windows[:, 0] * 1000),
+                                              np.rint(windows[:, 1] * 1000), value_time)
+            results.update(zip(metric_positions, window_results))
+            continue
+        # static metrics are looked up 10 seconds in, and again halfway through the run if empty
+        for requery in (0, 1):
+            eval_times = np.array([cells[position][4][requery] for position in metric_positions])
+            window_results = evaluate_windows(raw_samples, function, np.rint((eval_times - LOOKBACK_SECONDS) * 1000),
+                                              np.rint(eval_times * 1000), value_time)
+            results.update(zip(metric_positions, window_results))
+            metric_positions = [position for position in metric_positions if results[position] == []]
+            if not metric_positions:
+                break
+
+    # When not verbose, print a '.' that, when done several times, gives a progress bar
+    if not query_resources.VERBOSE:
+        print(".", end="")
+        sys.stdout.flush()
+    return results
+
+
+# given a dataframe and groups of columns to insert, each a tuple of (metrics, column names, duration column)
+# like the arguments of query_and_insert_columns(), query the metrics for the next n_rows unqueried rows
+# of every column and return the updated dataframe. The columns are the same as query_and_insert_columns()
+# would insert, but the rows' windows are merged into spans and each metric is only queried once per span.
+# max_concurrency is how many spans to query at once (one at a time if None)
+def coalesced_query_and_insert_columns(df: pd.DataFrame, column_groups: list[tuple[list[str], list[str], str]],
+                                       n_rows: int, max_concurrency: int | None = None) -> pd.DataFrame:
+    # every cell to fill: (row, metric, column name, window (start, end) of its samples, static eval times)
+    cells = []
+    for metrics, col_names, duration_col in column_groups:
+        if len(metrics) != len(col_names):
+            raise ValueError(
+                "metrics and column names must be the same length with a 1 to 1 matching of metric to name")
+        for metric, col_name in zip(metrics, col_names):
+            if col_name not in df.columns:
+                df[col_name] = None
+            for row in _get_rows_to_query(df, col_name, n_rows):
+                start, duration_seconds = df.at[row, 'start'], df.at[row, duration_col]
+                # numpy numbers (e.g. int64) to python ones, like the rows of df.apply() in insert_column()
+                duration_seconds = getattr(duration_seconds, "item", lambda: duration_seconds)()
+                if metric in STATIC_METRICS:
+                    eval_times = get_static_eval_times(start, duration_seconds)
+                    window = (min(eval_times) - LOOKBACK_SECONDS, max(eval_times))
+                    cells.append((row, metric, col_name, window, eval_times))
+                else:
+                    cells.append((row, metric, col_name, get_run_window(start, duration_seconds), None))
+    if not cells:
+        return df
+
+    spans = plan_spans([cell[3] for cell in cells])
+    if query_resources.VERBOSE:
+        print_heading(f"Querying {len(cells)} cells in {len(spans)} time spans")
+    tasks = {span_number: (lambda span=span: _query_span(span, cells)) for span_number, span in enumerate(spans)}
+    if max_concurrency is None:
+        span_results = {span_number: task() for span_number, task in tasks.items()}
+    else:
+        # a span that failed leaves its cells unqueried, so they are queried again with the next batch
+        span_results = replace_failures(run_concurrently(tasks, max_concurrency=max_concurrency), default={})
+    results = {}
+    for span_result in span_results.values():
+        results.update(span_result)
+
+    # insert the results into their columns
+    for col_name in dict.fromkeys(cell[2] for cell in cells):
+        if query_resources.VERBOSE:
+            print_title(f"Inserting {col_name}")
+        column = df[col_name].astype(object).tolist()
+        for position, (row, _, cell_col_name, _, _) in enumerate(cells):
+            if cell_col_name == col_name and position in results:
+                column[df.index.get_loc(row)] = results[position]
+        df[col_name] = pd.Series(column, index=df.index, dtype=object)
+    print("")
+    return df
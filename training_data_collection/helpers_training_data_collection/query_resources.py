@@ -15,7 +15,7 @@ grandparent = os.path.dirname(parent)
 sys.path.append(grandparent)
 from helpers.querying import query_data
 from helpers.printing import print_heading, print_title
-from helpers.time_functions import delta_to_time_str, datetime_ify, calculate_offset
+from helpers.time_functions import delta_to_time_str, datetime_ify, calculate_eval_time
 # autopep8: on
 
 # Settings - You can edit these, especially NUM_ROWS, which is how many rows to generate per run
@@ -44,6 +44,20 @@ All that needs to be done is select NUM_ROWS to be the value you would like and
 CURRENT_ROW = 1  # for printing
 STATIC_METRICS = ["cpu_request", "mem_request"]
 VERBOSE = True
+# all resources and the heart of their queries
+QUERY_BODIES = {
+    # max over time metric
+    "mem_usage": "max_over_time(container_memory_working_set_bytes",
+    # static metrics
+    "cpu_request": "cluster:namespace:pod_cpu:active:kube_pod_container_resource_requests",
+    "mem_request": "cluster:namespace:pod_memory:active:kube_pod_container_resource_requests",
+    # increase metrics
+    "cpu_usage": "increase(container_cpu_usage_seconds_total",
+    "transmitted_packets": "increase(container_network_transmit_packets_total",
+    "received_packets": "increase(container_network_receive_packets_total",
+    "transmitted_bandwidth": "increase(container_network_transmit_bytes_total",
+    "received_bandwidth": "increase(container_network_receive_bytes_total"
+}
 # REQUEST_METRICS = ["cpu_request", "mem_request"]
 
 
@@ -93,14 +107,14 @@ def get_static_query_suffix(metric, start, duration_seconds, requery=False):
     # static metrics only need to be requested for one datapoint
     if requery:
         # query at halfway through the run
-        offset = calculate_offset(start, duration_seconds//2)
+        eval_time = calculate_eval_time(start, duration_seconds//2)
     else:
         # query at the beginning of the run (10 seconds in)
-        offset = calculate_offset(start, 10)
+        eval_time = calculate_eval_time(start, 10)
 
     suffixes = {
-        'cpu': '{resource="cpu", namespace="' + NAMESPACE + '"} offset ' + str(offset) + ')',
-        'mem': '{resource="memory", namespace="' + NAMESPACE + '"} offset ' + str(offset) + ')'
+        'cpu': '{resource="cpu", namespace="' + NAMESPACE + '"} @ ' + eval_time + ')',
+        'mem': '{resource="memory", namespace="' + NAMESPACE + '"} @ ' + eval_time + ')'
     }
 
     resource = metric[:3]  # either cpu or mem
@@ -109,26 +123,11 @@ def get_static_query_suffix(metric, start, duration_seconds, requery=False):
     return suffix
 
 
-# given a metric (one of the keys in query_bodies), start (datetime), and duration (float)
+# given a metric (one of the keys in QUERY_BODIES), start (datetime), and duration (float)
 # return a query for the metric over the given duration of the run
 def get_resource_query(metric, start, duration_seconds, is_static_metric, requery=False):
-    # all resources and the heart of their queries
-    query_bodies = {
-        # max over time metric
-        "mem_usage": "max_over_time(container_memory_working_set_bytes",
-        # static metrics
-        "cpu_request": "cluster:namespace:pod_cpu:active:kube_pod_container_resource_requests",
-        "mem_request": "cluster:namespace:pod_memory:active:kube_pod_container_resource_requests",
-        # increase metrics
-        "cpu_usage": "increase(container_cpu_usage_seconds_total",
-        "transmitted_packets": "increase(container_network_transmit_packets_total",
-        "received_packets": "increase(container_network_receive_packets_total",
-        "transmitted_bandwidth": "increase(container_network_transmit_bytes_total",
-        "received_bandwidth": "increase(container_network_receive_bytes_total"
-    }
-
     # check proper user inputs
-    metrics = query_bodies.keys()
+    metrics = QUERY_BODIES.keys()
     if metric not in metrics:
         raise ValueError(
             f'query metric "{metric}" must be within one of the following metrics:\n{metrics}')
@@ -138,10 +137,10 @@ def get_resource_query(metric, start, duration_seconds, is_static_metric, requer
             "Can only requery static metrics - requery can only be True if is_static_metric is True")
 
     # get all the pieces necessary to assemble the query
-    offset = calculate_offset(start, duration_seconds)
+    eval_time = calculate_eval_time(start, duration_seconds)
     duration = delta_to_time_str(timedelta(seconds=duration_seconds))
     suffix = '{namespace="' + NAMESPACE + \
-        '"}[' + str(duration) + '] offset ' + str(offset) + '))'
+        '"}[' + str(duration) + '] @ ' + eval_time + '))'
     prefix = 'sum by (node, pod) ('
 
     # static metrics have a different suffix. Update suffix if metric is a static metric
@@ -151,7 +150,7 @@ def get_resource_query(metric, start, duration_seconds, is_static_metric, requer
             metric, start, duration_seconds, requery=requery)
 
     # assemble the final query
-    query = prefix + query_bodies[metric] + suffix
+    query = prefix + QUERY_BODIES[metric] + suffix
     return query
 
 
@@ -165,7 +164,7 @@ def query_resource(metric, start, duration_seconds, row_index, n_rows):
     start = datetime_ify(start)
     query = get_resource_query(
         metric, start, duration_seconds, is_static_metric)
-    resource_data = query_data(query)
+    resource_data = query_data(query, title=metric)
 
     # print row information
     global CURRENT_ROW
@@ -179,7 +178,7 @@ def query_resource(metric, start, duration_seconds, row_index, n_rows):
     if is_static_metric and (resource_data == []):
         query = get_resource_query(
             metric, start, duration_seconds, is_static_metric, requery=True)
-        resource_data = query_data(query)
+        resource_data = query_data(query, title=metric)
 
     # When not verbose, print a '.' that, when done several times, gives a progress bar
     if not VERBOSE:
@@ -352,7 +351,7 @@ if __name__ == "__main__":
             training_data[col_name] = None
 
     # query everything and insert the new columns into the dataframe, saving after each insertion
-    # insert columns for static metrics (duration=runtime - just for calculating offset)
+    # insert columns for static metrics (duration=runtime - just for calculating eval time)
     training_data = query_and_insert_columns(
         training_data, STATIC_METRICS, col_names_static, duration_col_total, NUM_ROWS)
     # in case program gets stopped before finishing, save partial progress
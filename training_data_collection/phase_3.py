@@ -9,6 +9,7 @@ from termcolor import colored
 from workflow_files import PHASE_3_FILES
 from metrics_and_columns_setup import GET_METRICS, GET_DURATION_COLS, GET_COL_NAMES
 from helpers_training_data_collection.query_resources import query_and_insert_columns, set_verbose
+from helpers_training_data_collection.coalesced_querying import coalesced_query_and_insert_columns
 
 # display settings
 pd.set_option("display.max_columns", None)
@@ -21,10 +22,14 @@ class Phase_3():
     This class implements step 3 of automatic training data collection: querying performance metrics
     When using this class, specify the input parameters and then call the `run` method.
     """
+    # coalesce_queries: query each metric once per span of overlapping runs in a batch and work out every
+    # run's values locally, instead of one query per metric, duration column, and run (see coalesced_querying.py)
     # files are only read, so pylint: disable=dangerous-default-value
-    def __init__(self, verbose: bool = True, files: dict[str, str] = PHASE_3_FILES) -> None:
+    def __init__(self, verbose: bool = True, files: dict[str, str] = PHASE_3_FILES,
+                 coalesce_queries: bool = False) -> None:
         self.verbose = verbose
         self.files = files
+        self.coalesce_queries = coalesce_queries
         # metrics (to be queried)
         metrics = GET_METRICS()
         self.all_metrics = metrics["all"]
@@ -45,6 +50,7 @@ class Phase_3():
 
     # runs the whole phase. Returns True if successful, False otherwise
     # Note: number of queries = rows_batch_size * 15, so it is better to choose a small number (e.g. 10) for more frequent saving
+    # With coalesce_queries, it is about 8 per span of overlapping runs in a batch, so bigger batches save more queries
     def run(self, rows_batch_size: int = 10, verbose_status: bool = False) -> bool:
         success = False
 
@@ -87,6 +93,15 @@ class Phase_3():
         first_non_queried_row = is_unqueried_series.idxmax()
         return first_non_queried_row
 
+    # return every (metrics, column names, duration column) to query for, in the order query_metrics() queries them
+    def _get_column_groups(self) -> list[tuple[list[str], list[str], str]]:
+        column_groups = [(self.static_metrics, self.col_names_static, self.duration_col_total)]
+        for i in range(1, self.num_duration_cols+1):
+            col_names_t_i = [name for name in self.col_names_by_time if name[-1] == str(i)]
+            column_groups.append((self.non_static_metrics, col_names_t_i, self.duration_col_names[i-1]))
+        column_groups.append((self.totals_metrics, self.col_names_total, self.duration_col_total))
+        return column_groups
+
     # given:
         # df - a dataframe
         # batch_size - number of rows to query at a time until the df is filled out
@@ -125,6 +140,12 @@ class Phase_3():
         while not isinstance(df[self.col_names_total[-1]].iloc[len(df) - 1], (list, str)):
             self._print_if_verbose(
                 f"\nbatch {batch_number} / {total_batches}:")
+            if self.coalesce_queries:
+                # query every column of the batch at once
+                df = coalesced_query_and_insert_columns(df, self._get_column_groups(), batch_size)
+                batch_number += 1
+                df.to_csv(self.files['query_progress'])
+                continue
             # query and insert static columns
             df = query_and_insert_columns(
                 df, self.static_metrics, self.col_names_static, self.duration_col_total, batch_size)
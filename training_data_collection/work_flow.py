@@ -8,6 +8,8 @@ from phase_4 import Phase_4
 from metrics_and_columns_setup import include_all_totals_metrics
 from work_flow_functions import (
     is_phase_finished, set_phase_finished, display_new_run_prompt, prompt_helitack_status)
+# the phases add the parent directory to the path, so helpers can be imported after them
+from helpers.telemetry import telemetry_stage  # pylint: disable=wrong-import-order
 
 # display settings
 pd.set_option("display.max_columns", None)
@@ -80,7 +82,9 @@ for i, phase in enumerate(phases):
     else:
         # Run the phase and see what the resulting success flag is
         print(colored(f"\n\nBeginning Phase {phase_number}...", "magenta"))
-        success = phase.run()
+        # every query the phase sends is recorded in query telemetry under this stage
+        with telemetry_stage(f"phase_{phase_number}"):
+            success = phase.run()
         if not success:
             print(
                 colored(f"\nProgram stop caused by phase {phase_number}\n", "magenta"))
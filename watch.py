@@ -0,0 +1,204 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+import time
+import shutil
+from datetime import datetime
+from typing import Callable
+import pandas as pd
+from termcolor import colored
+from header import Header
+from tables import Tables
+from graphs import Graphs
+from helpers.query_planner import QueryPlanner
+from helpers.rolling_buffers import SeriesBuffers
+from helpers.printing import print_heading, print_sub_title, print_dataframe_dict
+from helpers.time_functions import time_str_to_delta, find_time_from_offset
+from inputs import (NAMESPACE, DEFAULT_GRAPH_TIME_OFFSET, DEFAULT_GRAPH_STEP, QUERY_TIMEOUT_SEC,
+                    WATCH_INTERVAL_SEC, WATCH_BUFFER_CAPACITY)
+
+
+class Watcher():
+    """Keeps a live view of a namespace's header, tables, and graphs, refreshed every interval_sec
+
+    The header and tables are re-queried every refresh (they are instant queries). Graphs are only
+    queried for the time since the last refresh, and the new samples are appended to a rolling
+    buffer of buffer_capacity samples per series, so a refresh costs the same no matter how long
+    the graph window is. Every refresh, the rows of the header and tables that changed and the new
+    graph samples are passed to callback (printed to the console by default).
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, namespace: str = NAMESPACE, interval_sec: float = WATCH_INTERVAL_SEC,
+                 time_offset: str = DEFAULT_GRAPH_TIME_OFFSET, time_step: str = DEFAULT_GRAPH_STEP,
+                 buffer_capacity: int | None = WATCH_BUFFER_CAPACITY, only_include_worker_pods: bool = False,
+                 max_concurrency: int | None = None, callback: Callable[[dict], None] | None = None,
+                 query_timeout_seconds: int = QUERY_TIMEOUT_SEC) -> None:
+        self.interval_sec = interval_sec
+        self.only_include_worker_pods = only_include_worker_pods
+        self.max_concurrency = max_concurrency
+        self.callback = callback if callback is not None else print_update
+        self.header = Header(namespace=namespace, query_timeout_seconds=query_timeout_seconds)
+        self.tables = Tables(namespace=namespace, query_timeout_seconds=query_timeout_seconds)
+        self.graphs = Graphs(namespace=namespace, time_offset=time_offset, time_step=time_step,
+                             query_timeout_seconds=query_timeout_seconds)
+
+        self.step_seconds = time_str_to_delta(time_step).total_seconds()
+        # by default, keep enough samples per series to cover the whole graph window
+        if buffer_capacity is None:
+            buffer_capacity = int(time_str_to_delta(time_offset).total_seconds() // self.step_seconds) + 1
+        self.buffer_capacity = buffer_capacity
+
+        # the latest header and tables, and a rolling buffer for every graph
+        self.header_dict = {}
+        self.tables_dict = {}
+        self.graph_buffers = {}
+        # unix time of the first graph point that hasn't been queried yet
+        self._next_graph_start = None
+
+    # refresh every interval_sec until stopped (ctrl+c) or until iterations refreshes have been done.
+    # A refresh that fails prints a warning and is tried again at the next interval
+    def run(self, iterations: int | None = None) -> None:
+        num_refreshes = 0
+        try:
+            while iterations is None or num_refreshes < iterations:
+                refresh_start = time.monotonic()
+                try:
+                    self.refresh()
+                # pylint: disable=broad-exception-caught
+                except Exception as exc:
+                    print(colored(f"\nRefresh failed ({exc!r}), trying again in {self.interval_sec} seconds", "yellow"))
+                num_refreshes += 1
+                if iterations is not None and num_refreshes >= iterations:
+                    break
+                time.sleep(max(0.0, self.interval_sec - (time.monotonic() - refresh_start)))
+        except KeyboardInterrupt:
+            print("\nStopped watching")
+
+    # query everything that is new since the last refresh, pass the update to the callback, and return it.
+    # The update is a dict of:
+    #   'time': when the refresh happened
+    #   'header' and 'tables': {title: dataframe of the rows that are new or changed since the last refresh}
+    #   'graphs': {title: dataframe of the new samples of every series}
+    def refresh(self, now: datetime | None = None) -> dict:
+        if now is None:
+            now = datetime.now()
+        header_changes, tables_changes = self._refresh_header_and_tables()
+        update = {
+            'time': now,
+            'header': header_changes,
+            'tables': tables_changes,
+            'graphs': self._refresh_graphs(now)
+        }
+        self.callback(update)
+        return update
+
+    # the latest header dict
+    def get_header_dict(self) -> dict[str, pd.DataFrame]:
+        return self.header_dict
+
+    # the latest tables dict
+    def get_tables_dict(self) -> dict[str, pd.DataFrame]:
+        return self.tables_dict
+
+    # the graphs of every sample in the rolling buffers, in the same format as Graphs.get_graphs_dict()
+    def get_graphs_dict(self, display_time_as_datetime: bool = True) -> dict[str, pd.DataFrame]:
+        graphs_dict = {}
+        for title, buffers in self.graph_buffers.items():
+            graph_df = buffers.to_df()
+            if display_time_as_datetime:
+                graph_df['Time'] = pd.to_datetime(graph_df['Time'], unit="s")
+            graphs_dict[title] = graph_df
+        return graphs_dict
+
+    # re-query the header and tables (planned together so shared series are only queried once).
+    # Returns ({header title: changed rows}, {table title: changed rows})
+    def _refresh_header_and_tables(self) -> tuple[dict[str, pd.DataFrame], dict[str, pd.DataFrame]]:
+        tables_queries, tables_partial_queries = self.tables.get_queries(
+            only_include_worker_pods=self.only_include_worker_pods)
+        planner = QueryPlanner(timeout_sec=self.tables.query_timeout_seconds)
+        planner.add_queries('tables', {**tables_queries, **tables_partial_queries})
+        planner.add_queries('header', self.header.get_queries(only_include_worker_pods=self.only_include_worker_pods))
+        # refreshes have to see the latest values, so they never come from the cache
+        results = planner.execute(max_concurrency=self.max_concurrency, multiplex=self.tables.multiplex_queries,
+                                  use_cache=False, progress_bars=False)
+
+        header_dict = self.header.get_header_dict(
+            only_include_worker_pods=self.only_include_worker_pods, results=results.get('header', {}))
+        # the tables keep what they were filled in with, so empty them to fill them in again
+        self.tables.clear_tables()
+        tables_dict = self.tables.get_tables_dict(
+            only_include_worker_pods=self.only_include_worker_pods, results=results.get('tables', {}))
+
+        header_changes = {title: get_changed_rows(self.header_dict.get(title), df) for title, df in header_dict.items()}
+        tables_changes = {title: get_changed_rows(self.tables_dict.get(title), df) for title, df in tables_dict.items()}
+        self.header_dict = header_dict
+        self.tables_dict = tables_dict
+        return header_changes, tables_changes
+
+    # query the graphs from the last queried point up to now and append the samples to the rolling buffers.
+    # Returns {title: new samples}
+    def _refresh_graphs(self, now: datetime) -> dict[str, pd.DataFrame]:
+        # the first refresh queries the whole window, later ones continue on the same grid of steps
+        if self._next_graph_start is None:
+            start = find_time_from_offset(end=now, offset=self.graphs.time_offset)
+        else:
+            start = datetime.fromtimestamp(self._next_graph_start)
+            if start > now:  # no new point since the last refresh
+                return {}
+
+        # like the header and tables, refreshes have to see the latest samples, so they never come from
+        # the cache or the series store. Refreshes run every tick, so they don't print progress bars
+        graphs_dict = self.graphs.get_graphs_dict(
+            only_include_worker_pods=self.only_include_worker_pods, display_time_as_datetime=False,
+            max_concurrency=self.max_concurrency, start=start, end=now, use_cache=False, progress_bars=False)
+        num_steps = (now - start).total_seconds() // self.step_seconds
+        self._next_graph_start = start.timestamp() + (num_steps + 1) * self.step_seconds
+
+        # series (e.g. pods) without a sample in the whole window are dropped
+        oldest_time = self._next_graph_start - self.buffer_capacity * self.step_seconds
+        new_samples = {}
+        for title, graph_df in graphs_dict.items():
+            if title not in self.graph_buffers:
+                self.graph_buffers[title] = SeriesBuffers(self.buffer_capacity, value_title=title)
+            new_samples[title] = self.graph_buffers[title].append_df(graph_df)
+            self.graph_buffers[title].drop_older_than(oldest_time)
+        return new_samples
+
+
+# given the previous and current version of a header item or table, return the rows of current that
+# are new or have a different value than in previous. If there is no previous version, every row is returned
+def get_changed_rows(previous: pd.DataFrame | None, current: pd.DataFrame) -> pd.DataFrame:
+    if previous is None or len(previous) == 0 or len(current) == 0 or list(previous.columns) != list(current.columns):
+        return current
+    merged = current.merge(previous.drop_duplicates(), how='left', on=list(current.columns), indicator=True)
+    return current[(merged['_merge'] == 'left_only').to_numpy()]
+
+
+# print the rows and samples of an update from Watcher.refresh() to the console (the default callback)
+def print_update(update: dict) -> None:
+    print_heading(f"Update at {update['time']:%Y-%m-%d %H:%M:%S}")
+    for section in ['header', 'tables', 'graphs']:
+        changes = {title: df for title, df in update[section].items() if df is not None and len(df) > 0}
+        print_sub_title(f"{section.title()} ({len(changes)} changed)")
+        if section == 'graphs':
+            changes = {title: df.assign(Time=pd.to_datetime(df['Time'], unit="s")) for title, df in changes.items()}
+        print_dataframe_dict(changes)
+
+
+# ============================
+#         Main Program
+# ============================
+
+
+if __name__ == "__main__":
+    # display settings
+    pd.set_option("display.max_columns", None)
+    pd.set_option('display.width', shutil.get_terminal_size().columns)
+
+    watcher = Watcher(
+        # only includes bp3d-worker pods and changes their name to be just their ensemble id
+        only_include_worker_pods=False,
+        # number of queries to send at once. None sends them one at a time.
+        max_concurrency=None
+    )
+    watcher.run()